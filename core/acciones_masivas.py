@@ -0,0 +1,205 @@
+# core/acciones_masivas.py
+"""
+Acciones masivas del admin.
+
+Cada acción se registra con ``@accion_masiva(nombre, modelo)`` y recibe un
+QuerySet de un bloque de filas. Hace un UPDATE con expresiones F (sin cargar
+los objetos) y devuelve el número de filas que cambiaron. ``ejecutar``
+recorre los ids por bloques de ACCIONES_TAMANO_BLOQUE en una transacción.
+Si la selección pasa de ACCIONES_MAX_SINCRONO filas (por ejemplo, "seleccionar
+las 80.000"), el admin la guarda como TareaMasiva con ``encolar``. El comando
+procesar_tareas la ejecuta después, con una transacción por bloque que
+guarda también el progreso. Si el worker muere, la tarea sigue desde el
+último bloque confirmado.
+
+update() no envía señales: cada acción invalida a mano la cache de páginas
+y sincroniza las columnas desnormalizadas de Carta.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache_paginas import invalidar_etiquetas
+from .models import Carta, Inventario, Resena, TareaMasiva
+
+# nombre -> (modelo, función que recibe el QuerySet de un bloque)
+ACCIONES = {}
+
+
+class TareaReclamada(Exception):
+    """Otro worker avanzó la tarea: este debe dejarla sin tocar su estado"""
+
+
+def _tamano_bloque():
+    return getattr(settings, 'ACCIONES_TAMANO_BLOQUE', 1000)
+
+
+def _max_sincrono():
+    return getattr(settings, 'ACCIONES_MAX_SINCRONO', 2000)
+
+
+def _segundos_bloqueo():
+    return getattr(settings, 'ACCIONES_SEGUNDOS_BLOQUEO', 300)
+
+
+def accion_masiva(nombre, modelo):
+    """Registra una función como acción masiva sobre ``modelo``"""
+    def decorator(funcion):
+        ACCIONES[nombre] = (modelo, funcion)
+        return funcion
+    return decorator
+
+
+def _bloques(ids, tamano):
+    for inicio in range(0, len(ids), tamano):
+        yield ids[inicio:inicio + tamano]
+
+
+def _ejecutar_bloque(nombre, ids):
+    modelo, funcion = ACCIONES[nombre]
+    return funcion(modelo.objects.filter(pk__in=ids))
+
+
+def es_sincrona(total):
+    """¿Se puede hacer en la petición o va a una tarea en segundo plano?"""
+    return total <= _max_sincrono()
+
+
+def ejecutar(nombre, ids, tamano_bloque=None):
+    """Aplica la acción a todos los ids en una transacción; devuelve las filas afectadas"""
+    tamano_bloque = tamano_bloque or _tamano_bloque()
+    afectados = 0
+    with transaction.atomic():
+        for bloque in _bloques(list(ids), tamano_bloque):
+            afectados += _ejecutar_bloque(nombre, bloque)
+    return afectados
+
+
+def encolar(nombre, ids, usuario=None):
+    """Guarda la selección como TareaMasiva para procesar_tareas"""
+    if nombre not in ACCIONES:
+        raise ValueError(f'Acción masiva desconocida: {nombre}')
+    ids = list(ids)
+    return TareaMasiva.objects.create(accion=nombre, usuario=usuario, ids=ids, total=len(ids))
+
+
+def tomar_tarea():
+    """
+    Reclama una tarea pendiente, o una en curso cuyo worker dejó de avanzar
+    hace más de ACCIONES_SEGUNDOS_BLOQUEO. Devuelve None si no hay
+    """
+    abandonadas = timezone.now() - timedelta(seconds=_segundos_bloqueo())
+    candidatas = TareaMasiva.objects.filter(
+        Q(estado=TareaMasiva.PENDIENTE)
+        | Q(estado=TareaMasiva.EN_CURSO, fecha_actualizacion__lt=abandonadas)
+    ).order_by('id')
+    for tarea in candidatas[:5]:
+        # UPDATE condicional: si otro worker la tomó antes no cambia ninguna fila
+        tomada = TareaMasiva.objects.filter(
+            pk=tarea.pk, estado=tarea.estado, fecha_actualizacion=tarea.fecha_actualizacion
+        ).update(estado=TareaMasiva.EN_CURSO, fecha_actualizacion=timezone.now())
+        if tomada:
+            tarea.refresh_from_db()
+            return tarea
+    return None
+
+
+def procesar_tarea(tarea, tamano_bloque=None, progreso=None):
+    """
+    Ejecuta lo que queda de la tarea bloque a bloque. Cada bloque se confirma
+    junto con el avance, así que no se aplica dos veces al reanudar. Lanza
+    TareaReclamada si otro worker la avanzó entretanto.
+    ``progreso(tarea)`` se llama tras cada bloque
+    """
+    tamano_bloque = tamano_bloque or _tamano_bloque()
+    try:
+        for bloque in _bloques(tarea.ids[tarea.procesados:], tamano_bloque):
+            with transaction.atomic():
+                filas = _ejecutar_bloque(tarea.accion, bloque)
+                # Solo avanza si nadie más lo hizo: si otro worker reclamó la tarea
+                # (este se quedó parado más de ACCIONES_SEGUNDOS_BLOQUEO), el bloque
+                # se deshace y este worker se retira
+                avanzada = TareaMasiva.objects.filter(pk=tarea.pk, procesados=tarea.procesados).update(
+                    procesados=F('procesados') + len(bloque),
+                    afectados=F('afectados') + filas,
+                    fecha_actualizacion=timezone.now(),
+                )
+                if not avanzada:
+                    raise TareaReclamada(f'La tarea {tarea.pk} la está procesando otro worker')
+            tarea.procesados += len(bloque)
+            tarea.afectados += filas
+            if progreso:
+                progreso(tarea)
+    except TareaReclamada:
+        raise
+    except Exception as e:
+        TareaMasiva.objects.filter(pk=tarea.pk, procesados=tarea.procesados).update(
+            estado=TareaMasiva.ERROR, error=repr(e), fecha_actualizacion=timezone.now(),
+        )
+        tarea.estado = TareaMasiva.ERROR
+        raise
+    ahora = timezone.now()
+    TareaMasiva.objects.filter(pk=tarea.pk, procesados=tarea.procesados).update(
+        estado=TareaMasiva.TERMINADA, fecha_fin=ahora, fecha_actualizacion=ahora,
+    )
+    tarea.estado = TareaMasiva.TERMINADA
+    return tarea
+
+
+# =========== ACCIONES ===========
+
+def _invalidar_cartas(cartas):
+    """Invalida al confirmar el catálogo y las páginas de las cartas del QuerySet"""
+    etiquetas = {'catalogo'}
+    for carta_id, expansion_id in cartas.values_list('pk', 'expansion_id'):
+        etiquetas |= {f'carta:{carta_id}', f'expansion:{expansion_id}'}
+    transaction.on_commit(lambda: invalidar_etiquetas(*etiquetas))
+
+
+@accion_masiva('carta.aumentar_popularidad', Carta)
+def aumentar_popularidad(cartas):
+    filas = cartas.update(popularidad=F('popularidad') + 10)
+    _invalidar_cartas(cartas)
+    return filas
+
+
+def _cambiar_promocion(inventarios, activa):
+    # Solo se escriben las filas que cambian: el recuento es el real
+    filas = inventarios.exclude(en_promocion=activa).update(en_promocion=activa)
+    if filas:
+        # El precio vigente de la carta depende de la promoción
+        cartas = Carta.objects.filter(inventario__in=inventarios)
+        cartas.sincronizar_inventario()
+        _invalidar_cartas(cartas)
+    return filas
+
+
+@accion_masiva('inventario.activar_promocion', Inventario)
+def activar_promocion(inventarios):
+    return _cambiar_promocion(inventarios, True)
+
+
+@accion_masiva('inventario.desactivar_promocion', Inventario)
+def desactivar_promocion(inventarios):
+    return _cambiar_promocion(inventarios, False)
+
+
+def _cambiar_aprobacion(resenas, aprobada):
+    filas = resenas.exclude(aprobada=aprobada).update(aprobada=aprobada)
+    if filas:
+        etiquetas = {f'carta:{carta_id}' for carta_id in resenas.values_list('carta_id', flat=True)}
+        transaction.on_commit(lambda: invalidar_etiquetas(*etiquetas))
+    return filas
+
+
+@accion_masiva('resena.aprobar', Resena)
+def aprobar_resenas(resenas):
+    return _cambiar_aprobacion(resenas, True)
+
+
+@accion_masiva('resena.rechazar', Resena)
+def rechazar_resenas(resenas):
+    return _cambiar_aprobacion(resenas, False)
@@ -1,37 +1,78 @@
 # core/admin.py
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
-from django.db.models import Count, Sum, Avg
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
 from .models import (
     Categoria, Expansion, Carta, Inventario,
-    Pedido, ItemPedido, Resena, Coleccion, ColeccionCarta
+    Pedido, ItemPedido, Resena, Coleccion, ColeccionCarta, EventoOutbox, TareaMasiva
 )
+from . import acciones_masivas
+from .paginacion import PaginadorConteoCache
+from .pedidos import transicionar, PAGADO, ENVIADO, ENTREGADO, CANCELADO
+from .valoracion import valorar_colecciones
+
+
+# =========== BASE ===========
+class AdminPaginado(admin.ModelAdmin):
+    """
+    Listados con consultas fijas: los recuentos por fila salen de anotaciones
+    en get_queryset, las relaciones de list_select_related y el total del
+    paginador de la cache (sin el COUNT de la tabla completa al filtrar)
+    """
+    paginator = PaginadorConteoCache
+    show_full_result_count = False
+    
+    def _accion_masiva(self, request, queryset, accion, texto):
+        """
+        Ejecuta una acción de core/acciones_masivas.py sobre la selección: en
+        la petición si es pequeña, como TareaMasiva en segundo plano si no
+        """
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        if acciones_masivas.es_sincrona(len(ids)):
+            afectados = acciones_masivas.ejecutar(accion, ids)
+            self.message_user(request, f'{afectados} {texto}')
+            return
+        tarea = acciones_masivas.encolar(accion, ids, usuario=request.user)
+        url = reverse('admin:core_tareamasiva_change', args=[tarea.pk])
+        self.message_user(request, format_html(
+            '{} elementos en cola: <a href="{}">tarea #{}</a> (procesar_tareas)', len(ids), url, tarea.pk,
+        ), messages.INFO)
 
 
 # =========== CATEGORIA ===========
 @admin.register(Categoria)
-class CategoriaAdmin(admin.ModelAdmin):
+class CategoriaAdmin(AdminPaginado):
     list_display = ['nombre', 'get_total_cartas', 'fecha_creacion']
     search_fields = ['nombre', 'descripcion']
     readonly_fields = ['fecha_creacion', 'get_total_cartas']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_cartas=Count('cartas'))
+    
     def get_total_cartas(self, obj):
-        return obj.cartas.count()
+        return obj.num_cartas
     get_total_cartas.short_description = 'Total Cartas'
+    get_total_cartas.admin_order_field = 'num_cartas'
 
 
 # =========== EXPANSION ===========
 @admin.register(Expansion)
-class ExpansionAdmin(admin.ModelAdmin):
+class ExpansionAdmin(AdminPaginado):
     list_display = ['codigo', 'nombre', 'fecha_lanzamiento', 'get_cartas_count', 'activa', 'get_simbolo']
     list_filter = ['activa', 'fecha_lanzamiento']
     search_fields = ['codigo', 'nombre']
     readonly_fields = ['get_cartas_count', 'get_simbolo']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_cartas=Count('cartas'))
+    
     def get_cartas_count(self, obj):
-        return obj.cartas.count()
+        return obj.num_cartas
     get_cartas_count.short_description = 'Cartas'
+    get_cartas_count.admin_order_field = 'num_cartas'
     
     def get_simbolo(self, obj):
         if obj.simbolo:
@@ -50,13 +91,14 @@ class InventarioInline(admin.StackedInline):
 
 # =========== CARTA ===========
 @admin.register(Carta)
-class CartaAdmin(admin.ModelAdmin):
+class CartaAdmin(AdminPaginado):
     list_display = [
         'get_miniatura', 'codigo', 'nombre', 'expansion',
         'get_tipo', 'rareza', 'get_precio_estimado', 'coleccionable'
     ]
     list_filter = ['tipo', 'rareza', 'expansion', 'coleccionable']
     search_fields = ['codigo', 'nombre', 'descripcion', 'expansion__nombre']
+    list_select_related = ['expansion']
     readonly_fields = [
         'fecha_creacion', 'fecha_actualizacion',
         'get_precio_estimado', 'get_preview', 'popularidad'
@@ -116,20 +158,19 @@ class CartaAdmin(admin.ModelAdmin):
     actions = ['aumentar_popularidad']
     
     def aumentar_popularidad(self, request, queryset):
-        for carta in queryset:
-            carta.aumentar_popularidad(10)
-        self.message_user(request, f'Popularidad aumentada para {queryset.count()} cartas')
+        self._accion_masiva(request, queryset, 'carta.aumentar_popularidad', 'cartas con más popularidad')
 
 
 # =========== INVENTARIO ===========
 @admin.register(Inventario)
-class InventarioAdmin(admin.ModelAdmin):
+class InventarioAdmin(AdminPaginado):
     list_display = [
         'get_carta', 'precio_actual', 'stock_real',
         'vendidos_total', 'valoracion_promedio', 'en_promocion'
     ]
     list_filter = ['en_promocion', 'fecha_ingreso']
     search_fields = ['carta__nombre', 'carta__codigo']
+    list_select_related = ['carta']
     readonly_fields = [
         'stock_real', 'disponible', 'ultima_actualizacion',
         'precio_actual', 'get_carta_link'
@@ -165,12 +206,10 @@ class InventarioAdmin(admin.ModelAdmin):
     actions = ['activar_promocion', 'desactivar_promocion']
     
     def activar_promocion(self, request, queryset):
-        queryset.update(en_promocion=True)
-        self.message_user(request, f'{queryset.count()} productos en promoción')
+        self._accion_masiva(request, queryset, 'inventario.activar_promocion', 'productos en promoción')
     
     def desactivar_promocion(self, request, queryset):
-        queryset.update(en_promocion=False)
-        self.message_user(request, f'{queryset.count()} productos fuera de promoción')
+        self._accion_masiva(request, queryset, 'inventario.desactivar_promocion', 'productos fuera de promoción')
 
 
 # =========== ITEM PEDIDO INLINE ===========
@@ -197,17 +236,18 @@ class ItemPedidoInline(admin.TabularInline):
 
 # =========== PEDIDO ===========
 @admin.register(Pedido)
-class PedidoAdmin(admin.ModelAdmin):
+class PedidoAdmin(AdminPaginado):
     list_display = [
         'numero_pedido', 'cliente', 'estado', 'fecha_pedido',
-        'get_subtotal', 'get_total', 'cantidad_items'
+        'get_subtotal', 'get_total', 'get_cantidad_items'
     ]
     list_filter = ['estado', 'fecha_pedido', 'metodo_pago']
     search_fields = ['numero_pedido', 'cliente__username', 'cliente__email', 'nombre_completo']
+    list_select_related = ['cliente']
     readonly_fields = [
         'numero_pedido', 'fecha_pedido', 'fecha_pago', 'fecha_envio', 'fecha_entrega',
         'get_subtotal', 'get_envio', 'get_impuestos', 'get_total',
-        'cantidad_items', 'envio_gratis'
+        'get_cantidad_items', 'envio_gratis'
     ]
     inlines = [ItemPedidoInline]
     
@@ -230,7 +270,7 @@ class PedidoAdmin(admin.ModelAdmin):
         ('Totales', {
             'fields': (
                 'get_subtotal', 'get_envio', 'get_impuestos',
-                'get_total', 'cantidad_items', 'envio_gratis'
+                'get_total', 'get_cantidad_items', 'envio_gratis'
             )
         }),
         ('Notas', {
@@ -255,37 +295,53 @@ class PedidoAdmin(admin.ModelAdmin):
         return f"{obj.total}€"
     get_total.short_description = 'Total'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(unidades=Coalesce(Sum('items__cantidad'), 0))
+    
+    def get_cantidad_items(self, obj):
+        return obj.unidades
+    get_cantidad_items.short_description = 'Cantidad items'
+    get_cantidad_items.admin_order_field = 'unidades'
+    
     actions = [
         'marcar_como_pagado', 'marcar_como_enviado',
         'marcar_como_entregado', 'marcar_como_cancelado'
     ]
     
+    def _cambiar_estado(self, request, queryset, estado, texto):
+        """Lleva el lote a ``estado`` con la máquina de estados (consultas fijas)"""
+        # Los pedidos cuyo estado no admite la transición se omiten
+        ids = list(queryset.values_list('pk', flat=True))
+        cambiados = transicionar(ids, estado)
+        omitidos = len(ids) - len(cambiados)
+        mensaje = f'{len(cambiados)} pedidos marcados como {texto}'
+        if omitidos:
+            mensaje += f' ({omitidos} omitidos por su estado)'
+        self.message_user(request, mensaje, messages.WARNING if omitidos else messages.SUCCESS)
+    
     def marcar_como_pagado(self, request, queryset):
-        queryset.update(estado='PAGADO')
-        self.message_user(request, f'{queryset.count()} pedidos marcados como pagados')
+        self._cambiar_estado(request, queryset, PAGADO, 'pagados')
     
     def marcar_como_enviado(self, request, queryset):
-        queryset.update(estado='ENVIADO')
-        self.message_user(request, f'{queryset.count()} pedidos marcados como enviados')
+        self._cambiar_estado(request, queryset, ENVIADO, 'enviados')
     
     def marcar_como_entregado(self, request, queryset):
-        queryset.update(estado='ENTREGADO')
-        self.message_user(request, f'{queryset.count()} pedidos marcados como entregados')
+        self._cambiar_estado(request, queryset, ENTREGADO, 'entregados')
     
     def marcar_como_cancelado(self, request, queryset):
-        queryset.update(estado='CANCELADO')
-        self.message_user(request, f'{queryset.count()} pedidos marcados como cancelados')
+        self._cambiar_estado(request, queryset, CANCELADO, 'cancelados')
 
 
 # =========== ITEM PEDIDO ===========
 @admin.register(ItemPedido)
-class ItemPedidoAdmin(admin.ModelAdmin):
+class ItemPedidoAdmin(AdminPaginado):
     list_display = [
         'id', 'get_pedido', 'get_carta',
         'cantidad', 'get_precio_unitario', 'get_subtotal'
     ]
     list_filter = ['pedido__estado']
     search_fields = ['carta__nombre', 'pedido__numero_pedido']
+    list_select_related = ['pedido', 'carta']
     readonly_fields = [
         'get_pedido_info', 'get_carta_info',
         'get_precio_unitario_display', 'get_subtotal_display'
@@ -329,32 +385,33 @@ class ItemPedidoAdmin(admin.ModelAdmin):
 
 # =========== RESENA ===========
 @admin.register(Resena)
-class ResenaAdmin(admin.ModelAdmin):
+class ResenaAdmin(AdminPaginado):
     list_display = [
         'get_carta', 'get_usuario', 'valoracion',
         'fecha_creacion', 'aprobada', 'recomendado', 'utilidad'
     ]
     list_filter = ['valoracion', 'aprobada', 'recomendado', 'fecha_creacion']
     search_fields = ['carta__nombre', 'usuario__username', 'titulo']
+    list_select_related = ['carta', 'usuario']
     readonly_fields = ['fecha_creacion', 'fecha_actualizacion', 'utilidad']
     
     def get_carta(self, obj):
         return obj.carta.nombre
     get_carta.short_description = 'Carta'
+    get_carta.admin_order_field = 'carta__nombre'
     
     def get_usuario(self, obj):
         return obj.usuario.username
     get_usuario.short_description = 'Usuario'
+    get_usuario.admin_order_field = 'usuario__username'
     
     actions = ['aprobar_resenas', 'rechazar_resenas']
     
     def aprobar_resenas(self, request, queryset):
-        queryset.update(aprobada=True)
-        self.message_user(request, f'{queryset.count()} reseñas aprobadas')
+        self._accion_masiva(request, queryset, 'resena.aprobar', 'reseñas aprobadas')
     
     def rechazar_resenas(self, request, queryset):
-        queryset.update(aprobada=False)
-        self.message_user(request, f'{queryset.count()} reseñas rechazadas')
+        self._accion_masiva(request, queryset, 'resena.rechazar', 'reseñas rechazadas')
 
 
 # =========== COLECCION CARTA INLINE ===========
@@ -371,19 +428,29 @@ class ColeccionCartaInline(admin.TabularInline):
 
 # =========== COLECCION ===========
 @admin.register(Coleccion)
-class ColeccionAdmin(admin.ModelAdmin):
+class ColeccionAdmin(AdminPaginado):
     list_display = [
         'nombre', 'get_usuario', 'publica',
         'get_total_cartas', 'get_valor_estimado', 'fecha_creacion'
     ]
     list_filter = ['publica', 'fecha_creacion', 'usuario']
     search_fields = ['nombre', 'usuario__username', 'descripcion']
+    list_select_related = ['usuario']
     readonly_fields = [
         'fecha_creacion', 'fecha_actualizacion',
         'get_total_cartas', 'get_valor_estimado'
     ]
     inlines = [ColeccionCartaInline]
     
+    def get_changelist_instance(self, request):
+        # Valora todas las colecciones de la página con una sola consulta
+        changelist = super().get_changelist_instance(request)
+        colecciones = list(changelist.result_list)
+        valoraciones = valorar_colecciones(colecciones)
+        for coleccion in colecciones:
+            coleccion.__dict__['valoracion'] = valoraciones[coleccion.pk]
+        return changelist
+    
     def get_usuario(self, obj):
         return obj.usuario.username
     get_usuario.short_description = 'Usuario'
@@ -399,13 +466,14 @@ class ColeccionAdmin(admin.ModelAdmin):
 
 # =========== COLECCION CARTA ===========
 @admin.register(ColeccionCarta)
-class ColeccionCartaAdmin(admin.ModelAdmin):
+class ColeccionCartaAdmin(AdminPaginado):
     list_display = [
         'get_coleccion', 'get_carta', 'cantidad',
         'estado', 'fecha_agregado'
     ]
     list_filter = ['estado', 'fecha_agregado']
     search_fields = ['coleccion__nombre', 'carta__nombre']
+    list_select_related = ['coleccion', 'carta']
     readonly_fields = ['fecha_agregado', 'get_coleccion_link', 'get_carta_link']
     
     def get_coleccion(self, obj):
@@ -431,6 +499,52 @@ class ColeccionCartaAdmin(admin.ModelAdmin):
     get_carta_link.short_description = 'Ver Carta'
 
 
+# =========== OUTBOX ===========
+@admin.register(EventoOutbox)
+class EventoOutboxAdmin(AdminPaginado):
+    list_display = ['id', 'tipo', 'manejador', 'pedido', 'fecha_creacion', 'intentos', 'fecha_procesado']
+    list_filter = ['tipo', 'manejador', ('fecha_procesado', admin.EmptyFieldListFilter)]
+    search_fields = ['pedido__numero_pedido']
+    list_select_related = ['pedido']
+    readonly_fields = [
+        'tipo', 'manejador', 'pedido', 'datos', 'fecha_creacion', 'disponible_desde',
+        'intentos', 'ultimo_error', 'fecha_procesado'
+    ]
+    actions = ['reintentar']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def reintentar(self, request, queryset):
+        """Vuelve a poner en cola los eventos fallidos seleccionados"""
+        filas = queryset.filter(fecha_procesado__isnull=True).update(intentos=0, disponible_desde=timezone.now())
+        self.message_user(request, f'{filas} eventos en cola de nuevo')
+
+
+# =========== TAREAS MASIVAS ===========
+@admin.register(TareaMasiva)
+class TareaMasivaAdmin(AdminPaginado):
+    list_display = ['id', 'accion', 'usuario', 'estado', 'get_progreso', 'afectados', 'fecha_creacion', 'fecha_fin']
+    list_filter = ['estado', 'accion']
+    list_select_related = ['usuario']
+    exclude = ['ids']
+    readonly_fields = [
+        'accion', 'usuario', 'estado', 'total', 'procesados', 'afectados', 'get_progreso',
+        'error', 'fecha_creacion', 'fecha_actualizacion', 'fecha_fin'
+    ]
+    
+    def get_queryset(self, request):
+        # La lista de ids puede ser enorme y no se muestra
+        return super().get_queryset(request).defer('ids')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def get_progreso(self, obj):
+        return f"{obj.procesados}/{obj.total} ({obj.progreso}%)"
+    get_progreso.short_description = 'Progreso'
+
+
 # Personalización del sitio admin
 admin.site.site_header = "🏆 Pokémon TCG Store - Administración"
 admin.site.site_title = "Pokémon TCG Admin"
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Registra los receptores de invalidación de la cache de páginas
+        # y los manejadores del outbox de pedidos
+        from . import cache_paginas, signals
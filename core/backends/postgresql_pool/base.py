@@ -0,0 +1,68 @@
+# core/backends/postgresql_pool/base.py
+"""
+Backend PostgreSQL con pool de conexiones de psycopg.
+
+Django 4.2 no trae pool propio (llega en 5.1 con ``OPTIONS['pool']``). Este
+backend toma las conexiones de un ``psycopg_pool.ConnectionPool`` por alias
+y las devuelve al pool al cerrarlas, así que con ``CONN_MAX_AGE = 0`` cada
+petición reutiliza una conexión abierta en lugar de abrir una nueva.
+Requiere psycopg 3 y psycopg-pool (requirements.txt).
+
+``OPTIONS['pool']`` se pasa tal cual a ``ConnectionPool`` (min_size,
+max_size, timeout, max_idle...). Con ``CONN_HEALTH_CHECKS`` el pool comprueba
+cada conexión antes de entregarla.
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+
+try:
+    from psycopg import IsolationLevel
+    from psycopg_pool import ConnectionPool
+except ImportError as e:
+    raise ImproperlyConfigured(f'El backend con pool necesita psycopg 3 y psycopg-pool: {e}')
+
+_pools = {}
+_cerrojo = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    @property
+    def pool(self):
+        """Pool del alias, creado la primera vez que se necesita"""
+        if self.alias not in _pools:
+            with _cerrojo:
+                if self.alias not in _pools:
+                    params = self.get_connection_params()
+                    # Django ajusta el autocommit después de obtener la conexión
+                    params['autocommit'] = True
+                    comprobar = ConnectionPool.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None
+                    _pools[self.alias] = ConnectionPool(
+                        kwargs=params,
+                        check=comprobar,
+                        open=True,
+                        name=f'pokemon-tcg-{self.alias}',
+                        **self.settings_dict['OPTIONS'].get('pool', {}),
+                    )
+        return _pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = IsolationLevel(options.get('isolation_level', IsolationLevel.READ_COMMITTED))
+        conexion = self.pool.getconn()
+        if 'isolation_level' in options:
+            conexion.isolation_level = self.isolation_level
+        return conexion
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # La conexión vuelve al pool en lugar de cerrarse
+                self.pool.putconn(self.connection)
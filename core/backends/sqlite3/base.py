@@ -0,0 +1,49 @@
+# core/backends/sqlite3/base.py
+"""
+Backend SQLite ajustado para producción.
+
+Igual que ``django.db.backends.sqlite3`` pero cada conexión nueva activa WAL
+(los lectores no bloquean al escritor), ``synchronous=NORMAL``, E/S mapeada
+en memoria, una cache de páginas mayor y tablas temporales en memoria. Las
+transacciones empiezan con ``BEGIN IMMEDIATE``: el bloqueo de escritura se
+pide al principio, de modo que una transacción que espera usa el
+``timeout`` de la conexión en lugar de fallar con "database is locked" al
+pasar de lectura a escritura.
+
+Los PRAGMA se pueden cambiar con ``OPTIONS['pragmas']``.
+"""
+from django.db.backends.sqlite3 import base
+
+PRAGMAS_POR_DEFECTO = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,  # 256 MB
+    'cache_size': -64000,            # en KiB (64 MB)
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # No son argumentos de sqlite3.connect()
+        params.pop('pragmas', None)
+        params.pop('begin_immediate', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conexion = super().get_new_connection(conn_params)
+        pragmas = {**PRAGMAS_POR_DEFECTO, **self.settings_dict['OPTIONS'].get('pragmas', {})}
+        if self.is_in_memory_db():
+            pragmas.pop('journal_mode', None)
+        for nombre, valor in pragmas.items():
+            conexion.execute(f'PRAGMA {nombre} = {valor}')
+        return conexion
+
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict['OPTIONS'].get('begin_immediate', True):
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,300 @@
+# core/cache_paginas.py
+"""
+Cache de páginas completas para tráfico anónimo del catálogo.
+
+Las respuestas se guardan comprimidas y asociadas a etiquetas ('catalogo',
+'carta:<id>', 'expansion:<id>', 'categorias'). Cada etiqueta tiene una versión en cache;
+invalidar una etiqueta cambia su versión y deja obsoletas todas las páginas
+que la usaron, sin tener que recorrerlas.
+
+Con réplica de lectura (core/routers.py), la versión lleva la hora del
+cambio. Durante REPLICA_SEGUNDOS_PRIMARIA segundos no se guardan páginas de
+esas etiquetas: una página generada con la réplica todavía atrasada se
+quedaría en cache con la versión nueva hasta que caducara.
+"""
+import hashlib
+import time
+import uuid
+import zlib
+from functools import wraps
+from urllib.parse import parse_qsl, urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Carta, Categoria, Expansion, Inventario, Resena, Pedido, ItemPedido
+
+# Marcador que sustituye al token CSRF en las páginas cacheadas
+MARCADOR_CSRF = '__CSRF_CACHE_PAGINA__'
+
+PREFIJO = 'pagina'
+CLAVE_ACIERTOS = f'{PREFIJO}:stats:aciertos'
+CLAVE_FALLOS = f'{PREFIJO}:stats:fallos'
+
+# Parámetros que no cambian el contenido de la página
+PARAMETROS_IGNORADOS = {'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid'}
+
+
+def _timeout():
+    return getattr(settings, 'CACHE_PAGINAS_TIMEOUT', 300)
+
+
+def querystring_normalizada(request):
+    """Querystring ordenada, sin parámetros vacíos ni de seguimiento"""
+    parametros = sorted(
+        (clave, valor) for clave, valor in parse_qsl(request.META.get('QUERY_STRING', ''))
+        if valor and clave not in PARAMETROS_IGNORADOS
+    )
+    return urlencode(parametros)
+
+
+def clave_pagina(request):
+    """Clave de cache a partir de la ruta y la querystring normalizada"""
+    url = f"{request.path}?{querystring_normalizada(request)}"
+    return f"{PREFIJO}:url:{hashlib.md5(url.encode('utf-8')).hexdigest()}"
+
+
+def _clave_etiqueta(etiqueta):
+    return f'{PREFIJO}:tag:{etiqueta}'
+
+
+def _nueva_version(instante):
+    return f'{instante:.3f}:{uuid.uuid4().hex}'
+
+
+def _segundos_replica():
+    # Solo se define en settings cuando hay réplica
+    return getattr(settings, 'REPLICA_SEGUNDOS_PRIMARIA', 0)
+
+
+def versiones_asentadas(versiones):
+    """¿Cambiaron todas las etiquetas hace más que el retraso de la réplica?"""
+    segundos = _segundos_replica()
+    if not segundos:
+        return True
+    limite = time.time() - segundos
+    return all(float(version.partition(':')[0] or 0) <= limite for version in versiones.values())
+
+
+def versiones_etiquetas(etiquetas):
+    """Devuelve la versión actual de cada etiqueta, creándola si no existe"""
+    claves = {_clave_etiqueta(etiqueta): etiqueta for etiqueta in etiquetas}
+    actuales = cache.get_many(claves)
+    faltantes = [clave for clave in claves if clave not in actuales]
+    if faltantes:
+        for clave in faltantes:
+            # Etiqueta sin cambios conocidos: se da por asentada
+            cache.add(clave, _nueva_version(0), None)
+        actuales.update(cache.get_many(faltantes))
+    return {claves[clave]: version for clave, version in actuales.items()}
+
+
+def invalidar_etiquetas(*etiquetas):
+    """Cambia la versión de las etiquetas indicadas"""
+    ahora = time.time()
+    cache.set_many({_clave_etiqueta(etiqueta): _nueva_version(ahora) for etiqueta in etiquetas}, None)
+
+
+def _incrementar(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.add(clave, 0, None)
+        cache.incr(clave)
+
+
+def estadisticas():
+    """Aciertos, fallos y ratio de acierto de la cache de páginas"""
+    valores = cache.get_many([CLAVE_ACIERTOS, CLAVE_FALLOS])
+    aciertos = valores.get(CLAVE_ACIERTOS, 0)
+    fallos = valores.get(CLAVE_FALLOS, 0)
+    total = aciertos + fallos
+    return {
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'ratio_aciertos': round(aciertos / total, 4) if total else 0.0,
+    }
+
+
+def es_cacheable(request):
+    """Solo se cachean GET/HEAD anónimos sin mensajes ni carrito en sesión"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        if request.session.get(settings.CART_SESSION_ID):
+            return False
+    if len(get_messages(request)):
+        return False
+    return True
+
+
+def _respuesta_desde_entrada(request, entrada):
+    """Construye la respuesta a partir de una entrada de cache"""
+    response = get_conditional_response(
+        request, etag=entrada['etag'], last_modified=entrada['last_modified']
+    )
+    if response is None:
+        cuerpo = zlib.decompress(entrada['cuerpo']).decode('utf-8')
+        if MARCADOR_CSRF in cuerpo:
+            cuerpo = cuerpo.replace(MARCADOR_CSRF, get_token(request))
+        response = HttpResponse(cuerpo, content_type=entrada['content_type'])
+    response['ETag'] = entrada['etag']
+    response['Last-Modified'] = http_date(entrada['last_modified'])
+    return response
+
+
+def _respuesta_cacheada(request):
+    """Respuesta guardada y vigente para la petición, o None si hay que generarla"""
+    entrada = cache.get(clave_pagina(request))
+    if entrada is not None:
+        vigentes = versiones_etiquetas(entrada['versiones'])
+        if vigentes == entrada['versiones']:
+            _incrementar(CLAVE_ACIERTOS)
+            response = _respuesta_desde_entrada(request, entrada)
+            response['X-Cache'] = 'HIT'
+            return response
+
+    _incrementar(CLAVE_FALLOS)
+    return None
+
+
+def _guardar_respuesta(request, response, etiquetas):
+    """Guarda la respuesta recién generada y la devuelve lista para servir"""
+    # Errores, redirecciones o respuestas que fijan cookies no se guardan
+    guardable = response.status_code == 200 and not response.streaming and not response.cookies
+    if guardable:
+        todas = set(etiquetas) | set(getattr(response, 'etiquetas_cache', ()))
+        versiones = versiones_etiquetas(todas)
+        # Ni páginas que pueden venir de una réplica aún sin el último cambio
+        guardable = versiones_asentadas(versiones)
+    if not guardable:
+        if not response.streaming and MARCADOR_CSRF.encode() in response.content:
+            response.content = response.content.replace(
+                MARCADOR_CSRF.encode(), get_token(request).encode()
+            )
+        return response
+
+    cuerpo = response.content
+    entrada = {
+        'cuerpo': zlib.compress(cuerpo),
+        'content_type': response['Content-Type'],
+        # Se respeta el ETag de versión si la vista ya lo calculó (core.etags)
+        'etag': response.get('ETag') or f'"{hashlib.md5(cuerpo).hexdigest()}"',
+        'last_modified': int(time.time()),
+        'versiones': versiones,
+    }
+    cache.set(clave_pagina(request), entrada, _timeout())
+
+    response = _respuesta_desde_entrada(request, entrada)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cache_pagina_anonima(*etiquetas):
+    """
+    Decorador que cachea la página completa para visitantes anónimos.
+    La vista puede añadir etiquetas propias en ``response.etiquetas_cache``.
+    Admite vistas síncronas y async.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view_async(request, *args, **kwargs):
+                # request.user, la sesión y la cache se consultan en el hilo síncrono
+                if not await sync_to_async(es_cacheable)(request):
+                    return await view_func(request, *args, **kwargs)
+
+                response = await sync_to_async(_respuesta_cacheada)(request)
+                if response is not None:
+                    return response
+
+                request.csrf_marcador_cache = True
+                response = await view_func(request, *args, **kwargs)
+                request.csrf_marcador_cache = False
+                return await sync_to_async(_guardar_respuesta)(request, response, etiquetas)
+            return _wrapped_view_async
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not es_cacheable(request):
+                return view_func(request, *args, **kwargs)
+
+            response = _respuesta_cacheada(request)
+            if response is not None:
+                return response
+
+            # El token CSRF se renderiza como marcador y se sustituye al servir
+            request.csrf_marcador_cache = True
+            response = view_func(request, *args, **kwargs)
+            request.csrf_marcador_cache = False
+            return _guardar_respuesta(request, response, etiquetas)
+        return _wrapped_view
+    return decorator
+
+
+# =========== INVALIDACIÓN POR SEÑALES ===========
+
+def _invalidar_al_confirmar(*etiquetas):
+    transaction.on_commit(lambda: invalidar_etiquetas(*etiquetas))
+
+
+@receiver(pre_save, sender=Carta)
+def invalidar_expansion_anterior(sender, instance, **kwargs):
+    # Una carta que cambia de expansión deja de estar también en la anterior
+    if instance._state.adding or instance.pk is None:
+        return
+    anterior = Carta.objects.filter(pk=instance.pk).values_list('expansion_id', flat=True).first()
+    if anterior and anterior != instance.expansion_id:
+        _invalidar_al_confirmar(f'expansion:{anterior}')
+
+
+@receiver([post_save, post_delete], sender=Carta)
+def invalidar_carta(sender, instance, **kwargs):
+    _invalidar_al_confirmar('catalogo', f'carta:{instance.pk}', f'expansion:{instance.expansion_id}')
+
+
+@receiver([post_save, post_delete], sender=Inventario)
+def invalidar_inventario(sender, instance, **kwargs):
+    etiquetas = ['catalogo', f'carta:{instance.carta_id}']
+    expansion_id = Carta.objects.filter(pk=instance.carta_id).values_list('expansion_id', flat=True).first()
+    if expansion_id:
+        etiquetas.append(f'expansion:{expansion_id}')
+    _invalidar_al_confirmar(*etiquetas)
+
+
+@receiver([post_save, post_delete], sender=Expansion)
+def invalidar_expansion(sender, instance, **kwargs):
+    _invalidar_al_confirmar('catalogo', f'expansion:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Categoria)
+def invalidar_categoria(sender, instance, **kwargs):
+    _invalidar_al_confirmar('catalogo', 'categorias')
+
+
+@receiver([post_save, post_delete], sender=Resena)
+def invalidar_resena(sender, instance, **kwargs):
+    _invalidar_al_confirmar(f'carta:{instance.carta_id}')
+
+
+@receiver([post_save, post_delete], sender=Pedido)
+def invalidar_carrito_pedido(sender, instance, **kwargs):
+    _invalidar_al_confirmar(f'carrito:{instance.cliente_id}')
+
+
+@receiver([post_save, post_delete], sender=ItemPedido)
+def invalidar_carrito_item(sender, instance, **kwargs):
+    cliente_id = Pedido.objects.filter(pk=instance.pedido_id).values_list('cliente_id', flat=True).first()
+    if cliente_id:
+        _invalidar_al_confirmar(f'carrito:{cliente_id}')
@@ -0,0 +1,342 @@
+# core/carrito.py
+"""
+Resolución del carrito abierto de un usuario.
+
+Cada cliente tiene como máximo un Pedido en estado CARRITO (restricción
+única parcial en Pedido). El id del carrito se guarda en la sesión para
+no tener que buscarlo por cliente y estado en cada petición.
+
+Añadir una carta al carrito es una operación de pocas sentencias: se bloquea
+la fila de inventario, se incrementa (o inserta) el item comprobando el stock
+en el propio UPDATE y los totales del pedido se ajustan con el incremento.
+
+Los visitantes anónimos no crean pedidos: su carrito es un diccionario
+{carta_id: cantidad} en la sesión que se vuelca al carrito de la base de
+datos al iniciar sesión.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery, Sum, prefetch_related_objects
+
+from .models import (
+    Carta, Pedido, ItemPedido, Inventario, ENVIO_GRATIS_DESDE, COSTE_ENVIO, TIPO_IVA,
+    redondear_dinero,
+)
+from .cache_paginas import invalidar_etiquetas
+
+CLAVE_SESION = getattr(settings, 'CARRITO_SESSION_ID', 'carrito_id')
+CLAVE_SESION_ANONIMA = getattr(settings, 'CART_SESSION_ID', 'cart')
+
+
+def datos_carrito_nuevo(user):
+    """Campos requeridos de un carrito recién creado"""
+    nombre_usuario = f"{user.first_name or ''} {user.last_name or ''}".strip()
+    if not nombre_usuario:
+        nombre_usuario = user.username
+
+    return {
+        'nombre_completo': nombre_usuario,
+        'email': user.email or '',
+        'telefono': '',
+        'direccion': '',
+        'ciudad': 'No especificada',
+        'provincia': '',
+        'codigo_postal': '',
+        'pais': 'España',
+        'subtotal': Decimal('0.00'),
+        'envio': Decimal('0.00'),
+        'impuestos': Decimal('0.00'),
+        'total': Decimal('0.00'),
+    }
+
+
+def obtener_o_crear_carrito(user):
+    """
+    Devuelve el carrito abierto del usuario, creándolo si no existe.
+    Si dos peticiones lo crean a la vez, la restricción única hace fallar
+    una de ellas y get_or_create devuelve el carrito de la otra.
+    """
+    carrito, _ = Pedido.objects.get_or_create(
+        cliente=user,
+        estado='CARRITO',
+        defaults=datos_carrito_nuevo(user),
+    )
+    return carrito
+
+
+def obtener_carrito(request, crear=True):
+    """Carrito abierto del usuario de la petición (None si no hay y crear=False)"""
+    # Misma petición: la vista y el context processor comparten el carrito
+    carrito = getattr(request, '_carrito', None)
+    if carrito is not None and carrito.estado == 'CARRITO':
+        return carrito
+
+    carrito_id = request.session.get(CLAVE_SESION)
+    if carrito_id:
+        carrito = Pedido.objects.filter(
+            id=carrito_id, cliente=request.user, estado='CARRITO'
+        ).first()
+        if carrito is not None:
+            request._carrito = carrito
+            return carrito
+        # El carrito de la sesión ya se pagó o se eliminó
+        del request.session[CLAVE_SESION]
+
+    if crear:
+        carrito = obtener_o_crear_carrito(request.user)
+    else:
+        carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+
+    if carrito is not None:
+        request.session[CLAVE_SESION] = carrito.id
+        request._carrito = carrito
+    return carrito
+
+
+def cerrar_carrito(request):
+    """Olvida el carrito de la sesión (tras convertirlo en pedido)"""
+    request.session.pop(CLAVE_SESION, None)
+    request._carrito = None
+
+
+def cargar_items(pedido):
+    """
+    Carga los ítems del pedido una sola vez, con su carta, expansión e
+    inventario. Después items.all, items.count, cantidad_items, la
+    comprobación de stock y el render trabajan sobre esa misma lista
+    """
+    prefetch_related_objects([pedido], Prefetch(
+        'items', queryset=ItemPedido.objects.select_related('carta__expansion', 'inventario').order_by('id'),
+    ))
+    return pedido
+
+
+def items_sin_stock(pedido):
+    """Ítems cargados con cargar_items cuya cantidad supera el stock real"""
+    return [item for item in pedido.items.all() if item.cantidad > item.inventario.stock_real]
+
+
+def cantidad_items(carrito):
+    """Unidades en el carrito (contador del menú)"""
+    if carrito is None:
+        return 0
+    if 'items' in getattr(carrito, '_prefetched_objects_cache', {}):
+        return carrito.cantidad_items
+    return carrito.items.aggregate(total=Sum('cantidad'))['total'] or 0
+
+
+def leer_cantidad(valor):
+    """Cantidad recibida de un formulario; ValueError con un mensaje legible si no es un entero"""
+    if valor is None or valor == '':
+        return 1
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError('La cantidad debe ser un número entero') from None
+
+
+def agregar_carta(carrito, carta_id, cantidad=1):
+    """
+    Añade ``cantidad`` unidades de una carta al carrito en una transacción.
+    Lanza ValueError si no hay inventario o stock suficiente. Devuelve el
+    nombre de la carta.
+    """
+    if cantidad < 1:
+        raise ValueError('La cantidad debe ser al menos 1')
+
+    with transaction.atomic():
+        # La fila de inventario queda bloqueada hasta el final de la transacción
+        inventario = Inventario.objects.select_for_update().filter(carta_id=carta_id).values(
+            'id', 'precio', 'precio_promocional', 'en_promocion',
+            'cantidad_disponible', 'cantidad_reservada', 'carta__nombre',
+        ).first()
+        if inventario is None:
+            raise ValueError('No hay inventario para esta carta')
+
+        nombre = inventario['carta__nombre']
+        stock = inventario['cantidad_disponible'] - inventario['cantidad_reservada']
+
+        # Incremento del item existente; la condición de stock va en el WHERE
+        actualizados = ItemPedido.objects.filter(
+            pedido=carrito, carta_id=carta_id, cantidad__lte=stock - cantidad
+        ).update(
+            cantidad=F('cantidad') + cantidad,
+            subtotal=(F('cantidad') + cantidad) * F('precio_unitario'),
+        )
+
+        if not actualizados:
+            if cantidad > stock:
+                raise ValueError(f'Stock insuficiente para {nombre}')
+            if inventario['en_promocion'] and inventario['precio_promocional']:
+                precio = inventario['precio_promocional']
+            else:
+                precio = inventario['precio']
+            try:
+                with transaction.atomic():
+                    ItemPedido.objects.bulk_create([ItemPedido(
+                        pedido=carrito, carta_id=carta_id, inventario_id=inventario['id'],
+                        cantidad=cantidad, precio_unitario=precio, subtotal=precio * cantidad,
+                    )])
+            except IntegrityError:
+                # El item ya existía: no se actualizó por falta de stock
+                raise ValueError(f'Stock insuficiente para agregar más unidades de {nombre}')
+
+        # Totales del pedido a partir del incremento del subtotal
+        dinero = models.DecimalField(max_digits=10, decimal_places=2)
+        precio_item = ItemPedido.objects.filter(
+            pedido=OuterRef('pk'), carta_id=carta_id
+        ).values('precio_unitario')[:1]
+        subtotal = F('subtotal') + Subquery(precio_item, output_field=dinero) * cantidad
+        Pedido.objects.filter(pk=carrito.pk).update(
+            **Pedido.objects.expresiones_totales(subtotal)
+        )
+
+        # update y bulk_create no envían señales: se invalida la cache a mano
+        etiqueta = f'carrito:{carrito.cliente_id}'
+        transaction.on_commit(lambda: invalidar_etiquetas(etiqueta))
+
+    return nombre
+
+
+# Carrito anónimo en sesión
+
+class CarritoSesion:
+    """
+    Carrito de un visitante anónimo. Las cartas se cargan con un único
+    in_bulk y las líneas son ItemPedido sin guardar cuyo id es el de la carta.
+    """
+    descuento = Decimal('0.00')
+
+    def __init__(self, request):
+        contenido = contenido_sesion(request)
+        cartas = Carta.objects.select_related('inventario', 'expansion').in_bulk(
+            [int(carta_id) for carta_id in contenido]
+        )
+        self.lineas = []
+        for carta_id, cantidad in contenido.items():
+            carta = cartas.get(int(carta_id))
+            inventario = getattr(carta, 'inventario', None) if carta else None
+            if inventario is None:
+                continue
+            item = ItemPedido(
+                id=carta.id, carta=carta, inventario=inventario,
+                cantidad=cantidad, precio_unitario=inventario.precio_actual,
+            )
+            item.calcular_subtotal()
+            self.lineas.append(item)
+
+        self.subtotal = sum((item.subtotal for item in self.lineas), Decimal('0.00'))
+        self.envio = Decimal('0.00') if self.subtotal >= ENVIO_GRATIS_DESDE else COSTE_ENVIO
+        self.impuestos = redondear_dinero(self.subtotal * TIPO_IVA)
+        self.total = redondear_dinero(self.subtotal + self.envio + self.impuestos - self.descuento)
+
+    @property
+    def cantidad_items(self):
+        return sum(item.cantidad for item in self.lineas)
+
+    @property
+    def envio_gratis(self):
+        return self.envio == 0
+
+
+def contenido_sesion(request):
+    """Diccionario {str(carta_id): cantidad} del carrito anónimo"""
+    return request.session.get(CLAVE_SESION_ANONIMA, {})
+
+
+def _guardar_sesion(request, contenido):
+    if contenido:
+        request.session[CLAVE_SESION_ANONIMA] = contenido
+    else:
+        request.session.pop(CLAVE_SESION_ANONIMA, None)
+
+
+def _stock_y_nombre(carta_id):
+    fila = Inventario.objects.filter(carta_id=carta_id).values_list(
+        'cantidad_disponible', 'cantidad_reservada', 'carta__nombre'
+    ).first()
+    if fila is None:
+        raise ValueError('No hay inventario para esta carta')
+    disponible, reservada, nombre = fila
+    return disponible - reservada, nombre
+
+
+def agregar_carta_sesion(request, carta_id, cantidad=1):
+    """Añade unidades al carrito anónimo comprobando el stock. Devuelve el nombre."""
+    if cantidad < 1:
+        raise ValueError('La cantidad debe ser al menos 1')
+    stock, nombre = _stock_y_nombre(carta_id)
+    contenido = contenido_sesion(request)
+    nueva_cantidad = contenido.get(str(carta_id), 0) + cantidad
+    if nueva_cantidad > stock:
+        raise ValueError(f'Stock insuficiente para {nombre}')
+    contenido[str(carta_id)] = nueva_cantidad
+    _guardar_sesion(request, contenido)
+    return nombre
+
+
+def actualizar_carta_sesion(request, carta_id, cantidad):
+    """Fija la cantidad de una carta del carrito anónimo (0 la elimina)"""
+    contenido = contenido_sesion(request)
+    if str(carta_id) not in contenido:
+        raise ValueError('La carta no está en el carrito')
+    if cantidad <= 0:
+        del contenido[str(carta_id)]
+    else:
+        stock, _ = _stock_y_nombre(carta_id)
+        if cantidad > stock:
+            raise ValueError('Stock insuficiente')
+        contenido[str(carta_id)] = cantidad
+    _guardar_sesion(request, contenido)
+
+
+def vaciar_carrito_sesion(request):
+    request.session.pop(CLAVE_SESION_ANONIMA, None)
+
+
+def fusionar_carrito_sesion(request):
+    """
+    Vuelca el carrito anónimo en el carrito del usuario recién identificado.
+    Las cantidades se suman a las que ya hubiera (limitadas al stock) y se
+    escriben con un único bulk_create con update_conflicts.
+    """
+    contenido = contenido_sesion(request)
+    if not contenido:
+        return 0
+
+    with transaction.atomic():
+        carrito = obtener_carrito(request)
+        carta_ids = [int(carta_id) for carta_id in contenido]
+        inventarios = Inventario.objects.filter(carta_id__in=carta_ids).values_list(
+            'carta_id', 'id', 'precio', 'precio_promocional', 'en_promocion',
+            'cantidad_disponible', 'cantidad_reservada',
+        )
+        existentes = dict(carrito.items.filter(carta_id__in=carta_ids).values_list('carta_id', 'cantidad'))
+
+        items = []
+        for carta_id, inventario_id, precio, promocional, en_promocion, disponible, reservada in inventarios:
+            cantidad = min(contenido[str(carta_id)] + existentes.get(carta_id, 0), disponible - reservada)
+            if cantidad < 1:
+                continue
+            precio_unitario = promocional if en_promocion and promocional else precio
+            items.append(ItemPedido(
+                pedido=carrito, carta_id=carta_id, inventario_id=inventario_id,
+                cantidad=cantidad, precio_unitario=precio_unitario,
+                subtotal=precio_unitario * cantidad,
+            ))
+
+        if items:
+            ItemPedido.objects.bulk_create(
+                items,
+                update_conflicts=True,
+                unique_fields=['pedido', 'carta'],
+                update_fields=['cantidad', 'precio_unitario', 'subtotal'],
+            )
+            Pedido.objects.filter(pk=carrito.pk).recalcular_totales()
+            etiqueta = f'carrito:{carrito.cliente_id}'
+            transaction.on_commit(lambda: invalidar_etiquetas(etiqueta))
+
+    vaciar_carrito_sesion(request)
+    return len(items)
@@ -0,0 +1,111 @@
+# core/etags.py
+"""
+ETags fuertes basados en las versiones del catálogo.
+
+Las versiones son las mismas etiquetas que usa la cache de páginas
+(core.cache_paginas): 'catalogo' cambia al guardar o borrar cualquier Carta,
+Inventario, Expansion o Categoria; 'expansion:<id>' con las cartas, el stock
+o los precios de esa expansión; 'categorias' con las categorías, y
+'carta:<id>' y 'carrito:<usuario>' con la carta o el carrito correspondiente.
+Calcular el ETag solo consulta la cache, así que un If-None-Match que
+coincide se responde con 304 antes de ejecutar ninguna consulta del catálogo.
+Con réplica, tras un cambio no se emite ETag hasta que la réplica lo tiene
+(cache_paginas.versiones_asentadas): el cliente guardaría con la versión
+nueva un cuerpo leído de la réplica atrasada.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .cache_paginas import versiones_asentadas, versiones_etiquetas, querystring_normalizada
+
+
+def _etag(*partes):
+    return hashlib.sha1('|'.join(str(parte) for parte in partes).encode('utf-8')).hexdigest()
+
+
+def _etag_versionado(etiquetas, *partes):
+    """ETag de ``partes`` y las versiones de ``etiquetas``; None si aún no están asentadas"""
+    versiones = versiones_etiquetas(etiquetas)
+    if not versiones_asentadas(versiones):
+        return None
+    return _etag(*partes, *(versiones[etiqueta] for etiqueta in etiquetas))
+
+
+def _es_ajax(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def etag_filtrar_cartas(request):
+    """
+    ETag para la respuesta JSON de filtrar_cartas (solo AJAX). Filtrada por
+    expansión va por las versiones de esa expansión y de las categorías (los
+    cambios de stock de otras expansiones no la invalidan); sin filtro, por
+    la de todo el catálogo
+    """
+    if not _es_ajax(request):
+        return None
+    expansion_id = request.GET.get('expansion', '')
+    if expansion_id.isdigit():
+        etiquetas = [f'expansion:{int(expansion_id)}', 'categorias']
+    else:
+        etiquetas = ['catalogo']
+    return _etag_versionado(etiquetas, 'filtrar', querystring_normalizada(request))
+
+
+def etag_autocompletar(request):
+    """ETag para las sugerencias del buscador"""
+    return _etag_versionado(['catalogo'], 'autocompletar', querystring_normalizada(request))
+
+
+def etag_detalle_carta(request, carta_id):
+    """
+    ETag para el detalle de una carta. La página incluye el carrito del
+    usuario, así que el usuario y la versión de su carrito forman parte del ETag
+    """
+    if len(get_messages(request)):
+        return None
+    if not request.user.is_authenticated and request.session.get(settings.CART_SESSION_ID):
+        return None
+    etiquetas = ['catalogo', f'carta:{carta_id}']
+    usuario = 'anonimo'
+    if request.user.is_authenticated:
+        usuario = request.user.pk
+        etiquetas.append(f'carrito:{usuario}')
+    return _etag_versionado(etiquetas, 'detalle', carta_id, usuario)
+
+
+def etag_api(request, recurso, obj_id=None):
+    """ETag para la API JSON del catálogo (listado o elemento ``obj_id`` de ``recurso``)"""
+    return _etag_versionado(['catalogo'], 'api', recurso, obj_id, querystring_normalizada(request))
+
+
+def condicion_async(etag_func):
+    """
+    ``condition(etag_func=...)`` para vistas async de solo lectura (el de
+    Django 4.2 solo admite vistas síncronas). El ETag se calcula en el hilo
+    síncrono porque puede consultar la sesión y el usuario
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            etag = None
+            if request.method in ('GET', 'HEAD'):
+                etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+                if etag is not None:
+                    etag = quote_etag(etag)
+                    response = get_conditional_response(request, etag=etag)
+                    if response is not None:
+                        return response
+
+            response = await view_func(request, *args, **kwargs)
+            if etag is not None and not response.has_header('ETag'):
+                response.headers['ETag'] = etag
+            return response
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,108 @@
+# core/idempotencia.py
+"""
+Claves de idempotencia para los envíos de pago.
+
+Los formularios de pago llevan un campo oculto ``clave_idempotencia``, que
+se genera al mostrarlos. Los clientes del endpoint JSON mandan la cabecera
+``Idempotency-Key``. ``@idempotente`` ejecuta la vista en una transacción
+que empieza insertando la clave. Ante un doble clic o un reintento con la
+misma clave, la segunda inserción espera a que termine la primera (por la
+restricción única) y se devuelve la respuesta guardada sin volver a pagar.
+Si la vista falla, la transacción se deshace con la clave y se puede
+reintentar.
+
+Solo se guardan las respuestas JSON correctas (2xx) y las redirecciones que
+la vista marca con ``completado`` (el pedido se realizó). Un formulario que
+vuelve a mostrarse con errores, una respuesta de error o una redirección de
+error (sin stock, carrito vacío) no consumen la clave: el cliente puede
+corregir y reintentar con la misma. Las claves caducan a las IDEMPOTENCIA_HORAS y las borra
+el comando limpiar_idempotencia.
+"""
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+
+from .models import ClaveIdempotencia
+
+CAMPO = 'clave_idempotencia'
+CABECERA = 'Idempotency-Key'
+LONGITUD_MAXIMA = 64
+
+
+def _horas():
+    return getattr(settings, 'IDEMPOTENCIA_HORAS', 24)
+
+
+def completado(response):
+    """Marca la redirección de la vista como resultado del envío: se guarda con la clave"""
+    response.envio_completado = True
+    return response
+
+
+def _guardable(response):
+    if response.status_code in (301, 302, 303):
+        return getattr(response, 'envio_completado', False)
+    return 200 <= response.status_code < 300 and response.get('Content-Type', '').startswith('application/json')
+
+
+def _repetir(guardada):
+    response = HttpResponse(bytes(guardada.contenido), status=guardada.codigo)
+    if guardada.tipo_contenido:
+        response['Content-Type'] = guardada.tipo_contenido
+    if guardada.ubicacion:
+        response['Location'] = guardada.ubicacion
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotente(vista):
+    """Deduplica los POST con la misma clave; usar debajo de login_required"""
+    @wraps(vista)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method != 'POST':
+            # Clave para el formulario que se va a mostrar
+            request.clave_idempotencia = uuid.uuid4().hex
+            return vista(request, *args, **kwargs)
+
+        clave = request.headers.get(CABECERA) or request.POST.get(CAMPO, '')
+        if not clave:
+            return vista(request, *args, **kwargs)
+        if len(clave) > LONGITUD_MAXIMA:
+            return HttpResponseBadRequest('Clave de idempotencia demasiado larga')
+        request.clave_idempotencia = clave
+
+        ahora = timezone.now()
+        with transaction.atomic():
+            claves = ClaveIdempotencia.objects.filter(cliente=request.user, clave=clave)
+            claves.filter(expira__lte=ahora).delete()
+            try:
+                with transaction.atomic():
+                    registro = claves.create(
+                        cliente=request.user, clave=clave, ruta=request.path,
+                        codigo=0, expira=ahora + timedelta(hours=_horas()),
+                    )
+            except IntegrityError:
+                guardada = claves.first()
+                if guardada is None:
+                    # El primer envío se deshizo mientras esperábamos
+                    return HttpResponse('El envío anterior con esta clave falló; reinténtalo', status=409)
+                if guardada.ruta != request.path:
+                    return HttpResponse('La clave de idempotencia ya se usó en otra operación', status=422)
+                return _repetir(guardada)
+
+            response = vista(request, *args, **kwargs)
+            if not _guardable(response):
+                registro.delete()
+                return response
+            registro.codigo = response.status_code
+            registro.tipo_contenido = response.get('Content-Type', '')
+            registro.ubicacion = response.get('Location', '')
+            registro.contenido = b'' if response.streaming else response.content
+            registro.save(update_fields=['codigo', 'tipo_contenido', 'ubicacion', 'contenido'])
+        return response
+    return _wrapped_view
@@ -0,0 +1,97 @@
+# core/listado_admin.py
+"""
+Listados genéricos del panel de administración (admin_views.lista_admin).
+
+Cada modelo declara una vez sus columnas. La consulta del listado pide solo
+esas columnas con ``.only()``. Las columnas ForeignKey se traen con
+``select_related``, limitado a los campos que usa el ``__str__`` del modelo
+relacionado, para que pintar una celda no lance consultas perezosas. La
+búsqueda, la ordenación (``?orden=campo`` o ``?orden=-campo``) y los filtros
+por columna (``?<columna>=valor``) se resuelven en SQL.
+"""
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from .models import Carta, Categoria, Coleccion, Expansion, Inventario, Pedido, Resena, User
+
+# Campos que necesita el __str__ de los modelos que aparecen como relación
+CAMPOS_STR = {
+    User: ('username',),
+    Carta: ('codigo', 'nombre'),
+    Expansion: ('codigo', 'nombre'),
+}
+
+# Campos de texto: se filtran con icontains; el resto por igualdad
+TEXTO = (models.CharField, models.TextField)
+
+
+class ListadoAdmin:
+    """Columnas, búsqueda y consulta del listado de un modelo"""
+
+    def __init__(self, modelo, columnas, busqueda=None):
+        self.modelo = modelo
+        self.columnas = list(columnas)
+        self.busqueda = busqueda
+        self.campos = {nombre: modelo._meta.get_field(nombre) for nombre in self.columnas}
+        self.relaciones = [nombre for nombre, campo in self.campos.items() if campo.many_to_one or campo.one_to_one]
+        self.ordenables = set(self.columnas)
+        self.orden_defecto = list(modelo._meta.ordering) or ['-pk']
+
+        solo = ['pk', *self.columnas]
+        for nombre in self.relaciones:
+            relacionado = self.campos[nombre].related_model
+            solo += [f'{nombre}__{campo}' for campo in CAMPOS_STR.get(relacionado, ())]
+        self.solo = solo
+
+    @property
+    def titulo(self):
+        return self.modelo._meta.verbose_name_plural
+
+    def filtros(self, parametros):
+        """{columna: valor} de los parámetros GET que filtran una columna"""
+        return {
+            nombre: parametros[nombre].strip()
+            for nombre in self.columnas
+            if parametros.get(nombre, '').strip()
+        }
+
+    def orden(self, parametro):
+        """Orden pedido si es una columna; siempre acaba en pk para ser estable"""
+        if parametro and parametro.lstrip('-') in self.ordenables:
+            orden = [parametro]
+        else:
+            orden = list(self.orden_defecto)
+        if not any(campo.lstrip('-') in ('pk', 'id') for campo in orden):
+            orden.append('-pk' if orden[0].startswith('-') else 'pk')
+        return orden
+
+    def consulta(self, busqueda='', filtros=None, orden=None):
+        queryset = self.modelo.objects.select_related(*self.relaciones).only(*self.solo)
+        if busqueda and self.busqueda:
+            queryset = queryset.filter(**{f'{self.busqueda}__icontains': busqueda})
+        for nombre, valor in (filtros or {}).items():
+            campo = self.campos[nombre]
+            if isinstance(campo, TEXTO) and not campo.choices:
+                queryset = queryset.filter(**{f'{nombre}__icontains': valor})
+                continue
+            if campo.is_relation:
+                campo = campo.target_field
+                nombre = f'{nombre}_id'
+            try:
+                valor = campo.to_python(valor)
+            except ValidationError:
+                return queryset.none()
+            queryset = queryset.filter(**{nombre: valor})
+        return queryset.order_by(*(orden or self.orden(None)))
+
+
+LISTADOS = {
+    'carta': ListadoAdmin(Carta, ['codigo', 'nombre', 'expansion', 'rareza', 'stock_real'], busqueda='nombre'),
+    'expansion': ListadoAdmin(Expansion, ['codigo', 'nombre', 'fecha_lanzamiento', 'total_cartas'], busqueda='nombre'),
+    'categoria': ListadoAdmin(Categoria, ['nombre', 'icono', 'fecha_creacion'], busqueda='nombre'),
+    'pedido': ListadoAdmin(Pedido, ['numero_pedido', 'cliente', 'estado', 'fecha_pedido', 'total'], busqueda='cliente__username'),
+    'inventario': ListadoAdmin(Inventario, ['carta', 'cantidad_disponible', 'cantidad_reservada', 'precio']),
+    'resena': ListadoAdmin(Resena, ['carta', 'usuario', 'valoracion', 'titulo', 'fecha_creacion'], busqueda='titulo'),
+    'coleccion': ListadoAdmin(Coleccion, ['nombre', 'usuario', 'publica'], busqueda='nombre'),
+    'usuario': ListadoAdmin(User, ['username', 'email', 'is_staff', 'is_active', 'date_joined'], busqueda='username'),
+}
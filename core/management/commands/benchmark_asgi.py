@@ -0,0 +1,232 @@
+# core/management/commands/benchmark_asgi.py
+import asyncio
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import import_module
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+LONGITUD = re.compile(rb'\r\ncontent-length:\s*(\d+)')
+
+# Segundos máximos por respuesta antes de contarla como error
+TIMEOUT_RESPUESTA = 30
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga del catálogo: WSGI síncrono (gunicorn gthread) frente a ASGI async (uvicorn) '
+            'con distintas conexiones simultáneas. Requiere gunicorn y uvicorn instalados')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conexiones', default='50,200,1000',
+                            help='Niveles de conexiones simultáneas separados por comas')
+        parser.add_argument('--duracion', type=float, default=10, help='Segundos por nivel')
+        parser.add_argument('--ruta', default='/', help='Ruta a pedir (por defecto la portada)')
+        parser.add_argument('--servidores', default='wsgi,asgi', help='wsgi, asgi o ambos')
+        parser.add_argument('--workers', type=int, default=1, help='Procesos de cada servidor')
+        parser.add_argument('--hilos', type=int, default=8, help='Hilos por worker de gunicorn')
+        parser.add_argument('--anonimo', action='store_true',
+                            help='Peticiones anónimas (salen de la cache de páginas)')
+
+    def handle(self, *args, **options):
+        niveles = [int(nivel) for nivel in options['conexiones'].split(',')]
+        servidores = options['servidores'].split(',')
+        for servidor in servidores:
+            if servidor not in ('wsgi', 'asgi'):
+                raise CommandError(f'Servidor desconocido: {servidor}')
+            modulo = 'gunicorn' if servidor == 'wsgi' else 'uvicorn'
+            if find_spec(modulo) is None:
+                raise CommandError(f'Falta {modulo} (pip install {modulo})')
+        self._subir_limite_ficheros(max(niveles))
+
+        usuario = sesion = None
+        cookie = ''
+        if not options['anonimo']:
+            # Usuario identificado: las páginas no salen de la cache de páginas
+            usuario, sesion = self._crear_sesion()
+            cookie = f'{settings.SESSION_COOKIE_NAME}={sesion.session_key}'
+
+        resultados = []
+        try:
+            for servidor in servidores:
+                with _Servidor(servidor, options) as puerto:
+                    for conexiones in niveles:
+                        self.stdout.write(f'{servidor}: {conexiones} conexiones...')
+                        medida = asyncio.run(self._carga(
+                            puerto, options['ruta'], cookie, conexiones, options['duracion']
+                        ))
+                        resultados.append((servidor, conexiones) + medida)
+        finally:
+            if usuario is not None:
+                sesion.delete()
+                usuario.delete()
+
+        self.stdout.write(f'\nRuta {options["ruta"]}, {options["duracion"]:g}s por nivel, '
+                          f'{options["workers"]} worker(s), {os.cpu_count()} CPU')
+        self.stdout.write(f'{"servidor":<10}{"conexiones":>11}{"peticiones":>12}{"req/s":>9}'
+                          f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errores":>9}')
+        for servidor, conexiones, peticiones, por_segundo, p50, p95, p99, errores in resultados:
+            self.stdout.write(f'{servidor:<10}{conexiones:>11}{peticiones:>12}{por_segundo:>9.1f}'
+                              f'{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{errores:>9}')
+
+    def _subir_limite_ficheros(self, conexiones):
+        try:
+            import resource
+        except ImportError:
+            return
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if blando < conexiones * 2 + 100:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+
+    def _crear_sesion(self):
+        usuario = User.objects.filter(username='benchmark_asgi').first()
+        if usuario is None:
+            usuario = User.objects.create_user('benchmark_asgi')
+        sesion = import_module(settings.SESSION_ENGINE).SessionStore()
+        sesion[SESSION_KEY] = str(usuario.pk)
+        sesion[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+        sesion.save()
+        return usuario, sesion
+
+    async def _carga(self, puerto, ruta, cookie, conexiones, duracion):
+        peticion = (
+            f'GET {ruta} HTTP/1.1\r\nHost: 127.0.0.1:{puerto}\r\n'
+            + (f'Cookie: {cookie}\r\n' if cookie else '')
+            + 'Connection: keep-alive\r\n\r\n'
+        ).encode()
+        tiempos = []
+        errores = [0]
+        inicio_carga = time.perf_counter()
+        fin = inicio_carga + duracion
+
+        async def cliente():
+            lector = escritor = None
+            while time.perf_counter() < fin:
+                try:
+                    if escritor is None:
+                        lector, escritor = await asyncio.open_connection('127.0.0.1', puerto)
+                    inicio = time.perf_counter()
+                    estado, cerrar = await asyncio.wait_for(
+                        _peticion(lector, escritor, peticion), TIMEOUT_RESPUESTA
+                    )
+                    if estado >= 400:
+                        errores[0] += 1
+                    else:
+                        tiempos.append((time.perf_counter() - inicio) * 1000)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                    errores[0] += 1
+                    cerrar = True
+                if cerrar and escritor is not None:
+                    escritor.close()
+                    lector = escritor = None
+            if escritor is not None:
+                escritor.close()
+
+        await asyncio.gather(*(cliente() for _ in range(conexiones)))
+        # Las últimas respuestas llegan después de ``fin``: cuenta el tiempo real
+        transcurrido = time.perf_counter() - inicio_carga
+        if not tiempos:
+            return 0, 0.0, 0.0, 0.0, 0.0, errores[0]
+        tiempos.sort()
+        return (
+            len(tiempos),
+            len(tiempos) / transcurrido,
+            statistics.median(tiempos),
+            tiempos[int(len(tiempos) * 0.95) - 1] if len(tiempos) >= 20 else tiempos[-1],
+            tiempos[int(len(tiempos) * 0.99) - 1] if len(tiempos) >= 100 else tiempos[-1],
+            errores[0],
+        )
+
+
+async def _peticion(lector, escritor, peticion):
+    """Envía una petición y lee la respuesta completa; devuelve (estado, cerrar conexión)"""
+    escritor.write(peticion)
+    await escritor.drain()
+    cabecera = (await lector.readuntil(b'\r\n\r\n')).lower()
+    estado = int(cabecera.split(b' ', 2)[1])
+    longitud = LONGITUD.search(cabecera)
+    if longitud:
+        await lector.readexactly(int(longitud.group(1)))
+    elif b'\r\ntransfer-encoding: chunked' in cabecera:
+        while True:
+            tamano = int((await lector.readline()).split(b';')[0], 16)
+            await lector.readexactly(tamano + 2)
+            if tamano == 0:
+                break
+    else:
+        await lector.read()
+        return estado, True
+    return estado, b'\r\nconnection: close' in cabecera
+
+
+class _Servidor:
+    """Arranca gunicorn o uvicorn en un puerto libre y lo para al salir"""
+
+    def __init__(self, servidor, options):
+        self.servidor = servidor
+        self.options = options
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            puerto = sock.getsockname()[1]
+
+        if self.servidor == 'wsgi':
+            argumentos = [
+                sys.executable, '-m', 'gunicorn', 'pokemon_tcg.wsgi:application',
+                '--bind', f'127.0.0.1:{puerto}', '--workers', str(self.options['workers']),
+                '--worker-class', 'gthread', '--threads', str(self.options['hilos']),
+                '--worker-connections', '4096', '--backlog', '4096', '--log-level', 'warning',
+            ]
+        else:
+            argumentos = [
+                sys.executable, '-m', 'uvicorn', 'pokemon_tcg.asgi:application',
+                '--host', '127.0.0.1', '--port', str(puerto), '--workers', str(self.options['workers']),
+                '--backlog', '4096', '--no-access-log', '--log-level', 'warning',
+            ]
+        entorno = {
+            **os.environ,
+            'DEBUG': 'False',
+            'VISTAS_ASYNC': str(self.servidor == 'asgi'),
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'pokemon_tcg.settings'),
+        }
+        self.salida = tempfile.TemporaryFile()
+        self.proceso = subprocess.Popen(
+            argumentos, cwd=settings.BASE_DIR, env=entorno, stdout=self.salida, stderr=subprocess.STDOUT
+        )
+        self._esperar(puerto)
+        return puerto
+
+    def _esperar(self, puerto):
+        limite = time.monotonic() + 30
+        while time.monotonic() < limite:
+            if self.proceso.poll() is not None:
+                self.salida.seek(0)
+                raise CommandError(f'El servidor {self.servidor} terminó al arrancar:\n'
+                                   + self.salida.read().decode(errors='replace'))
+            try:
+                with socket.create_connection(('127.0.0.1', puerto), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise CommandError(f'El servidor {self.servidor} no respondió en 30s')
+
+    def __exit__(self, *exc):
+        self.proceso.terminate()
+        try:
+            self.proceso.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proceso.kill()
+            self.proceso.wait()
+        self.salida.close()
@@ -0,0 +1,174 @@
+# core/management/commands/benchmark_concurrencia.py
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from core.models import Carta, Inventario
+
+MODOS = {
+    'estandar': {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}},
+    'ajustado': {'ENGINE': 'core.backends.sqlite3', 'OPTIONS': {'timeout': 20}},
+}
+
+DATOS_CHECKOUT = {
+    'nombre_completo': 'Benchmark',
+    'email': 'benchmark@example.com',
+    'telefono': '600000000',
+    'direccion': 'Calle Falsa 123',
+    'ciudad': 'Madrid',
+    'provincia': 'Madrid',
+    'codigo_postal': '28001',
+    'pais': 'España',
+    'metodo_pago': 'TARJETA',
+}
+
+
+class Command(BaseCommand):
+    help = ('Escritores (añadir al carrito + checkout) y lectores (detalle de carta) concurrentes '
+            'sobre una copia de la base de datos SQLite, con el backend estándar y el ajustado')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escritores', type=int, default=4, help='Hilos que hacen checkout')
+        parser.add_argument('--lectores', type=int, default=8, help='Hilos que piden el detalle de cartas')
+        parser.add_argument('--segundos', type=float, default=5, help='Duración de cada medición')
+        parser.add_argument('--modo', action='append', choices=sorted(MODOS),
+                            help='Configuraciones a medir (repetible; por defecto las dos)')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Este benchmark solo tiene sentido con SQLite')
+
+        origen = connections['default'].settings_dict['NAME']
+        resultados = []
+        for modo in options['modo'] or ['estandar', 'ajustado']:
+            with tempfile.TemporaryDirectory() as directorio:
+                copia = os.path.join(directorio, 'benchmark.sqlite3')
+                self._copiar(origen, copia, wal=(modo == 'ajustado'))
+                self.stdout.write(f'Midiendo {modo}...')
+                resultados.append((modo, self._medir(modo, copia, options)))
+
+        self.stdout.write(
+            f'\n{"modo":<10}{"checkouts/s":>13}{"err. escritura":>16}{"ms escritura":>14}'
+            f'{"lecturas/s":>12}{"err. lectura":>14}{"ms lectura":>12}'
+        )
+        for modo, r in resultados:
+            self.stdout.write(
+                f'{modo:<10}{r["escrituras"] / r["segundos"]:>13.1f}{r["errores_escritura"]:>16}'
+                f'{r["ms_escritura"]:>14.1f}{r["lecturas"] / r["segundos"]:>12.1f}'
+                f'{r["errores_lectura"]:>14}{r["ms_lectura"]:>12.1f}'
+            )
+
+    def _copiar(self, origen, destino, wal):
+        # La API de backup da una copia coherente aunque la base esté en uso
+        with closing(sqlite3.connect(origen)) as fuente, closing(sqlite3.connect(destino)) as copia:
+            fuente.backup(copia)
+            copia.execute(f"PRAGMA journal_mode = {'WAL' if wal else 'DELETE'}")
+
+    def _medir(self, modo, nombre_base, options):
+        original = connections.settings['default']
+        connections['default'].close()
+        connections.settings['default'] = {**original, 'NAME': nombre_base, **MODOS[modo]}
+        del connections['default']
+        # Los "database is locked" esperados no se vuelcan como trazas
+        registro = logging.getLogger('django.request')
+        nivel = registro.level
+        registro.setLevel(logging.CRITICAL)
+        try:
+            with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                return self._ejecutar(options)
+        finally:
+            registro.setLevel(nivel)
+            connections['default'].close()
+            connections.settings['default'] = original
+            del connections['default']
+
+    def _ejecutar(self, options):
+        # Preparación en la copia: stock ilimitado y un usuario por hilo
+        Inventario.objects.update(cantidad_disponible=10 ** 6, cantidad_reservada=0)
+        Carta.objects.sincronizar_inventario()
+        carta_ids = list(Carta.objects.filter(inventario__isnull=False).values_list('id', flat=True))
+        if not carta_ids:
+            raise CommandError('No hay cartas con inventario')
+        total_hilos = options['escritores'] + options['lectores']
+        User.objects.bulk_create([User(username=f'benchmark_{i}') for i in range(total_hilos)])
+        usuarios = list(User.objects.filter(username__startswith='benchmark_').order_by('id'))
+
+        fin = time.perf_counter() + options['segundos']
+        estadisticas = []
+        hilos = []
+        for i, usuario in enumerate(usuarios):
+            destino = self._escritor if i < options['escritores'] else self._lector
+            fila = {'ok': 0, 'errores': 0, 'tiempo': 0.0, 'escritor': i < options['escritores']}
+            estadisticas.append(fila)
+            hilos.append(threading.Thread(target=destino, args=(usuario, carta_ids, fin, fila)))
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        def _suma(escritor, campo):
+            return sum(f[campo] for f in estadisticas if f['escritor'] == escritor)
+
+        def _ms(escritor):
+            operaciones = _suma(escritor, 'ok') + _suma(escritor, 'errores')
+            return _suma(escritor, 'tiempo') * 1000 / operaciones if operaciones else 0
+
+        return {
+            'segundos': options['segundos'],
+            'escrituras': _suma(True, 'ok'),
+            'errores_escritura': _suma(True, 'errores'),
+            'ms_escritura': _ms(True),
+            'lecturas': _suma(False, 'ok'),
+            'errores_lectura': _suma(False, 'errores'),
+            'ms_lectura': _ms(False),
+        }
+
+    def _escritor(self, usuario, carta_ids, fin, fila):
+        cliente = Client()
+        cliente.force_login(usuario)
+        url_checkout = reverse('checkout')
+        url_ok = reverse('mis_pedidos')
+        try:
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                try:
+                    carta_id = random.choice(carta_ids)
+                    cliente.post(reverse('agregar_al_carrito', args=[carta_id]), {'cantidad': 1})
+                    respuesta = cliente.post(url_checkout, DATOS_CHECKOUT)
+                    # Los errores de base de datos del checkout acaban en un redirect al carrito
+                    correcto = respuesta.status_code == 302 and respuesta.url == url_ok
+                except OperationalError:
+                    correcto = False
+                fila['tiempo'] += time.perf_counter() - inicio
+                fila['ok' if correcto else 'errores'] += 1
+        finally:
+            connections.close_all()
+
+    def _lector(self, usuario, carta_ids, fin, fila):
+        # Lector identificado: no usa la cache de páginas y suma popularidad
+        cliente = Client()
+        cliente.force_login(usuario)
+        try:
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                try:
+                    respuesta = cliente.get(reverse('detalle_carta', args=[random.choice(carta_ids)]))
+                    correcto = respuesta.status_code == 200
+                except OperationalError:
+                    correcto = False
+                fila['tiempo'] += time.perf_counter() - inicio
+                fila['ok' if correcto else 'errores'] += 1
+        finally:
+            connections.close_all()
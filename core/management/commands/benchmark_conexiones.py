@@ -0,0 +1,93 @@
+# core/management/commands/benchmark_conexiones.py
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = 'Latencia de home_view abriendo una conexión por petición frente a conexiones persistentes o pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones por configuración')
+        parser.add_argument('--url', default=None, help='URL a pedir (por defecto la portada)')
+
+    def handle(self, *args, **options):
+        url = options['url'] or reverse('home')
+        ajustes = connections['default'].settings_dict
+        if ajustes['ENGINE'] == 'core.backends.postgresql_pool':
+            configuraciones = [
+                {'nombre': 'conexión por petición', 'CONN_MAX_AGE': 0, 'ENGINE': 'django.db.backends.postgresql'},
+                {'nombre': 'pool', 'CONN_MAX_AGE': 0, 'ENGINE': ajustes['ENGINE']},
+            ]
+        else:
+            configuraciones = [
+                {'nombre': 'conexión por petición', 'CONN_MAX_AGE': 0, 'ENGINE': ajustes['ENGINE']},
+                {'nombre': 'persistente', 'CONN_MAX_AGE': ajustes['CONN_MAX_AGE'] or 60, 'ENGINE': ajustes['ENGINE']},
+            ]
+
+        usuario = User.objects.filter(username='benchmark_conexiones').first()
+        if usuario is None:
+            usuario = User.objects.create_user('benchmark_conexiones')
+
+        resultados = []
+        try:
+            for configuracion in configuraciones:
+                resultados.append((configuracion.pop('nombre'),) + self._medir(url, usuario, options['peticiones'], configuracion))
+        finally:
+            usuario.delete()
+
+        self.stdout.write(f'\nPerfil {settings.DB_PERFIL}, {connections["default"].settings_dict["ENGINE"]}')
+        self.stdout.write(f'{"configuración":<26}{"conexiones":>12}{"media ms":>10}{"p50 ms":>9}{"p95 ms":>9}')
+        for nombre, conexiones, media, p50, p95 in resultados:
+            self.stdout.write(f'{nombre:<26}{conexiones:>12}{media:>10.2f}{p50:>9.2f}{p95:>9.2f}')
+
+    def _medir(self, url, usuario, peticiones, configuracion):
+        ajustes = connections.settings['default']
+        originales = {clave: ajustes[clave] for clave in configuracion}
+        connections['default'].close()
+        ajustes.update(configuracion)
+        del connections['default']
+
+        abiertas = []
+
+        def _contar(sender, connection, **kwargs):
+            abiertas.append(connection.alias)
+
+        connection_created.connect(_contar)
+        tiempos = []
+        try:
+            with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                # Usuario identificado: la portada no sale de la cache de páginas
+                cliente = Client()
+                cliente.force_login(usuario)
+                cliente.get(url)
+                close_old_connections()
+                abiertas.clear()
+                for _ in range(peticiones):
+                    inicio = time.perf_counter()
+                    respuesta = cliente.get(url)
+                    # El cliente de pruebas no emite request_finished como un servidor WSGI
+                    close_old_connections()
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                    if respuesta.status_code != 200:
+                        raise CommandError(f'{url} devolvió {respuesta.status_code}')
+        finally:
+            connection_created.disconnect(_contar)
+            connections['default'].close()
+            ajustes.update(originales)
+            del connections['default']
+
+        tiempos.sort()
+        return (
+            len(abiertas),
+            statistics.mean(tiempos),
+            statistics.median(tiempos),
+            tiempos[int(len(tiempos) * 0.95) - 1],
+        )
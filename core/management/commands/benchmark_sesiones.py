@@ -0,0 +1,74 @@
+# core/management/commands/benchmark_sesiones.py
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core.models import Inventario
+
+
+class Deshacer(Exception):
+    """Fuerza el rollback de los datos creados por el benchmark"""
+
+
+class Command(BaseCommand):
+    help = 'Mide consultas a la base de datos por petición con cada motor de sesiones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/', help='URL a pedir')
+        parser.add_argument('--peticiones', type=int, default=50, help='Peticiones por motor')
+        parser.add_argument('--modo', action='append', choices=sorted(settings.MOTORES_SESION),
+                            help='Motores a medir (repetible; por defecto todos)')
+
+    def handle(self, *args, **options):
+        modos = options['modo'] or list(settings.MOTORES_SESION)
+        resultados = []
+        try:
+            # Todo lo que se crea aquí (usuario, sesiones, carritos) se deshace al final
+            with transaction.atomic():
+                usuario = User.objects.create_user('benchmark_sesiones', password='benchmark')
+                carta_id = Inventario.objects.filter(cantidad_disponible__gt=0).values_list('carta_id', flat=True).first()
+                for modo in modos:
+                    for escenario in ('anonimo', 'autenticado'):
+                        resultados.append((modo, escenario) + self._medir(
+                            modo, escenario, usuario, carta_id, options['url'], options['peticiones']
+                        ))
+                raise Deshacer
+        except Deshacer:
+            pass
+
+        self.stdout.write(f'\n{"motor":<16}{"escenario":<14}{"consultas/pet.":>16}{"de sesión/pet.":>16}{"ms/pet.":>10}')
+        for modo, escenario, consultas, de_sesion, ms in resultados:
+            self.stdout.write(f'{modo:<16}{escenario:<14}{consultas:>16.2f}{de_sesion:>16.2f}{ms:>10.2f}')
+
+    def _medir(self, modo, escenario, usuario, carta_id, url, peticiones):
+        hosts = settings.ALLOWED_HOSTS + ['testserver']
+        with override_settings(SESSION_ENGINE=settings.MOTORES_SESION[modo], ALLOWED_HOSTS=hosts):
+            caches[settings.SESSION_CACHE_ALIAS].clear()
+            # Cliente nuevo: SessionMiddleware importa el motor al cargarse
+            cliente = Client()
+            if escenario == 'autenticado':
+                cliente.force_login(usuario)
+            elif carta_id:
+                # Visitante anónimo con carrito en sesión
+                cliente.post(f'/carrito/agregar/{carta_id}/', {'cantidad': 1})
+
+            respuesta = cliente.get(url)  # calentamiento
+            if respuesta.status_code >= 400:
+                raise CommandError(f'{url} devolvió {respuesta.status_code}')
+
+            consultas = de_sesion = 0
+            inicio = time.perf_counter()
+            for _ in range(peticiones):
+                with CaptureQueriesContext(connection) as capturadas:
+                    cliente.get(url)
+                consultas += len(capturadas)
+                de_sesion += sum('django_session' in q['sql'] for q in capturadas.captured_queries)
+            duracion = time.perf_counter() - inicio
+
+        return consultas / peticiones, de_sesion / peticiones, duracion * 1000 / peticiones
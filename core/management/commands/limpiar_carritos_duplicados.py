@@ -1,85 +1,137 @@
 # core/management/commands/limpiar_carritos_duplicados.py
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.db.models import Count
 from core.models import Pedido, ItemPedido
+from core.cache_paginas import invalidar_etiquetas
+
+
+def planificar_consolidacion(usuario_ids):
+    """
+    Calcula cómo fusionar los carritos de un bloque de usuarios.
+    El carrito más reciente de cada usuario se conserva; de cada carta queda
+    un solo item (el del carrito principal si lo tiene) con la suma de cantidades.
+    """
+    carritos = list(Pedido.objects.filter(
+        cliente_id__in=usuario_ids,
+        estado='CARRITO'
+    ).order_by('cliente_id', '-fecha_pedido', '-id').values_list('id', 'cliente_id'))
+
+    principal = {}  # cliente -> carrito principal
+    rango = {}      # carrito -> posición (0 = más reciente)
+    cliente_de = {}
+    contador = {}
+    for carrito_id, cliente_id in carritos:
+        principal.setdefault(cliente_id, carrito_id)
+        rango[carrito_id] = contador.get(cliente_id, 0)
+        contador[cliente_id] = rango[carrito_id] + 1
+        cliente_de[carrito_id] = cliente_id
+
+    items = ItemPedido.objects.filter(
+        pedido_id__in=list(cliente_de)
+    ).order_by().values_list('id', 'pedido_id', 'carta_id', 'cantidad', 'precio_unitario')
+
+    # (cliente, carta) -> [item superviviente, cantidad total]
+    grupos = {}
+    eliminar = []
+    for item_id, pedido_id, carta_id, cantidad, precio in sorted(items, key=lambda i: rango[i[1]]):
+        clave = (cliente_de[pedido_id], carta_id)
+        if clave in grupos:
+            grupos[clave][1] += cantidad
+            eliminar.append(item_id)
+        else:
+            grupos[clave] = [(item_id, pedido_id, precio), cantidad]
+
+    actualizar = []
+    movidos = 0
+    for (cliente_id, _), ((item_id, pedido_id, precio), cantidad) in grupos.items():
+        destino = principal[cliente_id]
+        if pedido_id != destino:
+            movidos += 1
+        actualizar.append(ItemPedido(
+            id=item_id, pedido_id=destino, cantidad=cantidad, subtotal=precio * cantidad
+        ))
+
+    principales = set(principal.values())
+    return {
+        'principales': list(principales),
+        'secundarios': [c for c in cliente_de if c not in principales],
+        'clientes': list(principal),
+        'actualizar': actualizar,
+        'eliminar': eliminar,
+        'movidos': movidos,
+    }
+
+
+def aplicar_consolidacion(plan):
+    """Ejecuta el plan con unas pocas sentencias agrupadas"""
+    with transaction.atomic():
+        if plan['eliminar']:
+            # Pocos por usuario: delete() envía post_delete (invalidación del carrito) y
+            # no se salta los receptores que se añadan a ItemPedido
+            ItemPedido.objects.filter(id__in=plan['eliminar']).delete()
+        if plan['actualizar']:
+            ItemPedido.objects.bulk_update(plan['actualizar'], ['pedido', 'cantidad', 'subtotal'], batch_size=500)
+        Pedido.objects.filter(id__in=plan['secundarios']).delete()
+        etiquetas = [f"carrito:{cliente_id}" for cliente_id in plan['clientes']]
+        transaction.on_commit(lambda: invalidar_etiquetas(*etiquetas))
+
 
 class Command(BaseCommand):
     help = 'Limpia carritos duplicados para cada usuario'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Muestra lo que se haría sin modificar nada')
+        parser.add_argument('--bloque', type=int, default=500, help='Usuarios por bloque')
+
     def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        bloque = options['bloque']
+
         # Encontrar usuarios con múltiples carritos
-        usuarios_con_duplicados = Pedido.objects.filter(
+        usuarios_con_duplicados = list(Pedido.objects.filter(
             estado='CARRITO'
         ).values('cliente').annotate(
             total=Count('id')
-        ).filter(total__gt=1)
-        
-        total_consolidados = 0
+        ).filter(total__gt=1).order_by('cliente').values_list('cliente', flat=True))
+
+        total_usuarios = len(usuarios_con_duplicados)
         total_eliminados = 0
-        
-        for usuario_data in usuarios_con_duplicados:
-            usuario_id = usuario_data['cliente']
-            
-            # Obtener carritos del usuario
-            carritos = Pedido.objects.filter(
-                cliente_id=usuario_id,
-                estado='CARRITO'
-            ).order_by('-fecha_pedido')
-            
-            if carritos.count() < 2:
-                continue
-            
-            # Tomar el más reciente como principal
-            carrito_principal = carritos.first()
-            
-            # Consolidar items de otros carritos
-            for carrito in carritos[1:]:
-                items_movidos = 0
-                
-                # Necesitamos copiar los items para iterar
-                items = list(carrito.items.all())
-                
-                for item in items:
-                    # Verificar si ya existe el item en el carrito principal
-                    item_existente = carrito_principal.items.filter(
-                        carta=item.carta,
-                        inventario=item.inventario
-                    ).first()
-                    
-                    if item_existente:
-                        # Sumar cantidades
-                        item_existente.cantidad += item.cantidad
-                        item_existente.calcular_subtotal()
-                        item_existente.save()
-                        item.delete()  # Eliminar el item duplicado
-                    else:
-                        # Mover item al carrito principal
-                        item.pedido = carrito_principal
-                        item.save()
-                        items_movidos += 1
-                
-                # Eliminar carrito duplicado (vacío)
-                carrito.delete()
-                total_eliminados += 1
-                total_consolidados += items_movidos
-            
+        total_movidos = 0
+        total_fusionados = 0
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('Modo de prueba: no se modificará nada'))
+        self.stdout.write(f'Usuarios con carritos duplicados: {total_usuarios}')
+
+        for inicio in range(0, total_usuarios, bloque):
+            usuario_ids = usuarios_con_duplicados[inicio:inicio + bloque]
+            plan = planificar_consolidacion(usuario_ids)
+
+            if not dry_run:
+                aplicar_consolidacion(plan)
+
+            total_eliminados += len(plan['secundarios'])
+            total_movidos += plan['movidos']
+            total_fusionados += len(plan['eliminar'])
+
             self.stdout.write(
-                self.style.SUCCESS(
-                    f'Consolidado carrito para usuario {usuario_id}. '
-                    f'{items_movidos} items movidos, 1 carrito eliminado.'
-                )
+                f'  [{min(inicio + bloque, total_usuarios)}/{total_usuarios}] '
+                f'{len(plan["secundarios"])} carritos a eliminar, '
+                f'{plan["movidos"]} items movidos, {len(plan["eliminar"])} items fusionados'
             )
-        
-        # Recalcular totales de todos los carritos restantes
+
+        # Recalcular totales de todos los carritos restantes en un solo UPDATE
         carritos_restantes = Pedido.objects.filter(estado='CARRITO')
-        for carrito in carritos_restantes:
-            carrito.calcular_totales()
-        
+        if not dry_run:
+            carritos_restantes.recalcular_totales()
+
         self.stdout.write(
             self.style.SUCCESS(
-                f'\n✅ Proceso completado:\n'
+                f'\n✅ Proceso completado{" (prueba)" if dry_run else ""}:\n'
                 f'   - Carritos eliminados: {total_eliminados}\n'
-                f'   - Items consolidados: {total_consolidados}\n'
+                f'   - Items movidos: {total_movidos}\n'
+                f'   - Items fusionados: {total_fusionados}\n'
                 f'   - Carritos restantes: {carritos_restantes.count()}'
             )
-        )
\ No newline at end of file
+        )
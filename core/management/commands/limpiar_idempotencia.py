@@ -0,0 +1,40 @@
+# core/management/commands/limpiar_idempotencia.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ClaveIdempotencia
+
+
+class Command(BaseCommand):
+    help = 'Borra por bloques las claves de idempotencia de pagos caducadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bloque', type=int, default=1000, help='Claves borradas por transacción')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta las claves caducadas')
+
+    def handle(self, *args, **options):
+        caducadas = ClaveIdempotencia.objects.filter(expira__lte=timezone.now())
+
+        if options['dry_run']:
+            self.stdout.write(f'Claves caducadas: {caducadas.count()}')
+            return
+
+        bloque = options['bloque']
+        total = 0
+        inicio = time.perf_counter()
+        while True:
+            with transaction.atomic():
+                ids = list(caducadas.values_list('pk', flat=True)[:bloque])
+                if not ids:
+                    break
+                # Sin señales ni relaciones que la apunten: delete() es un solo DELETE
+                total += ClaveIdempotencia.objects.filter(pk__in=ids).delete()[0]
+            if len(ids) < bloque:
+                break
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {total} claves caducadas borradas en {time.perf_counter() - inicio:.2f}s'
+        ))
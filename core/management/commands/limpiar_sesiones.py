@@ -0,0 +1,59 @@
+# core/management/commands/limpiar_sesiones.py
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+# Motores que guardan las sesiones en la tabla django_session
+MOTORES_CON_TABLA = {
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+}
+
+
+class Command(BaseCommand):
+    help = 'Borra las sesiones caducadas por bloques (alternativa a clearsessions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bloque', type=int, default=1000, help='Sesiones borradas por transacción')
+        parser.add_argument('--pausa', type=float, default=0.05,
+                            help='Segundos de espera entre bloques para no bloquear otras escrituras')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta las sesiones caducadas')
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE not in MOTORES_CON_TABLA:
+            self.stdout.write(self.style.WARNING(
+                f'El motor {settings.SESSION_ENGINE} no guarda sesiones en la base de datos; no hay nada que limpiar'
+            ))
+            return
+
+        ahora = timezone.now()
+        caducadas = Session.objects.filter(expire_date__lt=ahora)
+
+        if options['dry_run']:
+            self.stdout.write(f'Sesiones caducadas: {caducadas.count()}')
+            return
+
+        bloque = options['bloque']
+        total = 0
+        inicio = time.perf_counter()
+        while True:
+            # Transacciones cortas: el bloqueo de escritura se libera en cada bloque
+            with transaction.atomic():
+                claves = list(caducadas.values_list('session_key', flat=True)[:bloque])
+                if not claves:
+                    break
+                # Session no tiene señales ni relaciones: delete() es un solo DELETE
+                borradas = Session.objects.filter(session_key__in=claves).delete()[0]
+            total += borradas
+            self.stdout.write(f'  {total} sesiones borradas')
+            if len(claves) < bloque:
+                break
+            time.sleep(options['pausa'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {total} sesiones caducadas borradas en {time.perf_counter() - inicio:.2f}s'
+        ))
@@ -0,0 +1,57 @@
+# core/management/commands/procesar_outbox.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = 'Procesa por lotes los eventos de pedidos del outbox (stock, popularidad y emails)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='Eventos tomados por lote')
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Segundos de espera cuando la cola está vacía (0 = vaciarla y terminar)')
+        parser.add_argument('--purgar', type=int, default=None, metavar='DIAS',
+                            help='Borra antes los eventos procesados hace más de DIAS días')
+        parser.add_argument('--fallidos', action='store_true',
+                            help='Lista los eventos que agotaron los reintentos y termina')
+
+    def handle(self, *args, **options):
+        if options['fallidos']:
+            fallidos = outbox.fallidos()
+            for evento in fallidos:
+                ultima_linea = evento.ultimo_error.strip().splitlines()[-1:] or ['']
+                self.stdout.write(
+                    f'  #{evento.pk} {evento.tipo} {evento.manejador} pedido {evento.pedido_id}: {ultima_linea[0]}'
+                )
+            self.stdout.write(f'{len(fallidos)} eventos fallidos')
+            return
+
+        if options['purgar'] is not None:
+            borrados = outbox.purgar(options['purgar'])
+            self.stdout.write(f'{borrados} eventos procesados purgados')
+
+        total = errores_total = 0
+        inicio = time.perf_counter()
+        try:
+            while True:
+                procesados, errores = outbox.procesar_lote(options['lote'])
+                total += procesados
+                errores_total += errores
+                if procesados or errores:
+                    self.stdout.write(f'  lote: {procesados} procesados, {errores} con error')
+                    continue
+                if not options['intervalo']:
+                    break
+                # Worker continuo: como una petición, no guarda conexiones caducadas
+                close_old_connections()
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {total} eventos procesados, {errores_total} con error, en {time.perf_counter() - inicio:.2f}s'
+        ))
@@ -0,0 +1,52 @@
+# core/management/commands/procesar_tareas.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import acciones_masivas
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta por bloques las acciones masivas del admin encoladas como TareaMasiva'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bloque', type=int, default=None,
+                            help='Filas por bloque (por defecto ACCIONES_TAMANO_BLOQUE)')
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Segundos de espera cuando no hay tareas (0 = vaciar la cola y terminar)')
+
+    def handle(self, *args, **options):
+        terminadas = errores = 0
+        inicio = time.perf_counter()
+        try:
+            while True:
+                tarea = acciones_masivas.tomar_tarea()
+                if tarea is None:
+                    if not options['intervalo']:
+                        break
+                    close_old_connections()
+                    time.sleep(options['intervalo'])
+                    continue
+
+                self.stdout.write(f'  tarea #{tarea.pk} {tarea.accion}: {tarea.total} filas')
+                try:
+                    acciones_masivas.procesar_tarea(tarea, options['bloque'], progreso=self._progreso)
+                except acciones_masivas.TareaReclamada as e:
+                    self.stderr.write(f'  tarea #{tarea.pk} abandonada: {e}')
+                    continue
+                except Exception as e:
+                    errores += 1
+                    self.stderr.write(f'  tarea #{tarea.pk} con error: {e!r}')
+                    continue
+                terminadas += 1
+                self.stdout.write(f'  tarea #{tarea.pk} terminada: {tarea.afectados} filas afectadas')
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {terminadas} tareas terminadas, {errores} con error, en {time.perf_counter() - inicio:.2f}s'
+        ))
+
+    def _progreso(self, tarea):
+        self.stdout.write(f'    {tarea.procesados}/{tarea.total} ({tarea.progreso}%)')
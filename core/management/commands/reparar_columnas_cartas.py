@@ -0,0 +1,33 @@
+# core/management/commands/reparar_columnas_cartas.py
+from django.core.management.base import BaseCommand
+
+from core.models import Carta
+
+
+class Command(BaseCommand):
+    help = 'Recalcula precio_vigente y stock_real de las cartas a partir de su inventario'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra las cartas desincronizadas')
+        parser.add_argument('--mostrar', type=int, default=20, help='Cartas desincronizadas a mostrar')
+
+    def handle(self, *args, **options):
+        desincronizadas = Carta.objects.desincronizadas().order_by('id')
+        total = desincronizadas.count()
+
+        for carta in desincronizadas.values('id', 'codigo', 'precio_vigente', 'precio_inventario',
+                                            'stock_real', 'stock_inventario')[:options['mostrar']]:
+            self.stdout.write(
+                f"  #{carta['id']} {carta['codigo']}: precio {carta['precio_vigente']} -> {carta['precio_inventario']}, "
+                f"stock {carta['stock_real']} -> {carta['stock_inventario']}"
+            )
+        if total > options['mostrar']:
+            self.stdout.write(f'  ... y {total - options["mostrar"]} más')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Modo de prueba: {total} cartas desincronizadas'))
+            return
+
+        # Un solo UPDATE para todas las cartas (las sincronizadas no cambian)
+        Carta.objects.sincronizar_inventario()
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} cartas reparadas'))
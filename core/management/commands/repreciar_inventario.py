@@ -0,0 +1,96 @@
+# core/management/commands/repreciar_inventario.py
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.precios import ReglaPrecio, Repreciador
+
+
+def _decimal(valor):
+    try:
+        return Decimal(valor)
+    except (InvalidOperation, TypeError):
+        raise CommandError(f'Valor numérico no válido: {valor}')
+
+
+class Command(BaseCommand):
+    help = 'Cambia precios del inventario en bloque (por defecto solo muestra las diferencias)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rareza', action='append', default=[], help='Rareza (repetible)')
+        parser.add_argument('--condicion', action='append', default=[], help='Condición (repetible)')
+        parser.add_argument('--expansion', action='append', default=[], help='Código de expansión (repetible)')
+        parser.add_argument('--porcentaje', default='0', help='Variación en %% (ej. 10 o -15)')
+        parser.add_argument('--minimo', help='Precio mínimo resultante')
+        parser.add_argument('--maximo', help='Precio máximo resultante')
+        parser.add_argument('--campo', default='precio', choices=['precio', 'precio_promocional'])
+        parser.add_argument('--reglas', help='Fichero JSON con una lista de reglas (sustituye a las opciones anteriores)')
+        parser.add_argument('--aplicar', action='store_true', help='Guarda los cambios (sin esto es una prueba)')
+        parser.add_argument('--mostrar', type=int, default=20, help='Diferencias a mostrar')
+        parser.add_argument('--bloque', type=int, default=2000, help='Filas por bulk_update')
+
+    def _reglas(self, options):
+        if options['reglas']:
+            with open(options['reglas'], encoding='utf-8') as f:
+                datos = json.load(f)
+            reglas = []
+            for regla in datos:
+                reglas.append(ReglaPrecio(
+                    porcentaje=_decimal(regla.get('porcentaje', 0)),
+                    rarezas=tuple(regla.get('rarezas', ())),
+                    condiciones=tuple(regla.get('condiciones', ())),
+                    expansiones=tuple(regla.get('expansiones', ())),
+                    minimo=_decimal(regla['minimo']) if regla.get('minimo') is not None else None,
+                    maximo=_decimal(regla['maximo']) if regla.get('maximo') is not None else None,
+                    campo=regla.get('campo', 'precio'),
+                ))
+            return reglas
+
+        return [ReglaPrecio(
+            porcentaje=_decimal(options['porcentaje']),
+            rarezas=tuple(options['rareza']),
+            condiciones=tuple(options['condicion']),
+            expansiones=tuple(options['expansion']),
+            minimo=_decimal(options['minimo']) if options['minimo'] else None,
+            maximo=_decimal(options['maximo']) if options['maximo'] else None,
+            campo=options['campo'],
+        )]
+
+    def handle(self, *args, **options):
+        try:
+            repreciador = Repreciador(self._reglas(options))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        inicio = time.perf_counter()
+        if options['aplicar']:
+            plan = repreciador.aplicar(tamano_bloque=options['bloque'])
+        else:
+            plan = repreciador.calcular()
+        duracion = time.perf_counter() - inicio
+
+        for cambio in plan.cambios(limite=options['mostrar']):
+            precio_antes, precio_despues = cambio['precio']
+            promo_antes, promo_despues = cambio['precio_promocional']
+            self.stdout.write(
+                f"  #{cambio['id']} {cambio['expansion']} {cambio['rareza']}/{cambio['condicion']}: "
+                f"precio {precio_antes} -> {precio_despues}, "
+                f"promocional {promo_antes} -> {promo_despues}"
+            )
+        if len(plan) > options['mostrar']:
+            self.stdout.write(f'  ... y {len(plan) - options["mostrar"]} cambios más')
+
+        resumen = plan.resumen()
+        self.stdout.write(
+            f"\nFilas evaluadas: {resumen['filas']} | Filas con cambios: {resumen['cambios']} | {duracion:.2f}s\n"
+            f"Suma de precios: {resumen['precio_total_antes']} -> {resumen['precio_total_despues']}\n"
+            f"Suma de promocionales: {resumen['precio_promocional_total_antes']} -> "
+            f"{resumen['precio_promocional_total_despues']}"
+        )
+
+        if options['aplicar']:
+            self.stdout.write(self.style.SUCCESS(f'✅ {len(plan)} precios actualizados'))
+        else:
+            self.stdout.write(self.style.WARNING('Modo de prueba: no se ha guardado nada (usa --aplicar)'))
@@ -0,0 +1,121 @@
+# core/management/commands/simulador_pasarela.py
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request
+from urllib.error import URLError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.pasarela import CABECERA_FIRMA, firmar
+
+
+class Command(BaseCommand):
+    help = ('Pasarela de pagos simulada: acepta cobros en POST /cobros y notifica el resultado '
+            'al webhook de la tienda tras una latencia aleatoria')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puerto', type=int, default=8765)
+        parser.add_argument('--latencia-min', type=float, default=0.5, help='Segundos mínimos hasta el webhook')
+        parser.add_argument('--latencia-max', type=float, default=3.0, help='Segundos máximos hasta el webhook')
+        parser.add_argument('--rechazos', type=float, default=0.1, help='Proporción de cobros rechazados')
+        parser.add_argument('--errores', type=float, default=0.0,
+                            help='Proporción de peticiones respondidas con 503 (el outbox las reintenta)')
+        parser.add_argument('--reintentos-webhook', type=int, default=5,
+                            help='Reintentos del webhook si la tienda no responde 2xx')
+        parser.add_argument('--semilla', type=int, default=None, help='Semilla aleatoria (resultados repetibles)')
+
+    def handle(self, *args, **options):
+        self.opciones = options
+        self.azar = random.Random(options['semilla'])
+        self.secreto = settings.PASARELA_SECRETO
+        # transaccion_id -> estado; los cobros repetidos no se procesan dos veces
+        self.cobros = {}
+        self.cerrojo = threading.Lock()
+
+        servidor = ThreadingHTTPServer(('127.0.0.1', options['puerto']), self._manejador())
+        servidor.daemon_threads = True
+        self.stdout.write(self.style.SUCCESS(
+            f"Pasarela simulada en http://127.0.0.1:{options['puerto']} "
+            f"(latencia {options['latencia_min']}-{options['latencia_max']}s, "
+            f"rechazos {options['rechazos']:.0%}, errores {options['errores']:.0%})"
+        ))
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+
+    def _manejador(self):
+        simulador = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_POST(self):
+                cuerpo = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                codigo, respuesta = simulador.recibir_cobro(self.path, cuerpo, self.headers.get(CABECERA_FIRMA, ''))
+                datos = json.dumps(respuesta).encode()
+                self.send_response(codigo)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, formato, *args):
+                pass
+
+        return Manejador
+
+    def recibir_cobro(self, ruta, cuerpo, firma):
+        if ruta.rstrip('/') != '/cobros':
+            return 404, {'error': 'Ruta desconocida'}
+        if firma != firmar(cuerpo, self.secreto):
+            return 401, {'error': 'Firma no válida'}
+        try:
+            cobro = json.loads(cuerpo)
+            transaccion_id = cobro['transaccion_id']
+            webhook_url = cobro['webhook_url']
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'Cobro mal formado'}
+
+        with self.cerrojo:
+            if transaccion_id in self.cobros:
+                return 200, {'transaccion_id': transaccion_id, 'estado': self.cobros[transaccion_id]}
+            if self.azar.random() < self.opciones['errores']:
+                return 503, {'error': 'Pasarela no disponible'}
+            aprobado = self.azar.random() >= self.opciones['rechazos']
+            latencia = self.azar.uniform(self.opciones['latencia_min'], self.opciones['latencia_max'])
+            self.cobros[transaccion_id] = 'procesando'
+
+        threading.Thread(
+            target=self._notificar, args=(transaccion_id, webhook_url, aprobado, latencia), daemon=True
+        ).start()
+        self.stdout.write(f"  cobro {transaccion_id} {cobro.get('importe')} {cobro.get('moneda', '')} aceptado")
+        return 202, {'transaccion_id': transaccion_id, 'estado': 'procesando'}
+
+    def _notificar(self, transaccion_id, webhook_url, aprobado, latencia):
+        time.sleep(latencia)
+        estado = 'aprobado' if aprobado else 'rechazado'
+        with self.cerrojo:
+            self.cobros[transaccion_id] = estado
+        cuerpo = json.dumps({
+            'transaccion_id': transaccion_id,
+            'estado': estado,
+            'motivo': '' if aprobado else 'Pago rechazado por la entidad emisora',
+        }).encode()
+        peticion = urllib_request.Request(
+            webhook_url, data=cuerpo, method='POST',
+            headers={'Content-Type': 'application/json', CABECERA_FIRMA: firmar(cuerpo, self.secreto)},
+        )
+        for intento in range(self.opciones['reintentos_webhook'] + 1):
+            try:
+                with urllib_request.urlopen(peticion, timeout=10):
+                    self.stdout.write(f'  webhook {transaccion_id} {estado} ({latencia:.2f}s)')
+                    return
+            except (URLError, OSError) as e:
+                error = e
+            time.sleep(2 ** intento)
+        self.stderr.write(f'  webhook {transaccion_id} sin entregar: {error}')
@@ -0,0 +1,41 @@
+# core/management/commands/sincronizar_replica.py
+import sqlite3
+import time
+from contextlib import closing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copia la base de datos SQLite principal en la réplica de lectura con la API de backup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Repite la copia cada N segundos (0 = una sola vez)')
+        parser.add_argument('--paginas', type=int, default=1024,
+                            help='Páginas copiadas por paso (la primaria no se bloquea durante toda la copia)')
+
+    def handle(self, *args, **options):
+        if 'replica' not in connections.settings:
+            raise CommandError('No hay alias "replica" configurado (DB_REPLICA_NAME)')
+        primaria = connections['default']
+        replica = connections['replica']
+        if primaria.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Solo para SQLite; con PostgreSQL usa la replicación del propio servidor')
+
+        origen = primaria.settings_dict['NAME']
+        destino = replica.settings_dict['NAME']
+        if str(origen) == str(destino):
+            raise CommandError('La réplica y la primaria son el mismo fichero')
+
+        while True:
+            inicio = time.perf_counter()
+            with closing(sqlite3.connect(origen)) as fuente, closing(sqlite3.connect(destino)) as copia:
+                fuente.backup(copia, pages=options['paginas'])
+                copia.execute('PRAGMA journal_mode = WAL')
+            self.stdout.write(f'Réplica sincronizada en {time.perf_counter() - inicio:.2f}s: {destino}')
+
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:18
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from core.models import COSTE_ENVIO, ENVIO_GRATIS_DESDE, TIPO_IVA, redondear_dinero
+
+
+def fusionar_carritos_duplicados(apps, schema_editor):
+    """Deja un solo carrito por cliente antes de crear la restricción"""
+    Pedido = apps.get_model('core', 'Pedido')
+    ItemPedido = apps.get_model('core', 'ItemPedido')
+
+    clientes = Pedido.objects.filter(estado='CARRITO').values('cliente').annotate(
+        total=Count('id')
+    ).filter(total__gt=1).values_list('cliente', flat=True)
+
+    for cliente_id in list(clientes):
+        carritos = list(Pedido.objects.filter(
+            cliente_id=cliente_id, estado='CARRITO'
+        ).order_by('-fecha_pedido', '-id'))
+        principal, duplicados = carritos[0], carritos[1:]
+        items_principal = {item.carta_id: item for item in ItemPedido.objects.filter(pedido=principal)}
+
+        for carrito in duplicados:
+            for item in ItemPedido.objects.filter(pedido=carrito):
+                existente = items_principal.get(item.carta_id)
+                if existente:
+                    existente.cantidad += item.cantidad
+                    existente.subtotal = existente.precio_unitario * existente.cantidad
+                    existente.save()
+                    item.delete()
+                else:
+                    item.pedido = principal
+                    item.save()
+                    items_principal[item.carta_id] = item
+            carrito.delete()
+
+        # Totales del carrito con sus nuevos items (como Pedido.calcular_totales)
+        subtotal = sum(
+            (item.precio_unitario * item.cantidad for item in ItemPedido.objects.filter(pedido=principal)),
+            Decimal('0.00'),
+        )
+        principal.subtotal = subtotal
+        principal.envio = Decimal('0.00') if subtotal >= ENVIO_GRATIS_DESDE else COSTE_ENVIO
+        principal.impuestos = redondear_dinero(subtotal * TIPO_IVA)
+        principal.total = redondear_dinero(subtotal + principal.envio + principal.impuestos - principal.descuento)
+        principal.save(update_fields=['subtotal', 'envio', 'impuestos', 'total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_carta_categoria_alter_pedido_ciudad'),
+    ]
+
+    operations = [
+        migrations.RunPython(fusionar_carritos_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pedido',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'CARRITO')), fields=('cliente',), name='pedido_un_carrito_por_cliente'),
+        ),
+    ]
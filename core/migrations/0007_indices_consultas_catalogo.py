@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_pedido_un_carrito_por_cliente'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carta',
+            index=models.Index(condition=models.Q(('coleccionable', True)), fields=['-popularidad'], name='carta_colec_popularidad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carta',
+            index=models.Index(condition=models.Q(('coleccionable', True)), fields=['-fecha_creacion'], name='carta_colec_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carta',
+            index=models.Index(condition=models.Q(('coleccionable', True)), fields=['nombre'], name='carta_colec_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventario',
+            index=models.Index(condition=models.Q(('en_promocion', True)), fields=['carta'], name='inventario_promocion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resena',
+            index=models.Index(condition=models.Q(('aprobada', True)), fields=['carta', '-fecha_creacion'], name='resena_carta_aprobada_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:30
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def rellenar_columnas_inventario(apps, schema_editor):
+    """Copia precio vigente y stock de cada inventario a su carta"""
+    Carta = apps.get_model('core', 'Carta')
+    Inventario = apps.get_model('core', 'Inventario')
+
+    inventario = Inventario.objects.filter(carta=models.OuterRef('pk')).order_by()
+    precio_actual = models.Case(
+        models.When(
+            models.Q(en_promocion=True, precio_promocional__isnull=False) & ~models.Q(precio_promocional=0),
+            then=models.F('precio_promocional'),
+        ),
+        default=models.F('precio'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+    Carta.objects.update(
+        precio_vigente=models.Subquery(inventario.values(vigente=precio_actual)[:1]),
+        stock_real=Coalesce(
+            models.Subquery(inventario.values(
+                existencias=models.F('cantidad_disponible') - models.F('cantidad_reservada')
+            )[:1]),
+            models.Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_indices_consultas_catalogo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carta',
+            name='precio_vigente',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='carta',
+            name='stock_real',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(rellenar_columnas_inventario, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='carta',
+            index=models.Index(condition=models.Q(('coleccionable', True)), fields=['precio_vigente'], name='carta_colec_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carta',
+            index=models.Index(condition=models.Q(('coleccionable', True), ('stock_real__gt', 0)), fields=['precio_vigente'], name='carta_colec_stock_precio_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_carta_precio_vigente_stock_real'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('pedido.realizado', 'Pedido realizado'), ('pedido.pagado', 'Pedido pagado'), ('pedido.confirmado', 'Pedido confirmado'), ('pedido.enviado', 'Pedido enviado'), ('pedido.entregado', 'Pedido entregado'), ('pedido.cancelado', 'Pedido cancelado')], max_length=50)),
+                ('datos', models.JSONField(blank=True, default=dict)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('ultimo_error', models.TextField(blank=True, default='')),
+                ('fecha_procesado', models.DateTimeField(blank=True, null=True)),
+                ('pedido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eventos', to='core.pedido')),
+            ],
+            options={
+                'verbose_name': 'Evento de outbox',
+                'verbose_name_plural': 'Eventos de outbox',
+                'ordering': ['id'],
+                'indexes': [models.Index(condition=models.Q(('fecha_procesado__isnull', True)), fields=['disponible_desde', 'id'], name='outbox_pendientes_idx')],
+            },
+        ),
+    ]
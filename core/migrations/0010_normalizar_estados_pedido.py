@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+# Códigos abreviados que usaban algunas vistas y que no están en Pedido.ESTADOS
+ESTADOS_ANTIGUOS = {
+    'PEND': 'PENDIENTE',
+    'PROC': 'PAGADO',
+    'ENVI': 'ENVIADO',
+    'ENTR': 'ENTREGADO',
+    'CANC': 'CANCELADO',
+}
+
+
+def normalizar_estados(apps, schema_editor):
+    Pedido = apps.get_model('core', 'Pedido')
+    EventoOutbox = apps.get_model('core', 'EventoOutbox')
+    for antiguo, nuevo in ESTADOS_ANTIGUOS.items():
+        Pedido.objects.filter(estado=antiguo).update(estado=nuevo)
+    # La confirmación es ahora el paso a pagado
+    EventoOutbox.objects.filter(tipo='pedido.confirmado').update(tipo='pedido.pagado')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_outbox_eventos_pedido'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventooutbox',
+            name='tipo',
+            field=models.CharField(choices=[('pedido.realizado', 'Pedido realizado'), ('pedido.pagado', 'Pedido pagado'), ('pedido.enviado', 'Pedido enviado'), ('pedido.entregado', 'Pedido entregado'), ('pedido.cancelado', 'Pedido cancelado')], max_length=50),
+        ),
+        migrations.RunPython(normalizar_estados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0010_normalizar_estados_pedido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64)),
+                ('ruta', models.CharField(max_length=200)),
+                ('codigo', models.PositiveSmallIntegerField()),
+                ('tipo_contenido', models.CharField(blank=True, default='', max_length=100)),
+                ('ubicacion', models.CharField(blank=True, default='', max_length=500)),
+                ('contenido', models.BinaryField(blank=True, default=b'')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('expira', models.DateTimeField(db_index=True)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claves_idempotencia', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Clave de idempotencia',
+                'verbose_name_plural': 'Claves de idempotencia',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='claveidempotencia',
+            constraint=models.UniqueConstraint(fields=('cliente', 'clave'), name='clave_idempotencia_unica'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:53
+
+from django.db import migrations, models
+
+# Códigos abreviados que guardaban las vistas de pago y que no están en Pedido.METODOS_PAGO
+METODOS_ANTIGUOS = {
+    'EFEC': 'EFECTIVO',
+    'TARJ': 'TARJETA',
+    'PAYP': 'PAYPAL',
+    'TRANS': 'TRANSFERENCIA',
+}
+
+
+def normalizar_metodos_pago(apps, schema_editor):
+    Pedido = apps.get_model('core', 'Pedido')
+    for antiguo, nuevo in METODOS_ANTIGUOS.items():
+        Pedido.objects.filter(metodo_pago=antiguo).update(metodo_pago=nuevo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_claves_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='transaccion_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.RunPython(normalizar_metodos_pago, migrations.RunPython.noop),
+    ]
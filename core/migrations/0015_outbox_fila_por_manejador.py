@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:11
+
+from django.db import migrations, models
+
+# Manejadores de core/signals.py cuando se separaron las filas
+MANEJADORES = {
+    'pedido.realizado': ['aumentar_popularidad_compra', 'email_pedido_realizado', 'iniciar_cobro'],
+    'pedido.pagado': ['email_pedido_pagado'],
+    'pedido.enviado': ['email_pedido_enviado'],
+    'pedido.entregado': ['email_pedido_entregado'],
+    'pedido.cancelado': ['email_pedido_cancelado'],
+}
+
+
+def separar_pendientes(apps, schema_editor):
+    """Cada evento pendiente pasa a una fila por manejador, con los intentos a cero"""
+    EventoOutbox = apps.get_model('core', 'EventoOutbox')
+    pendientes = EventoOutbox.objects.filter(fecha_procesado__isnull=True, manejador='')
+    EventoOutbox.objects.bulk_create([
+        EventoOutbox(
+            tipo=evento.tipo, manejador=nombre, pedido_id=evento.pedido_id, datos=evento.datos,
+            fecha_creacion=evento.fecha_creacion, disponible_desde=evento.disponible_desde,
+        )
+        for evento in pendientes
+        for nombre in MANEJADORES.get(evento.tipo, ())
+    ], batch_size=500)
+    pendientes.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_tareas_masivas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventooutbox',
+            name='manejador',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(separar_pendientes, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,13 @@
 # core/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest, Round
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 
 class Categoria(models.Model):
@@ -52,6 +55,54 @@ class Expansion(models.Model):
         return self.cartas.count()
 
 
+def expresion_precio_actual(prefijo=''):
+    """Equivalente SQL de Inventario.precio_actual (``prefijo`` para cruzar relaciones)"""
+    return models.Case(
+        models.When(
+            models.Q(**{f'{prefijo}en_promocion': True})
+            & models.Q(**{f'{prefijo}precio_promocional__isnull': False})
+            & ~models.Q(**{f'{prefijo}precio_promocional': 0}),
+            then=models.F(f'{prefijo}precio_promocional'),
+        ),
+        default=models.F(f'{prefijo}precio'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+class CartaQuerySet(models.QuerySet):
+    """Operaciones en bloque sobre cartas"""
+    
+    def _columnas_inventario(self):
+        inventario = Inventario.objects.filter(carta=models.OuterRef('pk')).order_by()
+        return {
+            'precio_vigente': models.Subquery(
+                inventario.values(vigente=expresion_precio_actual())[:1]
+            ),
+            'stock_real': Coalesce(
+                models.Subquery(inventario.values(
+                    existencias=models.F('cantidad_disponible') - models.F('cantidad_reservada')
+                )[:1]),
+                models.Value(0),
+            ),
+        }
+    
+    def sincronizar_inventario(self):
+        """Copia precio vigente y stock del inventario a las cartas con un solo UPDATE"""
+        return self.update(**self._columnas_inventario())
+    
+    def desincronizadas(self):
+        """Cartas cuyas columnas desnormalizadas no coinciden con su inventario"""
+        columnas = self._columnas_inventario()
+        return self.annotate(
+            precio_inventario=columnas['precio_vigente'],
+            stock_inventario=columnas['stock_real'],
+        ).exclude(
+            models.Q(precio_vigente=models.F('precio_inventario'))
+            | models.Q(precio_vigente__isnull=True, precio_inventario__isnull=True),
+            stock_real=models.F('stock_inventario'),
+        )
+
+
 class Carta(models.Model):
     """Modelo principal para las cartas Pokémon"""
     
@@ -103,6 +154,19 @@ class Carta(models.Model):
         ('D', 'Dañada (Damaged)'),
     ]
     
+    # Precio estimado (base por rareza y multiplicadores)
+    PRECIOS_BASE = {
+        'COMUN': 0.3, 'INFREC': 0.8, 'RARA': 2.0,
+        'RARA_HOLO': 10.0, 'RARA_LUM': 15.0, 'ULTRA': 30.0,
+        'SECRETA': 40.0, 'EX': 20.0, 'GX': 25.0,
+        'V': 20.0, 'VMAX': 35.0, 'PROMO': 5.0,
+    }
+    MULTIPLICADORES_CONDICION = {
+        'NM': 1.0, 'LP': 0.75, 'MP': 0.5, 'HP': 0.3, 'D': 0.1
+    }
+    MULTIPLICADOR_HOLO = 1.3
+    MULTIPLICADOR_PRIMERA_EDICION = 2.0
+    
     # Campos básicos
     codigo = models.CharField(max_length=20, unique=True)
     nombre = models.CharField(max_length=200)
@@ -136,6 +200,12 @@ class Carta(models.Model):
     coleccionable = models.BooleanField(default=True)
     popularidad = models.IntegerField(default=0)  # Para ordenamiento
     
+    # Copia del inventario para ordenar y filtrar sin join (la mantiene Inventario.save)
+    precio_vigente = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, editable=False)
+    stock_real = models.IntegerField(default=0, editable=False)
+    
+    objects = CartaQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Carta"
         verbose_name_plural = "Cartas"
@@ -145,6 +215,19 @@ class Carta(models.Model):
             models.Index(fields=['tipo']),
             models.Index(fields=['rareza']),
             models.Index(fields=['popularidad']),
+            # Listados del catálogo (coleccionable=True) en cada orden. Parciales:
+            # el ORM compila el filtro como WHERE "coleccionable", que no sirve
+            # para buscar en un índice compuesto pero sí para elegir uno parcial
+            models.Index(fields=['-popularidad'], condition=models.Q(coleccionable=True),
+                         name='carta_colec_popularidad_idx'),
+            models.Index(fields=['-fecha_creacion'], condition=models.Q(coleccionable=True),
+                         name='carta_colec_fecha_idx'),
+            models.Index(fields=['nombre'], condition=models.Q(coleccionable=True),
+                         name='carta_colec_nombre_idx'),
+            models.Index(fields=['precio_vigente'], condition=models.Q(coleccionable=True),
+                         name='carta_colec_precio_idx'),
+            models.Index(fields=['precio_vigente'], condition=models.Q(coleccionable=True, stock_real__gt=0),
+                         name='carta_colec_stock_precio_idx'),
         ]
     
     def __str__(self):
@@ -163,24 +246,13 @@ class Carta(models.Model):
     @property
     def precio_estimado(self):
         """Calcula precio estimado"""
-        precios_base = {
-            'COMUN': 0.3, 'INFREC': 0.8, 'RARA': 2.0,
-            'RARA_HOLO': 10.0, 'RARA_LUM': 15.0, 'ULTRA': 30.0,
-            'SECRETA': 40.0, 'EX': 20.0, 'GX': 25.0,
-            'V': 20.0, 'VMAX': 35.0, 'PROMO': 5.0,
-        }
-        
-        multiplicadores = {
-            'NM': 1.0, 'LP': 0.75, 'MP': 0.5, 'HP': 0.3, 'D': 0.1
-        }
-        
-        base = precios_base.get(self.rareza, 1.0)
-        multiplicador = multiplicadores.get(self.condicion, 1.0)
+        base = self.PRECIOS_BASE.get(self.rareza, 1.0)
+        multiplicador = self.MULTIPLICADORES_CONDICION.get(self.condicion, 1.0)
         
         if self.es_holo:
-            multiplicador *= 1.3
+            multiplicador *= self.MULTIPLICADOR_HOLO
         if self.primera_edicion:
-            multiplicador *= 2.0
+            multiplicador *= self.MULTIPLICADOR_PRIMERA_EDICION
         
         return round(base * multiplicador, 2)
     
@@ -190,6 +262,84 @@ class Carta(models.Model):
         self.save(update_fields=['popularidad'])
 
 
+class StockInsuficiente(ValueError):
+    """No quedan unidades libres para reservar todo lo pedido"""
+
+
+class InventarioQuerySet(models.QuerySet):
+    """Movimientos de stock en bloque a partir de los ítems de pedidos"""
+    
+    @staticmethod
+    def _unidades(pedido_ids, *casos):
+        """Suma por inventario de las cantidades de los ítems según ``casos``"""
+        suma = ItemPedido.objects.filter(
+            pedido_id__in=pedido_ids, inventario=models.OuterRef('pk')
+        ).order_by().values('inventario').annotate(
+            total=models.Sum(models.Case(*casos, default=models.Value(0), output_field=models.IntegerField()))
+        ).values('total')
+        return Coalesce(models.Subquery(suma), models.Value(0))
+    
+    def _reservar(self, pedido_ids):
+        """
+        Reserva con un UPDATE condicional: solo cambian los inventarios con
+        unidades libres suficientes para todo lo pedido. La condición se
+        evalúa al escribir cada fila (con la fila bloqueada), así que dos
+        compras de la última unidad no pueden reservarla las dos. Si falta
+        alguna, lanza StockInsuficiente y la transacción que llama se deshace
+        """
+        necesarias = self._unidades(pedido_ids, models.When(pedido_id__in=pedido_ids, then=models.F('cantidad')))
+        inventario_ids = ItemPedido.objects.filter(pedido_id__in=pedido_ids).values('inventario')
+        esperadas = ItemPedido.objects.filter(pedido_id__in=pedido_ids).values('inventario').distinct().count()
+        con_stock = self.filter(pk__in=inventario_ids).filter(
+            GreaterThanOrEqual(models.F('cantidad_disponible') - models.F('cantidad_reservada'), necesarias)
+        )
+        with transaction.atomic():
+            filas = con_stock.update(cantidad_reservada=models.F('cantidad_reservada') + necesarias)
+            if filas < esperadas:
+                # Se deshace la reserva parcial antes de ver qué cartas faltan
+                transaction.set_rollback(True)
+        if filas < esperadas:
+            agotadas = self.filter(pk__in=inventario_ids).filter(
+                LessThan(models.F('cantidad_disponible') - models.F('cantidad_reservada'), necesarias)
+            )
+            nombres = sorted(Carta.objects.filter(inventario__in=agotadas).values_list('nombre', flat=True))
+            raise StockInsuficiente(f"Stock insuficiente para {', '.join(nombres) or 'alguna carta'}")
+        return filas
+    
+    def mover_stock(self, reservar=(), vender=(), liberar=()):
+        """
+        Reserva, vende (reservado -> vendido) y libera las unidades de varios
+        pedidos. La reserva es un UPDATE condicional al stock libre
+        (StockInsuficiente si no alcanza); venta y liberación van en un solo
+        UPDATE que agrupa las cantidades de cada inventario con SUM(CASE ...).
+        Después sincroniza precio_vigente y stock_real de las cartas
+        """
+        reservar, vender, liberar = list(reservar), list(vender), list(liberar)
+        pedido_ids = [*reservar, *vender, *liberar]
+        if not pedido_ids:
+            return 0
+        
+        filas = self._reservar(reservar) if reservar else 0
+        
+        salientes = [*vender, *liberar]
+        if salientes:
+            cantidad = models.F('cantidad')
+            delta_reservada = self._unidades(salientes, models.When(pedido_id__in=salientes, then=cantidad))
+            vendidas = self._unidades(salientes, models.When(pedido_id__in=vender, then=cantidad))
+            filas += self.filter(
+                pk__in=ItemPedido.objects.filter(pedido_id__in=salientes).values('inventario')
+            ).update(
+                cantidad_reservada=Greatest(models.F('cantidad_reservada') - delta_reservada, models.Value(0)),
+                cantidad_disponible=Greatest(models.F('cantidad_disponible') - vendidas, models.Value(0)),
+                vendidos_total=models.F('vendidos_total') + vendidas,
+            )
+        
+        Carta.objects.filter(
+            inventario__in=ItemPedido.objects.filter(pedido_id__in=pedido_ids).values('inventario')
+        ).sincronizar_inventario()
+        return filas
+
+
 class Inventario(models.Model):
     """Gestión de stock de cartas"""
     carta = models.OneToOneField(Carta, on_delete=models.CASCADE, related_name='inventario')
@@ -207,14 +357,35 @@ class Inventario(models.Model):
     fecha_ingreso = models.DateTimeField(auto_now_add=True)
     ultima_actualizacion = models.DateTimeField(auto_now=True)
     
+    objects = InventarioQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Inventario"
         verbose_name_plural = "Inventarios"
         ordering = ['-fecha_ingreso']
+        indexes = [
+            # Ofertas de la portada: pocas filas en promoción
+            models.Index(fields=['carta'], condition=models.Q(en_promocion=True), name='inventario_promocion_idx'),
+        ]
     
     def __str__(self):
         return f"Inventario de {self.carta.nombre}"
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.sincronizar_carta()
+    
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        Carta.objects.filter(pk=self.carta_id).update(precio_vigente=None, stock_real=0)
+        return resultado
+    
+    def sincronizar_carta(self):
+        """Actualiza precio_vigente y stock_real de la carta"""
+        Carta.objects.filter(pk=self.carta_id).update(
+            precio_vigente=self.precio_actual, stock_real=self.stock_real
+        )
+    
     @property
     def precio_actual(self):
         """Precio actual (promocional si está en promoción)"""
@@ -253,6 +424,51 @@ class Inventario(models.Model):
         self.save()
 
 
+ENVIO_GRATIS_DESDE = Decimal('100.00')
+COSTE_ENVIO = Decimal('4.95')
+TIPO_IVA = Decimal('0.21')
+CENTIMO = Decimal('0.01')
+
+
+def redondear_dinero(valor):
+    """Importe al céntimo con las mitades hacia arriba; el mismo criterio que expresiones_totales en SQL"""
+    return valor.quantize(CENTIMO, rounding=ROUND_HALF_UP)
+
+
+class PedidoQuerySet(models.QuerySet):
+    """Operaciones en bloque sobre pedidos"""
+    
+    @staticmethod
+    def expresiones_totales(subtotal):
+        """Expresiones SQL de envío, impuestos y total a partir del subtotal"""
+        dinero = models.DecimalField(max_digits=10, decimal_places=2)
+        envio = models.Case(
+            models.When(GreaterThanOrEqual(subtotal, models.Value(ENVIO_GRATIS_DESDE)),
+                        then=models.Value(Decimal('0.00'))),
+            default=models.Value(COSTE_ENVIO),
+            output_field=dinero,
+        )
+        # ROUND() de SQL redondea las mitades alejándose de cero: con importes
+        # positivos coincide con redondear_dinero
+        impuestos = Round(subtotal * models.Value(TIPO_IVA), 2, output_field=dinero)
+        total = models.ExpressionWrapper(
+            subtotal + envio + impuestos - models.F('descuento'), output_field=dinero
+        )
+        return {'subtotal': subtotal, 'envio': envio, 'impuestos': impuestos, 'total': total}
+    
+    def recalcular_totales(self):
+        """Recalcula los totales de todos los pedidos del queryset con un solo UPDATE"""
+        dinero = models.DecimalField(max_digits=10, decimal_places=2)
+        subtotal_items = ItemPedido.objects.filter(
+            pedido=models.OuterRef('pk')
+        ).order_by().values('pedido').annotate(
+            suma=models.Sum(models.F('precio_unitario') * models.F('cantidad'), output_field=dinero)
+        ).values('suma')
+        subtotal = Coalesce(models.Subquery(subtotal_items, output_field=dinero),
+                            models.Value(Decimal('0.00')), output_field=dinero)
+        return self.update(**self.expresiones_totales(subtotal))
+
+
 class Pedido(models.Model):
     """Pedidos de clientes"""
     
@@ -295,6 +511,8 @@ class Pedido(models.Model):
     
     # Información de pago
     metodo_pago = models.CharField(max_length=20, choices=METODOS_PAGO, blank=True, null=True)
+    # Identificador del cobro en la pasarela (core/pasarela.py)
+    transaccion_id = models.CharField(max_length=64, blank=True, default='', db_index=True)
     
     # Totales
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -306,6 +524,8 @@ class Pedido(models.Model):
     # Información adicional
     notas = models.TextField(blank=True, null=True)
     
+    objects = PedidoQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
@@ -314,6 +534,16 @@ class Pedido(models.Model):
             models.Index(fields=['estado']),
             models.Index(fields=['fecha_pedido']),
             models.Index(fields=['cliente']),
+            # Historial del cliente paginado por (fecha_pedido, id)
+            models.Index(fields=['cliente', '-fecha_pedido', '-id'], name='pedido_historial_idx'),
+        ]
+        constraints = [
+            # Un solo carrito abierto por cliente
+            models.UniqueConstraint(
+                fields=['cliente'],
+                condition=models.Q(estado='CARRITO'),
+                name='pedido_un_carrito_por_cliente',
+            ),
         ]
     
     def __str__(self):
@@ -328,13 +558,13 @@ class Pedido(models.Model):
             subtotal += item.subtotal
         
         # Calcular envío
-        envio = Decimal('0.00') if subtotal >= Decimal('100.00') else Decimal('4.95')
+        envio = Decimal('0.00') if subtotal >= ENVIO_GRATIS_DESDE else COSTE_ENVIO
         
         # Calcular impuestos
-        impuestos = (subtotal * Decimal('0.21')).quantize(Decimal('0.01'))
+        impuestos = redondear_dinero(subtotal * TIPO_IVA)
         
         # Calcular total
-        total = (subtotal + envio + impuestos - self.descuento).quantize(Decimal('0.01'))
+        total = redondear_dinero(subtotal + envio + impuestos - self.descuento)
         
         # Actualizar campos
         self.subtotal = subtotal
@@ -354,20 +584,22 @@ class Pedido(models.Model):
     def cantidad_items(self):
         return sum(item.cantidad for item in self.items.all())
     
+    @property
+    def pagado(self):
+        return self.fecha_pago is not None
+    
     @property
     def envio_gratis(self):
         return self.envio == 0
     
     def procesar_pago(self):
-        """Procesa el pago del pedido"""
+        """Procesa el pago del pedido (reserva el stock y lo marca como pagado)"""
+        from .pedidos import transicionar, PENDIENTE, PAGADO
         if self.estado == 'CARRITO':
-            self.estado = 'PAGADO'
-            self.fecha_pago = timezone.now()
-            self.save()
-            
-            # Reservar stock
-            for item in self.items.all():
-                item.inventario.reservar(item.cantidad)
+            with transaction.atomic():
+                transicionar([self.pk], PENDIENTE)
+                transicionar([self.pk], PAGADO)
+            self.refresh_from_db(fields=['estado', 'fecha_pago'])
 
 
 class ItemPedido(models.Model):
@@ -422,6 +654,11 @@ class Resena(models.Model):
         verbose_name_plural = "Reseñas"
         ordering = ['-fecha_creacion']
         unique_together = ['carta', 'usuario']
+        indexes = [
+            # Reseñas aprobadas de una carta, las más recientes primero
+            models.Index(fields=['carta', '-fecha_creacion'], condition=models.Q(aprobada=True),
+                         name='resena_carta_aprobada_idx'),
+        ]
     
     def __str__(self):
         return f"Reseña de {self.usuario.username} para {self.carta.nombre}"
@@ -458,16 +695,19 @@ class Coleccion(models.Model):
     def __str__(self):
         return self.nombre
     
+    @cached_property
+    def valoracion(self):
+        """Total de cartas, valor estimado y desglose por expansión"""
+        from .valoracion import valorar_colecciones
+        return valorar_colecciones([self.pk])[self.pk]
+    
     @property
     def total_cartas(self):
-        return sum(item.cantidad for item in self.cartas.all())
+        return self.valoracion['total_cartas']
     
     @property
     def valor_estimado(self):
-        total = Decimal('0.00')
-        for item in self.cartas.all():
-            total += item.carta.precio_estimado * item.cantidad
-        return total
+        return self.valoracion['valor_estimado']
 
 
 class ColeccionCarta(models.Model):
@@ -485,4 +725,124 @@ class ColeccionCarta(models.Model):
         unique_together = ['coleccion', 'carta']
     
     def __str__(self):
-        return f"{self.carta.nombre} en {self.coleccion.nombre}"
\ No newline at end of file
+        return f"{self.carta.nombre} en {self.coleccion.nombre}"
+
+
+class EventoOutbox(models.Model):
+    """
+    Evento de pedido pendiente de procesar (outbox transaccional). Se guarda
+    en la misma transacción que el cambio de estado y lo consume el comando
+    procesar_outbox (ver core/outbox.py)
+    """
+    TIPOS = [
+        ('pedido.realizado', 'Pedido realizado'),
+        ('pedido.pagado', 'Pedido pagado'),
+        ('pedido.enviado', 'Pedido enviado'),
+        ('pedido.entregado', 'Pedido entregado'),
+        ('pedido.cancelado', 'Pedido cancelado'),
+    ]
+    
+    tipo = models.CharField(max_length=50, choices=TIPOS)
+    # Cada manejador del tipo tiene su fila: reintentos y errores independientes
+    manejador = models.CharField(max_length=100, blank=True, default='')
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='eventos')
+    datos = models.JSONField(default=dict, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    # Entrega: no se toma antes de disponible_desde (reintentos y bloqueo del worker)
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    intentos = models.PositiveIntegerField(default=0)
+    ultimo_error = models.TextField(blank=True, default='')
+    fecha_procesado = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Evento de outbox"
+        verbose_name_plural = "Eventos de outbox"
+        ordering = ['id']
+        indexes = [
+            # El worker solo recorre los pendientes
+            models.Index(
+                fields=['disponible_desde', 'id'],
+                condition=models.Q(fecha_procesado__isnull=True),
+                name='outbox_pendientes_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} {self.manejador} #{self.pedido_id}"
+
+
+class ClaveIdempotencia(models.Model):
+    """
+    Respuesta guardada de un envío de pago (ver core/idempotencia.py). Un
+    reenvío con la misma clave recibe esta respuesta sin repetir el pago
+    hasta que caduca
+    """
+    cliente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='claves_idempotencia')
+    clave = models.CharField(max_length=64)
+    ruta = models.CharField(max_length=200)
+    
+    # Respuesta: código, Content-Type, Location de las redirecciones y cuerpo
+    codigo = models.PositiveSmallIntegerField()
+    tipo_contenido = models.CharField(max_length=100, blank=True, default='')
+    ubicacion = models.CharField(max_length=500, blank=True, default='')
+    contenido = models.BinaryField(blank=True, default=b'')
+    
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    expira = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        verbose_name = "Clave de idempotencia"
+        verbose_name_plural = "Claves de idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=['cliente', 'clave'], name='clave_idempotencia_unica'),
+        ]
+    
+    def __str__(self):
+        return f"{self.clave} ({self.ruta})"
+
+
+class TareaMasiva(models.Model):
+    """
+    Acción del admin sobre demasiadas filas para hacerla en la petición (ver
+    core/acciones_masivas.py). La ejecuta por bloques el comando
+    procesar_tareas y guarda el progreso tras cada bloque
+    """
+    PENDIENTE = 'PENDIENTE'
+    EN_CURSO = 'EN_CURSO'
+    TERMINADA = 'TERMINADA'
+    ERROR = 'ERROR'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_CURSO, 'En curso'),
+        (TERMINADA, 'Terminada'),
+        (ERROR, 'Error'),
+    ]
+    
+    accion = models.CharField(max_length=100)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='tareas_masivas')
+    ids = models.JSONField(default=list)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    
+    # Progreso: filas recorridas y filas que cambiaron (resultado de los UPDATE)
+    total = models.PositiveIntegerField(default=0)
+    procesados = models.PositiveIntegerField(default=0)
+    afectados = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_fin = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Tarea masiva"
+        verbose_name_plural = "Tareas masivas"
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"{self.accion} #{self.pk}"
+    
+    @property
+    def progreso(self):
+        """Porcentaje de filas recorridas"""
+        return round(100 * self.procesados / self.total) if self.total else 100
@@ -0,0 +1,175 @@
+# core/outbox.py
+"""
+Outbox transaccional para los eventos de pedidos.
+
+Un cambio de estado guarda sus eventos con ``registrar_evento`` o
+``registrar_eventos`` dentro de la misma transacción (core/pedidos.py): el
+evento existe si y solo si el cambio se confirmó. Los efectos secundarios
+(popularidad, cobros en la pasarela, emails) los ejecuta después el comando
+``procesar_outbox`` con los manejadores registrados con ``@manejador(tipo)``
+(core/signals.py).
+
+Cada evento guarda una fila por manejador de su tipo, con sus propios
+intentos, espera y error: si falla el email, la popularidad y el cobro
+siguen su curso. Entrega al menos una vez: el worker toma un lote y lo
+bloquea unos segundos moviendo ``disponible_desde`` al futuro; si muere
+antes de terminar, otro worker vuelve a tomar las filas al vencer el
+bloqueo. Cada manejador recibe juntas todas sus filas del lote:
+
+- Los transaccionales (solo escriben en la base de datos) se ejecutan en la
+  transacción que marca sus filas como procesadas: se aplican una sola vez.
+- Los externos (``transaccional=False``: emails, pasarela) se ejecutan fuera
+  de cualquier transacción, sin retener bloqueos mientras esperan a la red;
+  pueden repetirse y deben tolerarlo (la pasarela deduplica por
+  transaccion_id).
+"""
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EventoOutbox
+
+# tipo -> {nombre: (función que recibe la lista de eventos, transaccional)}
+MANEJADORES = defaultdict(dict)
+
+
+def _max_intentos():
+    return getattr(settings, 'OUTBOX_MAX_INTENTOS', 8)
+
+
+def _segundos_bloqueo():
+    return getattr(settings, 'OUTBOX_SEGUNDOS_BLOQUEO', 60)
+
+
+def manejador(tipo, transaccional=True):
+    """
+    Registra una función como manejador de los eventos de ``tipo``. Con
+    ``transaccional=False`` se ejecuta fuera de la transacción (E/S externa)
+    """
+    def decorator(funcion):
+        nombre = funcion.__name__
+        if nombre in MANEJADORES[tipo]:
+            raise ValueError(f'Manejador duplicado para {tipo}: {nombre}')
+        MANEJADORES[tipo][nombre] = (funcion, transaccional)
+        return funcion
+    return decorator
+
+
+def registrar_evento(tipo, pedido, **datos):
+    """Guarda un evento; llamar dentro de la transacción del cambio de estado"""
+    return registrar_eventos({tipo: [pedido.pk]}, **datos)
+
+
+def registrar_eventos(pedidos_por_tipo, **datos):
+    """Una fila por pedido, tipo y manejador ({tipo: [pedido_ids]}) con un solo INSERT"""
+    return EventoOutbox.objects.bulk_create([
+        EventoOutbox(tipo=tipo, manejador=nombre, pedido_id=pedido_id, datos=datos)
+        for tipo, pedido_ids in pedidos_por_tipo.items()
+        for nombre in MANEJADORES[tipo]
+        for pedido_id in pedido_ids
+    ])
+
+
+def pendientes():
+    return EventoOutbox.objects.filter(fecha_procesado__isnull=True, intentos__lt=_max_intentos())
+
+
+def fallidos():
+    """Eventos que agotaron los reintentos (se revisan a mano)"""
+    return EventoOutbox.objects.filter(fecha_procesado__isnull=True, intentos__gte=_max_intentos())
+
+
+def tomar_lote(tamano):
+    """Bloquea para este worker hasta ``tamano`` eventos listos, los más antiguos primero"""
+    ahora = timezone.now()
+    with transaction.atomic():
+        candidatos = pendientes().filter(disponible_desde__lte=ahora).order_by('disponible_desde', 'id')
+        candidatos = candidatos.select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked
+        )
+        eventos = list(candidatos[:tamano])
+        # El intento cuenta al tomarlo: un evento que tumba al worker también se agota
+        EventoOutbox.objects.filter(pk__in=[evento.pk for evento in eventos]).update(
+            disponible_desde=ahora + timedelta(seconds=_segundos_bloqueo()),
+            intentos=F('intentos') + 1,
+        )
+    return eventos
+
+
+def _vigentes(eventos, bloquear=False):
+    """Descarta las filas que otro worker procesó tras vencer el bloqueo"""
+    filas = EventoOutbox.objects.filter(pk__in=[evento.pk for evento in eventos], fecha_procesado__isnull=True)
+    if bloquear:
+        filas = filas.select_for_update()
+    vigentes = set(filas.values_list('pk', flat=True))
+    return [evento for evento in eventos if evento.pk in vigentes]
+
+
+def _marcar_procesados(eventos):
+    EventoOutbox.objects.filter(
+        pk__in=[evento.pk for evento in eventos], fecha_procesado__isnull=True
+    ).update(fecha_procesado=timezone.now(), ultimo_error='')
+
+
+def _ejecutar(tipo, nombre, eventos):
+    if nombre not in MANEJADORES[tipo]:
+        raise LookupError(f'Manejador no registrado: {tipo} / {nombre}')
+    funcion, transaccional = MANEJADORES[tipo][nombre]
+    if not transaccional:
+        eventos = _vigentes(eventos)
+        if eventos:
+            funcion(eventos)
+            _marcar_procesados(eventos)
+        return len(eventos)
+    with transaction.atomic():
+        eventos = _vigentes(eventos, bloquear=True)
+        if eventos:
+            funcion(eventos)
+            _marcar_procesados(eventos)
+    return len(eventos)
+
+
+def _marcar_error(evento, error):
+    # Espera exponencial: 2, 4, 8... segundos, como mucho una hora
+    espera = min(2 ** (evento.intentos + 1), 3600)
+    EventoOutbox.objects.filter(pk=evento.pk).update(
+        ultimo_error=error[-4000:],
+        disponible_desde=timezone.now() + timedelta(seconds=espera),
+    )
+
+
+def procesar_lote(tamano=100):
+    """Toma y procesa un lote; devuelve (procesados, con error)"""
+    por_manejador = defaultdict(list)
+    for evento in tomar_lote(tamano):
+        por_manejador[evento.tipo, evento.manejador].append(evento)
+
+    procesados = errores = 0
+    for (tipo, nombre), eventos in por_manejador.items():
+        try:
+            procesados += _ejecutar(tipo, nombre, eventos)
+            continue
+        except Exception:
+            if len(eventos) == 1:
+                _marcar_error(eventos[0], traceback.format_exc())
+                errores += 1
+                continue
+        # Un evento malo no bloquea al resto: el grupo se repite de uno en uno
+        for evento in eventos:
+            try:
+                procesados += _ejecutar(tipo, nombre, [evento])
+            except Exception:
+                _marcar_error(evento, traceback.format_exc())
+                errores += 1
+    return procesados, errores
+
+
+def purgar(dias):
+    """Borra los eventos procesados hace más de ``dias`` días"""
+    limite = timezone.now() - timedelta(days=dias)
+    return EventoOutbox.objects.filter(fecha_procesado__lt=limite).delete()[0]
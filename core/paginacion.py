@@ -0,0 +1,67 @@
+# core/paginacion.py
+"""
+Paginator con el total en cache para listados de administración.
+
+Paginator hace un COUNT(*) en cada página, que en tablas grandes es la
+consulta más cara del listado. PaginadorConteoCache guarda el total en la
+cache (por consulta SQL) durante CONTEO_CACHE_TIMEOUT segundos. En
+PostgreSQL, si el listado no tiene filtros y la tabla pasa de
+CONTEO_ESTIMADO_DESDE filas, usa la estimación del planificador
+(pg_class.reltuples), que no recorre la tabla. El total puede quedarse
+desfasado unos segundos, lo que en un listado paginado no importa.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+PREFIJO = 'conteo'
+
+
+def _timeout():
+    return getattr(settings, 'CONTEO_CACHE_TIMEOUT', 60)
+
+
+def _umbral_estimacion():
+    return getattr(settings, 'CONTEO_ESTIMADO_DESDE', 100_000)
+
+
+class PaginadorConteoCache(Paginator):
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        try:
+            sql = str(queryset.query)
+        except Exception:
+            # Consultas que no se pueden representar (p. ej. resultado vacío)
+            return super().count
+        clave = f'{PREFIJO}:{queryset.db}:{hashlib.sha1(sql.encode()).hexdigest()}'
+        total = cache.get(clave)
+        if total is None:
+            total = self._estimacion(queryset)
+            if total is None:
+                total = super().count
+            cache.set(clave, total, _timeout())
+        return total
+
+    @staticmethod
+    def _estimacion(queryset):
+        """Filas estimadas por PostgreSQL para una tabla grande sin filtros"""
+        conexion = connections[queryset.db]
+        if conexion.vendor != 'postgresql' or queryset.query.where or queryset.query.distinct:
+            return None
+        with conexion.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            fila = cursor.fetchone()
+        if fila and fila[0] >= _umbral_estimacion():
+            return fila[0]
+        return None
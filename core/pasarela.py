@@ -0,0 +1,105 @@
+# core/pasarela.py
+"""
+Pasarela de pagos enchufable.
+
+PASARELA_PAGOS indica la clase del proveedor; por defecto es el simulador
+local (manage.py simulador_pasarela). La petición web nunca espera a la
+pasarela:
+
+1. Al realizar el pedido, este recibe un transaccion_id y queda PENDIENTE.
+2. El manejador del outbox ``iniciar_cobro`` (core/signals.py) pide el
+   cobro desde el worker.
+3. La pasarela avisa del resultado llamando al webhook
+   (pago_views.webhook_pasarela), que lleva el pedido a PAGADO o a
+   CANCELADO.
+
+Un proveedor real solo tiene que implementar ``iniciar_cobro`` y
+``leer_webhook``.
+"""
+import abc
+import hashlib
+import hmac
+import json
+import uuid
+from urllib import request as urllib_request
+from urllib.error import URLError
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Métodos que se cobran por la pasarela; efectivo y transferencia los confirma el staff
+METODOS_PASARELA = {'TARJETA', 'PAYPAL'}
+
+CABECERA_FIRMA = 'X-Firma-Pasarela'
+
+
+class ErrorPasarela(Exception):
+    """La pasarela no aceptó la petición (el evento del outbox se reintenta)"""
+
+
+class WebhookInvalido(Exception):
+    """Notificación con firma incorrecta o mal formada"""
+
+
+def firmar(cuerpo, secreto):
+    """Firma HMAC-SHA256 (hex) de un cuerpo en bytes"""
+    return hmac.new(secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+
+
+class Pasarela(abc.ABC):
+    """Interfaz de un proveedor de pagos"""
+
+    def nueva_transaccion(self, pedido):
+        """Identificador con el que el pedido se presenta a la pasarela"""
+        return f"{(pedido.metodo_pago or 'PAGO')[:4]}_{uuid.uuid4().hex[:16].upper()}"
+
+    @abc.abstractmethod
+    def iniciar_cobro(self, pedido):
+        """
+        Pide el cobro sin esperar al resultado, que llega por el webhook.
+        Debe ser idempotente por transaccion_id: el outbox puede repetirlo
+        """
+
+    @abc.abstractmethod
+    def leer_webhook(self, request):
+        """Valida una notificación; devuelve (transaccion_id, aprobado, motivo)"""
+
+
+class PasarelaSimulada(Pasarela):
+    """Cliente HTTP del simulador local (manage.py simulador_pasarela)"""
+
+    def __init__(self):
+        self.url = settings.PASARELA_URL.rstrip('/')
+        self.secreto = settings.PASARELA_SECRETO
+        self.webhook_url = settings.PASARELA_WEBHOOK_URL
+        self.timeout = settings.PASARELA_TIMEOUT
+
+    def iniciar_cobro(self, pedido):
+        cuerpo = json.dumps({
+            'transaccion_id': pedido.transaccion_id,
+            'importe': str(pedido.total),
+            'moneda': 'EUR',
+            'webhook_url': self.webhook_url,
+        }).encode()
+        peticion = urllib_request.Request(
+            f'{self.url}/cobros', data=cuerpo, method='POST',
+            headers={'Content-Type': 'application/json', CABECERA_FIRMA: firmar(cuerpo, self.secreto)},
+        )
+        try:
+            with urllib_request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                return json.load(respuesta)
+        except (URLError, OSError, ValueError) as e:
+            raise ErrorPasarela(f'Cobro {pedido.transaccion_id} no aceptado: {e}') from e
+
+    def leer_webhook(self, request):
+        if not hmac.compare_digest(request.headers.get(CABECERA_FIRMA, ''), firmar(request.body, self.secreto)):
+            raise WebhookInvalido('Firma no válida')
+        try:
+            datos = json.loads(request.body)
+            return datos['transaccion_id'], datos['estado'] == 'aprobado', datos.get('motivo', '')
+        except (ValueError, KeyError, TypeError) as e:
+            raise WebhookInvalido(f'Notificación mal formada: {e}') from e
+
+
+def obtener_pasarela():
+    return import_string(settings.PASARELA_PAGOS)()
@@ -0,0 +1,127 @@
+# core/pedidos.py
+"""
+Máquina de estados de los pedidos.
+
+``transicionar`` (y ``transicionar_lote`` para varios destinos a la vez)
+cambia de estado un lote de pedidos y aplica sus efectos con un número fijo
+de consultas, tenga el lote 1 pedido o 500: bloquea los pedidos, un
+UPDATE ... CASE de estado y fechas, los UPDATE de inventario
+(Inventario.objects.mover_stock), la sincronización de las columnas de
+Carta y un INSERT de eventos del outbox, todo en una transacción. Los
+pedidos cuyo estado actual no admite la transición se omiten.
+
+Efectos en stock:
+    CARRITO -> PENDIENTE           reserva las unidades si quedan libres
+                                   (si no, StockInsuficiente y nada cambia)
+    ENVIADO -> ENTREGADO           las reservadas pasan a vendidas
+    PENDIENTE/PAGADO -> CANCELADO  libera la reserva
+Emails y popularidad van al outbox (core/signals.py).
+"""
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .cache_paginas import invalidar_etiquetas
+from .models import Inventario, ItemPedido, Pedido
+from .outbox import registrar_eventos
+
+CARRITO = 'CARRITO'
+PENDIENTE = 'PENDIENTE'
+PAGADO = 'PAGADO'
+ENVIADO = 'ENVIADO'
+ENTREGADO = 'ENTREGADO'
+CANCELADO = 'CANCELADO'
+
+# destino -> estados desde los que se puede llegar
+TRANSICIONES = {
+    PENDIENTE: {CARRITO},
+    PAGADO: {PENDIENTE},
+    ENVIADO: {PAGADO},
+    ENTREGADO: {ENVIADO},
+    CANCELADO: {PENDIENTE, PAGADO},
+}
+
+EVENTOS = {
+    PENDIENTE: 'pedido.realizado',
+    PAGADO: 'pedido.pagado',
+    ENVIADO: 'pedido.enviado',
+    ENTREGADO: 'pedido.entregado',
+    CANCELADO: 'pedido.cancelado',
+}
+
+# Fecha que se rellena al llegar a cada estado
+FECHAS = {
+    PAGADO: 'fecha_pago',
+    ENVIADO: 'fecha_envio',
+    ENTREGADO: 'fecha_entrega',
+}
+
+
+def transicionar(pedido_ids, destino, desde=None, **datos):
+    """Lleva los pedidos a ``destino``; devuelve los ids que cambiaron"""
+    return transicionar_lote({destino: pedido_ids}, desde=desde, **datos)[destino]
+
+
+def transicionar_lote(cambios, desde=None, **datos):
+    """
+    ``cambios`` es {destino: [pedido_ids]}. ``desde`` limita los estados de
+    origen admitidos y ``datos`` acompaña a los eventos del outbox (p. ej.
+    numero_seguimiento). Devuelve {destino: [ids cambiados]}
+    """
+    for destino in cambios:
+        if destino not in TRANSICIONES:
+            raise ValueError(f'Estado de destino desconocido: {destino}')
+    cambios = {destino: list(ids) for destino, ids in cambios.items()}
+    pedido_ids = {pk for ids in cambios.values() for pk in ids}
+
+    with transaction.atomic():
+        actuales = {
+            pk: (estado, cliente_id)
+            for pk, estado, cliente_id in Pedido.objects.select_for_update().filter(
+                pk__in=pedido_ids
+            ).values_list('pk', 'estado', 'cliente_id')
+        }
+        validos = {}
+        # Un pedido solo cambia una vez por lote
+        asignados = set()
+        for destino, ids in cambios.items():
+            origenes = TRANSICIONES[destino] & set(desde) if desde else TRANSICIONES[destino]
+            validos[destino] = [
+                pk for pk in dict.fromkeys(ids)
+                if pk in actuales and pk not in asignados and actuales[pk][0] in origenes
+            ]
+            asignados.update(validos[destino])
+        cambiados = [pk for ids in validos.values() for pk in ids]
+        if not cambiados:
+            return validos
+
+        ahora = timezone.now()
+        columnas = {
+            'estado': Case(
+                *[When(pk__in=ids, then=Value(destino)) for destino, ids in validos.items() if ids],
+                default=F('estado'),
+            ),
+        }
+        for destino, campo in FECHAS.items():
+            if validos.get(destino):
+                columnas[campo] = Case(When(pk__in=validos[destino], then=Value(ahora)), default=F(campo))
+        Pedido.objects.filter(pk__in=cambiados).update(**columnas)
+
+        con_stock = [*validos.get(PENDIENTE, ()), *validos.get(ENTREGADO, ()), *validos.get(CANCELADO, ())]
+        Inventario.objects.mover_stock(
+            reservar=validos.get(PENDIENTE, ()),
+            vender=validos.get(ENTREGADO, ()),
+            liberar=validos.get(CANCELADO, ()),
+        )
+        registrar_eventos({EVENTOS[destino]: ids for destino, ids in validos.items()}, **datos)
+
+        # update() no emite señales: se invalidan a mano las páginas afectadas
+        etiquetas = {f'carrito:{actuales[pk][1]}' for pk in cambiados}
+        if con_stock:
+            cartas = ItemPedido.objects.filter(pedido_id__in=con_stock).values_list('carta_id', 'carta__expansion_id')
+            etiquetas.add('catalogo')
+            for carta_id, expansion_id in cartas:
+                etiquetas |= {f'carta:{carta_id}', f'expansion:{expansion_id}'}
+        transaction.on_commit(lambda: invalidar_etiquetas(*etiquetas))
+
+    return validos
@@ -0,0 +1,212 @@
+# core/precios.py
+"""
+Motor de cambio masivo de precios del inventario.
+
+Las reglas filtran por rareza, condición y expansión y aplican un porcentaje
+y/o un precio mínimo y máximo. Todo el inventario afectado se carga con una
+sola consulta en arrays de NumPy (en céntimos), las reglas se aplican de forma
+vectorizada y solo las filas que cambian se escriben con ``bulk_update`` por
+bloques dentro de una única transacción (junto con la copia del precio
+vigente en ``Carta``). ``aplicar`` lee el inventario con SELECT ... FOR
+UPDATE, así que no pisa los cambios que se hagan mientras tanto.
+
+Los céntimos se calculan con enteros y se redondean como el resto de
+importes (models.redondear_dinero: mitades hacia arriba), también los
+límites mínimo y máximo.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Carta, Inventario, redondear_dinero
+from .cache_paginas import invalidar_etiquetas
+
+CAMPOS_PRECIO = ('precio', 'precio_promocional')
+
+
+def _a_centimos(valores):
+    """Lista de Decimal (o None) -> array int64 de céntimos (None -> -1)"""
+    return np.fromiter(
+        (int((valor * 100).to_integral_value()) if valor is not None else -1 for valor in valores),
+        dtype=np.int64, count=len(valores),
+    )
+
+
+def _a_decimal(centimos):
+    return Decimal(int(centimos)).scaleb(-2)
+
+
+def _limite_en_centimos(valor):
+    return int(redondear_dinero(Decimal(str(valor))) * 100)
+
+
+@dataclass
+class ReglaPrecio:
+    """Regla de precios. Los filtros vacíos no restringen."""
+    porcentaje: Decimal = Decimal('0')
+    rarezas: tuple = ()
+    condiciones: tuple = ()
+    expansiones: tuple = ()  # códigos de expansión
+    minimo: Decimal = None
+    maximo: Decimal = None
+    campo: str = 'precio'
+
+    def __post_init__(self):
+        if self.campo not in CAMPOS_PRECIO:
+            raise ValueError(f"Campo no válido: {self.campo}")
+        if not Decimal(str(self.porcentaje)).is_finite():
+            raise ValueError(f"Porcentaje no válido: {self.porcentaje}")
+        # Límites al céntimo, con el mismo redondeo que los precios
+        self.minimo_centimos = _limite_en_centimos(self.minimo) if self.minimo is not None else None
+        self.maximo_centimos = _limite_en_centimos(self.maximo) if self.maximo is not None else None
+        if self.minimo is not None and self.maximo is not None and self.minimo_centimos > self.maximo_centimos:
+            raise ValueError("El precio mínimo no puede ser mayor que el máximo")
+
+    def mascara(self, datos):
+        """Filas a las que aplica la regla"""
+        mascara = np.ones(len(datos['id']), dtype=bool)
+        if self.rarezas:
+            mascara &= np.isin(datos['rareza'], list(self.rarezas))
+        if self.condiciones:
+            mascara &= np.isin(datos['condicion'], list(self.condiciones))
+        if self.expansiones:
+            mascara &= np.isin(datos['expansion'], list(self.expansiones))
+        return mascara
+
+    def aplicar(self, centimos, mascara):
+        """Aplica la regla sobre un array de céntimos (-1 = sin precio)"""
+        mascara = mascara & (centimos >= 0)
+        nuevos = centimos.copy()
+        if self.porcentaje:
+            # Factor exacto numerador/denominador: redondeo entero sin coma flotante
+            numerador, denominador = (1 + Decimal(str(self.porcentaje)) / 100).as_integer_ratio()
+            nuevos[mascara] = (centimos[mascara] * (2 * numerador) + denominador) // (2 * denominador)
+        if self.minimo_centimos is not None:
+            nuevos[mascara & (nuevos < self.minimo_centimos)] = self.minimo_centimos
+        if self.maximo_centimos is not None:
+            nuevos[mascara & (nuevos > self.maximo_centimos)] = self.maximo_centimos
+        nuevos[mascara & (nuevos < 0)] = 0
+        return nuevos
+
+
+class PlanPrecios:
+    """Resultado del cálculo: precios antes y después de cada fila afectada"""
+
+    def __init__(self, datos, nuevos):
+        self.datos = datos
+        self.nuevos = nuevos
+        cambia = np.zeros(len(datos['id']), dtype=bool)
+        for campo in CAMPOS_PRECIO:
+            cambia |= nuevos[campo] != datos[campo]
+        self.indices = np.flatnonzero(cambia)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def cambios(self, limite=None):
+        """Diferencias fila a fila (para el modo de prueba)"""
+        indices = self.indices if limite is None else self.indices[:limite]
+        for i in indices:
+            fila = {
+                'id': int(self.datos['id'][i]),
+                'carta_id': int(self.datos['carta_id'][i]),
+                'rareza': self.datos['rareza'][i],
+                'condicion': self.datos['condicion'][i],
+                'expansion': self.datos['expansion'][i],
+            }
+            for campo in CAMPOS_PRECIO:
+                antes, despues = self.datos[campo][i], self.nuevos[campo][i]
+                fila[campo] = (
+                    _a_decimal(antes) if antes >= 0 else None,
+                    _a_decimal(despues) if despues >= 0 else None,
+                )
+            yield fila
+
+    def resumen(self):
+        """Totales de la operación"""
+        resumen = {'filas': len(self.datos['id']), 'cambios': len(self)}
+        for campo in CAMPOS_PRECIO:
+            antes = self.datos[campo][self.indices]
+            despues = self.nuevos[campo][self.indices]
+            validos = antes >= 0
+            resumen[f'{campo}_total_antes'] = _a_decimal(antes[validos].sum())
+            resumen[f'{campo}_total_despues'] = _a_decimal(despues[validos].sum())
+        return resumen
+
+
+class Repreciador:
+    """Calcula y aplica un conjunto de reglas sobre el inventario"""
+
+    def __init__(self, reglas, queryset=None):
+        self.reglas = list(reglas)
+        self.queryset = queryset if queryset is not None else Inventario.objects.all()
+
+    def _cargar(self, bloquear=False):
+        # Una sola consulta con todo lo que necesitan las reglas
+        queryset = self.queryset.order_by()
+        if bloquear:
+            # Solo las filas de Inventario: las ediciones simultáneas de precio o
+            # stock esperan a que termine la transacción en lugar de perderse.
+            # SQLite no tiene FOR UPDATE; allí BEGIN IMMEDIATE ya toma el bloqueo
+            # de escritura antes de leer (core/backends/sqlite3)
+            queryset = queryset.select_for_update(of=('self',))
+        filas = list(queryset.values_list(
+            'id', 'carta_id', 'carta__expansion_id', 'precio', 'precio_promocional',
+            'carta__rareza', 'carta__condicion', 'carta__expansion__codigo',
+        ))
+        columnas = list(zip(*filas)) if filas else [()] * 8
+        return {
+            'id': np.array(columnas[0], dtype=np.int64),
+            'carta_id': np.array(columnas[1], dtype=np.int64),
+            'expansion_id': np.array(columnas[2], dtype=np.int64),
+            'precio': _a_centimos(columnas[3]),
+            'precio_promocional': _a_centimos(columnas[4]),
+            'rareza': np.array(columnas[5], dtype=object),
+            'condicion': np.array(columnas[6], dtype=object),
+            'expansion': np.array(columnas[7], dtype=object),
+        }
+
+    def calcular(self, bloquear=False):
+        """Calcula los nuevos precios sin escribir nada (modo de prueba)"""
+        datos = self._cargar(bloquear)
+        nuevos = {campo: datos[campo].copy() for campo in CAMPOS_PRECIO}
+        for regla in self.reglas:
+            nuevos[regla.campo] = regla.aplicar(nuevos[regla.campo], regla.mascara(datos))
+        return PlanPrecios(datos, nuevos)
+
+    def aplicar(self, tamano_bloque=2000):
+        """Calcula y guarda los cambios en una transacción. Devuelve el plan."""
+        ahora = timezone.now()
+        with transaction.atomic():
+            # Las filas quedan bloqueadas desde la lectura hasta el bulk_update
+            plan = self.calcular(bloquear=True)
+            indices = plan.indices
+            for inicio in range(0, len(indices), tamano_bloque):
+                bloque = indices[inicio:inicio + tamano_bloque]
+                objetos = []
+                for i in bloque:
+                    promocional = plan.nuevos['precio_promocional'][i]
+                    objetos.append(Inventario(
+                        id=int(plan.datos['id'][i]),
+                        precio=_a_decimal(plan.nuevos['precio'][i]),
+                        precio_promocional=_a_decimal(promocional) if promocional >= 0 else None,
+                        ultima_actualizacion=ahora,
+                    ))
+                Inventario.objects.bulk_update(
+                    objetos, ['precio', 'precio_promocional', 'ultima_actualizacion']
+                )
+                # bulk_update no pasa por Inventario.save: precio_vigente se copia aquí
+                Carta.objects.filter(
+                    pk__in=[int(carta_id) for carta_id in plan.datos['carta_id'][bloque]]
+                ).sincronizar_inventario()
+
+            if len(indices):
+                # bulk_update no envía señales: se invalida la cache a mano
+                etiquetas = ['catalogo']
+                etiquetas += [f'carta:{carta_id}' for carta_id in plan.datos['carta_id'][indices]]
+                etiquetas += [f'expansion:{expansion_id}' for expansion_id in np.unique(plan.datos['expansion_id'][indices])]
+                transaction.on_commit(lambda: invalidar_etiquetas(*etiquetas))
+        return plan
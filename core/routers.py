@@ -0,0 +1,110 @@
+# core/routers.py
+"""
+Lecturas del catálogo en la réplica.
+
+``RouterReplica`` envía las lecturas de los modelos del catálogo al alias
+``replica`` y todo lo demás (escrituras, carritos, pedidos, usuarios,
+sesiones) a ``default``. Una petición queda fijada a ``default`` si no es de
+solo lectura, si llega con la cookie que ``FijarPrimariaMiddleware`` pone
+tras una escritura o, desde ese momento, si escribe en un modelo de core
+aunque sea un GET. Así el usuario ve enseguida lo que acaba de cambiar
+aunque la réplica vaya con retraso. Dentro de una transacción de
+``default`` también se lee de ``default``.
+
+Las escrituras con el hint ``fijar_primaria=False`` (contadores como la
+popularidad, que el visitante no necesita leer enseguida) no fijan la
+petición: ``Carta.objects.db_manager(hints={'fijar_primaria': False})``.
+
+Los demás visitantes sí pueden leer de la réplica con retraso: la cache de
+páginas y los ETags no se guardan ni se emiten hasta que las etiquetas
+invalidadas tienen REPLICA_SEGUNDOS_PRIMARIA segundos (core.cache_paginas).
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+ALIAS_PRIMARIA = 'default'
+ALIAS_REPLICA = 'replica'
+
+COOKIE_PRIMARIA = 'leer_primaria'
+SEGUNDOS_PRIMARIA = getattr(settings, 'REPLICA_SEGUNDOS_PRIMARIA', 5)
+
+# Modelos de core que se pueden leer de la réplica
+MODELOS_CATALOGO = {'carta', 'expansion', 'categoria', 'inventario', 'resena'}
+
+METODOS_LECTURA = {'GET', 'HEAD', 'OPTIONS'}
+
+# Estado de la petición en curso: {'primaria': bool, 'escritura': bool}. Es un
+# dict mutable para que lo vean también los hilos de sync_to_async
+_peticion = ContextVar('peticion_replica', default=None)
+
+
+class RouterReplica:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'core' or model._meta.model_name not in MODELOS_CATALOGO:
+            return ALIAS_PRIMARIA
+        peticion = _peticion.get()
+        if (peticion and peticion['primaria']) or connections[ALIAS_PRIMARIA].in_atomic_block:
+            return ALIAS_PRIMARIA
+        return ALIAS_REPLICA
+
+    def db_for_write(self, model, **hints):
+        peticion = _peticion.get()
+        if peticion is not None and model._meta.app_label == 'core' and hints.get('fijar_primaria', True):
+            # El resto de la petición, y las siguientes por la cookie, leen lo escrito
+            peticion['primaria'] = peticion['escritura'] = True
+        return ALIAS_PRIMARIA
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica es una copia de la primaria
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == ALIAS_PRIMARIA
+
+
+class FijarPrimariaMiddleware:
+    """Fija la petición a la primaria tras una escritura (cookie de unos segundos)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.es_async = iscoroutinefunction(get_response)
+        if self.es_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.es_async:
+            return self._acall(request)
+        peticion = self._estado(request)
+        token = _peticion.set(peticion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _peticion.reset(token)
+        return self._fijar(response, peticion)
+
+    async def _acall(self, request):
+        peticion = self._estado(request)
+        token = _peticion.set(peticion)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _peticion.reset(token)
+        return self._fijar(response, peticion)
+
+    @staticmethod
+    def _estado(request):
+        escritura = request.method not in METODOS_LECTURA
+        return {'primaria': escritura or COOKIE_PRIMARIA in request.COOKIES, 'escritura': escritura}
+
+    @staticmethod
+    def _fijar(response, peticion):
+        if peticion['escritura']:
+            response.set_cookie(COOKIE_PRIMARIA, '1', max_age=SEGUNDOS_PRIMARIA, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,167 @@
+# core/serializers.py
+"""
+Serialización por proyección para la API JSON del catálogo.
+
+Cada recurso declara sus campos públicos y la expresión ORM de la que salen.
+Las consultas piden solo las columnas solicitadas con ``values()`` y las filas
+se convierten directamente en diccionarios, sin instanciar modelos.
+"""
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
+from django.db.models import F
+
+from .models import Carta, Expansion, Categoria, Inventario, expresion_precio_actual
+
+
+def _url_imagen(nombre):
+    return default_storage.url(nombre) if nombre else None
+
+
+def _centimos(valor):
+    # SQLite no redondea las expresiones decimales calculadas
+    return valor.quantize(Decimal('0.01')) if valor is not None else None
+
+
+class ErrorCampos(ValueError):
+    """Se pidió un campo que el recurso no expone"""
+
+
+class Proyeccion:
+    """Describe un recurso de la API: campos, expresiones y conversiones"""
+
+    def __init__(self, queryset, campos, por_defecto, conversiones=None, campo_codigo=None):
+        self.queryset = queryset
+        # nombre público -> ruta ORM (str) o expresión
+        self.campos = campos
+        self.por_defecto = por_defecto
+        self.conversiones = conversiones or {}
+        self.campo_codigo = campo_codigo
+
+    def resolver_campos(self, parametro):
+        """Valida ``?fields=`` y devuelve la lista de campos pedidos"""
+        if not parametro:
+            return list(self.por_defecto)
+        pedidos = [campo.strip() for campo in parametro.split(',') if campo.strip()]
+        desconocidos = [campo for campo in pedidos if campo not in self.campos]
+        if desconocidos:
+            raise ErrorCampos(f"Campos no válidos: {', '.join(desconocidos)}")
+        # El id siempre se incluye: es la clave de paginación y de los lotes
+        if 'id' not in pedidos:
+            pedidos.insert(0, 'id')
+        return pedidos
+
+    def consulta(self, campos, queryset=None):
+        """QuerySet de diccionarios con solo las columnas necesarias"""
+        queryset = self.queryset if queryset is None else queryset
+        rutas = {}
+        anotaciones = {}
+        for campo in campos:
+            origen = self.campos[campo]
+            if isinstance(origen, str):
+                rutas[campo] = origen
+            else:
+                anotaciones[f'_api_{campo}'] = origen
+        if anotaciones:
+            queryset = queryset.annotate(**anotaciones)
+        columnas = list(rutas.values()) + list(anotaciones)
+        return queryset.values(*columnas)
+
+    def serializar(self, filas, campos):
+        """Convierte las filas de ``values()`` a los nombres públicos"""
+        origenes = [
+            (campo, self.campos[campo] if isinstance(self.campos[campo], str) else f'_api_{campo}')
+            for campo in campos
+        ]
+        conversiones = self.conversiones
+        resultado = []
+        for fila in filas:
+            item = {}
+            for campo, origen in origenes:
+                valor = fila[origen]
+                if campo in conversiones:
+                    valor = conversiones[campo](valor)
+                item[campo] = valor
+            resultado.append(item)
+        return resultado
+
+
+PROYECCIONES = {
+    'cartas': Proyeccion(
+        queryset=Carta.objects.filter(coleccionable=True),
+        campos={
+            'id': 'id',
+            'codigo': 'codigo',
+            'nombre': 'nombre',
+            'numero': 'numero_en_expansion',
+            'descripcion': 'descripcion',
+            'tipo': 'tipo',
+            'tipo_secundario': 'tipo_secundario',
+            'hp': 'hp',
+            'rareza': 'rareza',
+            'condicion': 'condicion',
+            'es_holo': 'es_holo',
+            'primera_edicion': 'primera_edicion',
+            'idioma': 'idioma',
+            'imagen': 'imagen_frontal',
+            'popularidad': 'popularidad',
+            'expansion_id': 'expansion_id',
+            'expansion': 'expansion__codigo',
+            'categoria_id': 'categoria_id',
+            'categoria': 'categoria__nombre',
+            'precio': 'inventario__precio',
+            'precio_promocional': 'inventario__precio_promocional',
+            'en_promocion': 'inventario__en_promocion',
+            'precio_actual': expresion_precio_actual('inventario__'),
+            'stock': F('inventario__cantidad_disponible') - F('inventario__cantidad_reservada'),
+        },
+        por_defecto=['id', 'codigo', 'nombre', 'expansion', 'rareza', 'precio_actual', 'stock', 'imagen'],
+        conversiones={'imagen': _url_imagen, 'precio_actual': _centimos},
+        campo_codigo='codigo',
+    ),
+    'expansiones': Proyeccion(
+        queryset=Expansion.objects.all(),
+        campos={
+            'id': 'id',
+            'codigo': 'codigo',
+            'nombre': 'nombre',
+            'fecha_lanzamiento': 'fecha_lanzamiento',
+            'total_cartas': 'total_cartas',
+            'activa': 'activa',
+            'descripcion': 'descripcion',
+            'simbolo': 'simbolo',
+        },
+        por_defecto=['id', 'codigo', 'nombre', 'fecha_lanzamiento', 'total_cartas', 'activa'],
+        conversiones={'simbolo': _url_imagen},
+        campo_codigo='codigo',
+    ),
+    'categorias': Proyeccion(
+        queryset=Categoria.objects.all(),
+        campos={
+            'id': 'id',
+            'nombre': 'nombre',
+            'descripcion': 'descripcion',
+            'icono': 'icono',
+        },
+        por_defecto=['id', 'nombre', 'icono'],
+    ),
+    'inventario': Proyeccion(
+        queryset=Inventario.objects.all(),
+        campos={
+            'id': 'id',
+            'carta_id': 'carta_id',
+            'carta': 'carta__codigo',
+            'cantidad_disponible': 'cantidad_disponible',
+            'cantidad_reservada': 'cantidad_reservada',
+            'stock': F('cantidad_disponible') - F('cantidad_reservada'),
+            'precio': 'precio',
+            'precio_promocional': 'precio_promocional',
+            'en_promocion': 'en_promocion',
+            'precio_actual': expresion_precio_actual(),
+            'vendidos_total': 'vendidos_total',
+            'valoracion_promedio': 'valoracion_promedio',
+        },
+        por_defecto=['id', 'carta_id', 'carta', 'stock', 'precio_actual'],
+        conversiones={'precio_actual': _centimos},
+    ),
+}
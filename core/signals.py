@@ -1,51 +1,134 @@
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from django.db import transaction
-from .models import ItemPedido, Pedido, Inventario
-
-@receiver(post_save, sender=ItemPedido)
-def actualizar_stock_al_confirmar(sender, instance, created, **kwargs):
-    """
-    Actualiza el stock cuando se confirma un pedido
-    """
-    if instance.pedido.estado == 'PEND' and instance.pedido.pagado:
-        try:
-            with transaction.atomic():
-                instance.inventario.actualizar_stock(
-                    instance.cantidad, 
-                    operacion='venta'
-                )
-                # Incrementar popularidad de la carta
-                instance.inventario.popularidad += 10
-                instance.inventario.save()
-        except Exception as e:
-            # Revertir si hay error
-            print(f"Error actualizando stock: {e}")
-
-@receiver(post_delete, sender=ItemPedido)
-def restaurar_stock_al_eliminar(sender, instance, **kwargs):
-    """
-    Restaura el stock cuando se elimina un item del pedido
-    """
-    if instance.pedido.estado in ['PEND', 'PROC']:
-        try:
-            instance.inventario.liberar_stock(instance.cantidad)
-        except Exception as e:
-            print(f"Error restaurando stock: {e}")
-
-@receiver(post_save, sender=Pedido)
-def actualizar_estado_pedido(sender, instance, created, **kwargs):
-    """
-    Maneja cambios de estado del pedido
-    """
-    if not created and instance.estado == 'ENTR':
-        # Marcar como completado y liberar stock reservado
-        for item in instance.items.all():
-            try:
-                item.inventario.cantidad_reservada = max(
-                    0, 
-                    item.inventario.cantidad_reservada - item.cantidad
-                )
-                item.inventario.save()
-            except Exception as e:
-                print(f"Error liberando stock reservado: {e}")
\ No newline at end of file
+# core/signals.py
+"""
+Efectos secundarios de los cambios de estado de los pedidos.
+
+Antes eran receptores post_save/post_delete que recorrían los ítems dentro
+de la petición. Ahora son manejadores del outbox (core/outbox.py) que
+ejecuta el comando procesar_outbox: cada uno recibe todos sus eventos de un
+lote y trabaja en bloque (una UPDATE de popularidad para todos los pedidos,
+una sola conexión de correo para todos los emails). El cobro con tarjeta o
+PayPal también se pide aquí, fuera de la petición web. Cada manejador se
+reintenta por separado: un fallo del correo no retrasa el cobro. Emails y
+cobros son E/S externa y se registran con ``transaccional=False``.
+
+El stock no está aquí: lo mueve la máquina de estados (core/pedidos.py) en
+la misma transacción que el cambio de estado, para no vender unidades que
+ya están comprometidas.
+"""
+from collections import defaultdict
+
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, F, OuterRef, Subquery
+
+from .models import Carta, ItemPedido, Pedido
+from .outbox import manejador
+from .pasarela import obtener_pasarela
+from .pedidos import PENDIENTE
+
+# Popularidad que suma cada pedido que incluye la carta
+PUNTOS_POPULARIDAD_COMPRA = 10
+
+
+def _pedido_ids(eventos):
+    return [evento.pedido_id for evento in eventos]
+
+
+def _enviar_emails(eventos, asunto, cuerpo):
+    """Un email por evento con una sola conexión; ``cuerpo`` se formatea con pedido y datos"""
+    pedidos = Pedido.objects.select_related('cliente').in_bulk(_pedido_ids(eventos))
+    mensajes = []
+    for evento in eventos:
+        pedido = pedidos.get(evento.pedido_id)
+        destinatario = pedido and (pedido.email or pedido.cliente.email)
+        if not destinatario:
+            continue
+        mensajes.append(EmailMessage(
+            asunto.format(pedido=pedido),
+            cuerpo.format(pedido=pedido, datos=defaultdict(str, evento.datos)),
+            to=[destinatario],
+        ))
+    if mensajes:
+        get_connection().send_messages(mensajes)
+
+
+# =========== PEDIDO REALIZADO ===========
+
+@manejador('pedido.realizado')
+def aumentar_popularidad_compra(eventos):
+    """Suma popularidad a las cartas compradas (una UPDATE para todo el lote)"""
+    pedido_ids = _pedido_ids(eventos)
+    compras = ItemPedido.objects.filter(
+        pedido_id__in=pedido_ids, carta=OuterRef('pk')
+    ).order_by().values('carta').annotate(pedidos=Count('pedido')).values('pedidos')
+    Carta.objects.filter(
+        pk__in=ItemPedido.objects.filter(pedido_id__in=pedido_ids).values('carta')
+    ).update(popularidad=F('popularidad') + Subquery(compras) * PUNTOS_POPULARIDAD_COMPRA)
+
+
+@manejador('pedido.realizado', transaccional=False)
+def email_pedido_realizado(eventos):
+    _enviar_emails(
+        eventos,
+        'Pedido #{pedido.numero_pedido} recibido',
+        'Hola {pedido.nombre_completo},\n\n'
+        'Hemos recibido tu pedido #{pedido.numero_pedido} por {pedido.total} €.\n'
+        'Te avisaremos cuando lo enviemos.\n',
+    )
+
+
+@manejador('pedido.realizado', transaccional=False)
+def iniciar_cobro(eventos):
+    """Pide a la pasarela los cobros con tarjeta o PayPal; el resultado llega por el webhook"""
+    pedido_ids = [evento.pedido_id for evento in eventos if evento.datos.get('pasarela')]
+    if not pedido_ids:
+        return
+    pasarela = obtener_pasarela()
+    # Si falla uno se repite el lote de uno en uno: la pasarela ignora los cobros ya iniciados
+    for pedido in Pedido.objects.filter(pk__in=pedido_ids, estado=PENDIENTE):
+        pasarela.iniciar_cobro(pedido)
+
+
+# =========== PAGO Y ENVÍO ===========
+
+@manejador('pedido.pagado', transaccional=False)
+def email_pedido_pagado(eventos):
+    _enviar_emails(
+        eventos,
+        'Pago del pedido #{pedido.numero_pedido} recibido',
+        'Hola {pedido.nombre_completo},\n\n'
+        'Hemos recibido el pago de tu pedido #{pedido.numero_pedido} ({pedido.total} €).\n',
+    )
+
+
+@manejador('pedido.enviado', transaccional=False)
+def email_pedido_enviado(eventos):
+    _enviar_emails(
+        eventos,
+        'Pedido #{pedido.numero_pedido} enviado',
+        'Hola {pedido.nombre_completo},\n\n'
+        'Tu pedido #{pedido.numero_pedido} va de camino a {pedido.direccion}.\n'
+        'Número de seguimiento: {datos[numero_seguimiento]}\n',
+    )
+
+
+# =========== ENTREGA Y CANCELACIÓN ===========
+
+@manejador('pedido.entregado', transaccional=False)
+def email_pedido_entregado(eventos):
+    _enviar_emails(
+        eventos,
+        'Pedido #{pedido.numero_pedido} entregado',
+        'Hola {pedido.nombre_completo},\n\n'
+        'Tu pedido #{pedido.numero_pedido} figura como entregado. ¡Gracias por tu compra!\n',
+    )
+
+
+@manejador('pedido.cancelado', transaccional=False)
+def email_pedido_cancelado(eventos):
+    _enviar_emails(
+        eventos,
+        'Pedido #{pedido.numero_pedido} cancelado',
+        'Hola {pedido.nombre_completo},\n\n'
+        'Tu pedido #{pedido.numero_pedido} ha sido cancelado.\n'
+        '{datos[motivo]}\n',
+    )
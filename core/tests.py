@@ -1,3 +1,2034 @@
-from django.test import TestCase
+import json
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .carrito import datos_carrito_nuevo
+from .models import (
+    Carta, Categoria, ClaveIdempotencia, Coleccion, ColeccionCarta, EventoOutbox, Expansion, Inventario, ItemPedido,
+    Pedido, Resena,
+)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Los planes esperados son los de SQLite')
+class IndicesConsultasCatalogoTests(TestCase):
+    """Cada consulta caliente del catálogo usa un índice (EXPLAIN QUERY PLAN)"""
+
+    def assertUsaIndice(self, queryset, indice, ordena=True):
+        """El plan usa ``indice`` y, si ``ordena``, el orden sale del índice"""
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {indice}', plan, plan)
+        if ordena:
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+
+    def catalogo(self):
+        return Carta.objects.filter(coleccionable=True).select_related('inventario', 'expansion')
+
+    def test_destacadas_por_popularidad(self):
+        self.assertUsaIndice(self.catalogo().order_by('-popularidad')[:6], 'carta_colec_popularidad_idx')
+
+    def test_novedades_por_fecha(self):
+        self.assertUsaIndice(self.catalogo().order_by('-fecha_creacion')[:4], 'carta_colec_fecha_idx')
+
+    def test_listado_por_nombre(self):
+        self.assertUsaIndice(self.catalogo().order_by('nombre')[:20], 'carta_colec_nombre_idx')
+
+    def test_ofertas_de_la_portada(self):
+        self.assertUsaIndice(self.catalogo().filter(inventario__en_promocion=True)[:3], 'inventario_promocion_idx', ordena=False)
+
+    def test_resenas_aprobadas_de_una_carta(self):
+        self.assertUsaIndice(Resena.objects.filter(carta_id=1, aprobada=True)[:5], 'resena_carta_aprobada_idx')
+
+    def test_item_del_carrito(self):
+        plan = ItemPedido.objects.filter(pedido_id=1, carta_id=1).explain()
+        self.assertIn('(pedido_id=? AND carta_id=?)', plan, plan)
+
+    def test_listado_por_precio(self):
+        self.assertUsaIndice(self.catalogo().order_by('precio_vigente')[:20], 'carta_colec_precio_idx')
+
+    def test_listado_en_stock_por_precio(self):
+        self.assertUsaIndice(
+            self.catalogo().filter(stock_real__gt=0).order_by('precio_vigente')[:20], 'carta_colec_stock_precio_idx'
+        )
+
+
+class CheckoutSinCargasPerezosasTests(TestCase):
+    """El checkout carga el carrito una sola vez: consultas fijas con 50 líneas"""
+
+    LINEAS = 50
+    MAX_CONSULTAS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('entrenador', password='pikachu')
+        expansion = Expansion.objects.create(
+            codigo='TST', nombre='Expansión de prueba', fecha_lanzamiento=date(2024, 1, 1), total_cartas=cls.LINEAS
+        )
+        cartas = Carta.objects.bulk_create([
+            Carta(
+                codigo=f'TST-{numero:03}', nombre=f'Carta {numero}', numero_en_expansion=numero,
+                descripcion='', expansion=expansion, rareza='COMUN', imagen_frontal=f'cartas/frontal/{numero}.png',
+            )
+            for numero in range(cls.LINEAS)
+        ])
+        inventarios = Inventario.objects.bulk_create([
+            Inventario(carta=carta, cantidad_disponible=10, precio=Decimal('1.50')) for carta in cartas
+        ])
+        cls.carrito = Pedido.objects.create(cliente=cls.usuario, estado='CARRITO', **datos_carrito_nuevo(cls.usuario))
+        ItemPedido.objects.bulk_create([
+            ItemPedido(
+                pedido=cls.carrito, carta_id=inventario.carta_id, inventario=inventario,
+                cantidad=2, precio_unitario=inventario.precio, subtotal=2 * inventario.precio,
+            )
+            for inventario in inventarios
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        # La primera visita guarda el carrito en la sesión
+        self.client.get(reverse('checkout'))
+
+    def assertConsultasFijas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(consultas), self.MAX_CONSULTAS,
+            '\n'.join(consulta['sql'] for consulta in consultas.captured_queries),
+        )
+        return response
+
+    def test_checkout(self):
+        response = self.assertConsultasFijas(reverse('checkout'))
+        self.assertContains(response, f'Productos ({2 * self.LINEAS})')
+        self.assertContains(response, 'Carta 49')
+
+    def test_pago_con_tarjeta(self):
+        response = self.assertConsultasFijas(reverse('pago_tarjeta'))
+        self.assertContains(response, f'y {self.LINEAS - 3} más')
+
+
+class AdminListadosConsultasFijasTests(TestCase):
+    """Los listados del admin hacen las mismas consultas con 2 filas que con 12"""
+
+    LISTADOS = [
+        'categoria', 'expansion', 'carta', 'inventario', 'pedido',
+        'itempedido', 'resena', 'coleccion', 'coleccioncarta', 'eventooutbox',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pikachu')
+        cls.creadas = 0
+        cls.crear_filas(2)
+
+    @classmethod
+    def crear_filas(cls, cantidad):
+        """Una fila de cada modelo (con sus relaciones) por cada número"""
+        for numero in range(cls.creadas, cls.creadas + cantidad):
+            usuario = User.objects.create_user(f'entrenador{numero}')
+            categoria = Categoria.objects.create(nombre=f'Categoría {numero}')
+            expansion = Expansion.objects.create(
+                codigo=f'E{numero:02}', nombre=f'Expansión {numero}', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+            )
+            carta = Carta.objects.create(
+                codigo=f'E{numero:02}-001', nombre=f'Carta {numero}', numero_en_expansion=1, descripcion='',
+                expansion=expansion, categoria=categoria, rareza='COMUN', imagen_frontal=f'cartas/frontal/{numero}.png',
+            )
+            inventario = Inventario.objects.create(carta=carta, cantidad_disponible=10, precio=Decimal('1.50'))
+            pedido = Pedido.objects.create(cliente=usuario, estado='CARRITO', **datos_carrito_nuevo(usuario))
+            ItemPedido.objects.create(
+                pedido=pedido, carta=carta, inventario=inventario,
+                cantidad=2, precio_unitario=inventario.precio, subtotal=2 * inventario.precio,
+            )
+            Resena.objects.create(carta=carta, usuario=usuario, valoracion=5, titulo='Genial', comentario='')
+            coleccion = Coleccion.objects.create(usuario=usuario, nombre=f'Colección {numero}')
+            ColeccionCarta.objects.create(coleccion=coleccion, carta=carta, cantidad=3)
+            EventoOutbox.objects.create(tipo='pedido.realizado', pedido=pedido)
+        cls.creadas += cantidad
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def consultas_listado(self, modelo):
+        # Sin el total en cache: se mide también el COUNT del paginador
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse(f'admin:core_{modelo}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return [consulta['sql'] for consulta in consultas.captured_queries]
+
+    def test_consultas_fijas_por_pagina(self):
+        pocas = {modelo: self.consultas_listado(modelo) for modelo in self.LISTADOS}
+        self.crear_filas(10)
+        for modelo in self.LISTADOS:
+            with self.subTest(modelo=modelo):
+                muchas = self.consultas_listado(modelo)
+                self.assertEqual(len(muchas), len(pocas[modelo]), '\n'.join(muchas))
+
+    def test_total_del_paginador_en_cache(self):
+        self.consultas_listado('pedido')
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('admin:core_pedido_changelist'))
+        self.assertFalse(any('COUNT(' in consulta['sql'] for consulta in consultas.captured_queries))
+
+    def test_accion_cambiar_estado(self):
+        pedidos = list(Pedido.objects.order_by('pk'))
+        Pedido.objects.filter(pk=pedidos[0].pk).update(estado='PENDIENTE')
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(reverse('admin:core_pedido_changelist'), {
+                'action': 'marcar_como_pagado', '_selected_action': [pedido.pk for pedido in pedidos],
+            })
+        # Los omitidos salen de los ids ya cargados: ningún COUNT sobre la selección
+        sql = [consulta['sql'] for consulta in consultas.captured_queries]
+        self.assertFalse([consulta for consulta in sql if 'COUNT(' in consulta and 'IN (' in consulta])
+        self.assertEqual(len([consulta for consulta in sql if consulta.startswith('UPDATE "core_pedido"')]), 1)
+        self.assertEqual(Pedido.objects.get(pk=pedidos[0].pk).estado, 'PAGADO')
+        self.assertEqual(Pedido.objects.get(pk=pedidos[1].pk).estado, 'CARRITO')
+        response = self.client.get(response.url)
+        self.assertContains(response, '1 pedidos marcados como pagados (1 omitidos por su estado)')
+
+    def test_recuentos_anotados(self):
+        response = self.client.get(reverse('admin:core_pedido_changelist'))
+        self.assertContains(response, '<td class="field-get_cantidad_items">2</td>', html=True)
+        response = self.client.get(reverse('admin:core_expansion_changelist'))
+        self.assertContains(response, '<td class="field-get_cartas_count">1</td>', html=True)
+
+
+class ReservaStockTests(TestCase):
+    """La reserva al realizar el pedido no vende más unidades de las que hay"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expansion = Expansion.objects.create(
+            codigo='RSV', nombre='Reservas', fecha_lanzamiento=date(2024, 1, 1), total_cartas=2
+        )
+        cls.ultima = cls.crear_inventario(1, disponibles=1)
+        cls.sobrada = cls.crear_inventario(2, disponibles=10)
+
+    @classmethod
+    def crear_inventario(cls, numero, disponibles):
+        carta = Carta.objects.create(
+            codigo=f'RSV-{numero:03}', nombre=f'Carta {numero}', numero_en_expansion=numero,
+            descripcion='', expansion=cls.expansion, rareza='COMUN', imagen_frontal=f'cartas/frontal/r{numero}.png',
+        )
+        return Inventario.objects.create(carta=carta, cantidad_disponible=disponibles, precio=Decimal('2.00'))
+
+    def carrito(self, usuario, *lineas):
+        carrito = Pedido.objects.create(cliente=usuario, estado='CARRITO', **datos_carrito_nuevo(usuario))
+        for inventario, cantidad in lineas:
+            ItemPedido.objects.create(
+                pedido=carrito, carta_id=inventario.carta_id, inventario=inventario,
+                cantidad=cantidad, precio_unitario=inventario.precio, subtotal=cantidad * inventario.precio,
+            )
+        return carrito
+
+    def comprar(self, usuario):
+        self.client.force_login(usuario)
+        self.client.get(reverse('pago_efectivo'))
+        return self.client.post(reverse('pago_efectivo'), follow=True)
+
+    def test_dos_compras_de_la_ultima_unidad(self):
+        primero = User.objects.create_user('primero')
+        segundo = User.objects.create_user('segundo')
+        carrito_primero = self.carrito(primero, (self.ultima, 1))
+        carrito_segundo = self.carrito(segundo, (self.ultima, 1))
+
+        self.comprar(primero)
+        response = self.comprar(segundo)
+
+        self.assertContains(response, 'Stock insuficiente para Carta 1')
+        carrito_primero.refresh_from_db()
+        carrito_segundo.refresh_from_db()
+        self.assertEqual(carrito_primero.estado, 'PENDIENTE')
+        self.assertEqual(carrito_segundo.estado, 'CARRITO')
+        self.ultima.refresh_from_db()
+        self.assertEqual((self.ultima.cantidad_reservada, self.ultima.stock_real), (1, 0))
+        self.assertEqual(Carta.objects.get(pk=self.ultima.carta_id).stock_real, 0)
+
+    def test_sin_reserva_parcial(self):
+        from .models import StockInsuficiente
+        from .pedidos import transicionar, PENDIENTE
+
+        carrito = self.carrito(User.objects.create_user('parcial'), (self.sobrada, 3), (self.ultima, 2))
+        with self.assertRaisesMessage(StockInsuficiente, 'Carta 1'):
+            transicionar([carrito.pk], PENDIENTE)
+
+        carrito.refresh_from_db()
+        self.assertEqual(carrito.estado, 'CARRITO')
+        self.assertEqual(Inventario.objects.get(pk=self.sobrada.pk).cantidad_reservada, 0)
+        self.assertFalse(EventoOutbox.objects.filter(pedido=carrito).exists())
+
+    def test_api_responde_409(self):
+        usuario = User.objects.create_user('api')
+        self.carrito(usuario, (self.ultima, 2))
+        self.client.force_login(usuario)
+        response = self.client.post(reverse('procesar_pago', args=['efectivo']))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['success'])
+
+
+class ReservaStockConcurrenteTests(TransactionTestCase):
+    """Dos hilos compran a la vez la última unidad: solo uno la reserva"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite en memoria no espera al bloqueo entre hilos; usar SQLITE_TEST_NAME=/tmp/test.sqlite3')
+
+    def test_compras_simultaneas(self):
+        import threading
+        from django.db import connections
+        from .models import StockInsuficiente
+        from .pedidos import transicionar, PENDIENTE
+
+        expansion = Expansion.objects.create(
+            codigo='CNC', nombre='Concurrencia', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        carta = Carta.objects.create(
+            codigo='CNC-001', nombre='Última', numero_en_expansion=1, descripcion='', expansion=expansion, rareza='COMUN'
+        )
+        inventario = Inventario.objects.create(carta=carta, cantidad_disponible=1, precio=Decimal('2.00'))
+        carritos = []
+        for numero in range(2):
+            usuario = User.objects.create_user(f'hilo{numero}')
+            carrito = Pedido.objects.create(cliente=usuario, estado='CARRITO', **datos_carrito_nuevo(usuario))
+            ItemPedido.objects.create(
+                pedido=carrito, carta=carta, inventario=inventario,
+                cantidad=1, precio_unitario=inventario.precio, subtotal=inventario.precio,
+            )
+            carritos.append(carrito.pk)
+
+        salida = threading.Barrier(2)
+        resultados = []
+
+        def comprar(pedido_id):
+            try:
+                salida.wait()
+                resultados.append(transicionar([pedido_id], PENDIENTE))
+            except StockInsuficiente:
+                resultados.append('sin stock')
+            except Exception as e:
+                resultados.append(repr(e))
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=comprar, args=(pk,)) for pk in carritos]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(resultados), 2, resultados)
+        self.assertEqual(resultados.count('sin stock'), 1, resultados)
+        inventario.refresh_from_db()
+        self.assertEqual((inventario.cantidad_reservada, inventario.stock_real), (1, 0))
+        self.assertEqual(Pedido.objects.filter(pk__in=carritos, estado=PENDIENTE).count(), 1)
+
+
+class OutboxTests(TestCase):
+    """Cada manejador del outbox se entrega y reintenta por separado"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('outbox', email='outbox@example.com')
+        expansion = Expansion.objects.create(
+            codigo='OBX', nombre='Outbox', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='OBX-001', nombre='Mensajera', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN',
+        )
+        inventario = Inventario.objects.create(carta=cls.carta, cantidad_disponible=5, precio=Decimal('3.00'))
+        cls.pedido = Pedido.objects.create(
+            cliente=cls.usuario, estado='PENDIENTE', transaccion_id='TARJ_PRUEBA', **datos_carrito_nuevo(cls.usuario)
+        )
+        ItemPedido.objects.create(
+            pedido=cls.pedido, carta=cls.carta, inventario=inventario,
+            cantidad=1, precio_unitario=inventario.precio, subtotal=inventario.precio,
+        )
+
+    def setUp(self):
+        from . import outbox
+        self.outbox = outbox
+        outbox.registrar_eventos({'pedido.realizado': [self.pedido.pk]}, pasarela=True)
+        self.pasarela = mock.Mock()
+        parche = mock.patch('core.signals.obtener_pasarela', return_value=self.pasarela)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def fila(self, manejador):
+        return EventoOutbox.objects.get(pedido=self.pedido, manejador=manejador)
+
+    def disponible_ya(self):
+        """Simula que pasó la espera de los reintentos"""
+        EventoOutbox.objects.update(disponible_desde=timezone.now() - timedelta(seconds=1))
+
+    def test_una_fila_por_manejador(self):
+        self.assertEqual(
+            sorted(EventoOutbox.objects.values_list('manejador', flat=True)),
+            ['aumentar_popularidad_compra', 'email_pedido_realizado', 'iniciar_cobro'],
+        )
+
+    def test_vaciar_la_cola(self):
+        self.assertEqual(self.outbox.procesar_lote(), (3, 0))
+        self.assertFalse(self.outbox.pendientes().exists())
+        self.assertEqual(len(mail.outbox), 1)
+        self.pasarela.iniciar_cobro.assert_called_once()
+        self.assertEqual(Carta.objects.get(pk=self.carta.pk).popularidad, self.carta.popularidad + 10)
+        # Nada que repetir en la siguiente vuelta
+        self.assertEqual(self.outbox.procesar_lote(), (0, 0))
+
+    def test_fallo_del_correo_no_bloquea_el_cobro(self):
+        with mock.patch('core.signals.get_connection', side_effect=OSError('SMTP caído')):
+            self.assertEqual(self.outbox.procesar_lote(), (2, 1))
+
+        self.pasarela.iniciar_cobro.assert_called_once()
+        self.assertIsNotNone(self.fila('iniciar_cobro').fecha_procesado)
+        self.assertIsNotNone(self.fila('aumentar_popularidad_compra').fecha_procesado)
+        email = self.fila('email_pedido_realizado')
+        self.assertIsNone(email.fecha_procesado)
+        self.assertEqual(email.intentos, 1)
+        self.assertIn('SMTP caído', email.ultimo_error)
+
+        # El reintento solo repite el email
+        self.disponible_ya()
+        self.assertEqual(self.outbox.procesar_lote(), (1, 0))
+        self.pasarela.iniciar_cobro.assert_called_once()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_espera_exponencial(self):
+        esperas = []
+        with mock.patch('core.signals.get_connection', side_effect=OSError('SMTP caído')):
+            for _ in range(3):
+                self.disponible_ya()
+                antes = timezone.now()
+                self.outbox.procesar_lote()
+                esperas.append(round((self.fila('email_pedido_realizado').disponible_desde - antes).total_seconds()))
+        self.assertEqual(esperas, [2, 4, 8])
+        # Mientras espera, el worker no lo toma
+        self.assertEqual(self.outbox.procesar_lote(), (0, 0))
+
+    @override_settings(OUTBOX_MAX_INTENTOS=2)
+    def test_agotar_reintentos(self):
+        with mock.patch('core.signals.get_connection', side_effect=OSError('SMTP caído')):
+            for _ in range(3):
+                self.disponible_ya()
+                self.outbox.procesar_lote()
+        email = self.fila('email_pedido_realizado')
+        self.assertEqual(email.intentos, 2)
+        self.assertEqual(list(self.outbox.fallidos()), [email])
+        self.assertFalse(self.outbox.pendientes().exists())
+
+    def test_manejador_transaccional_se_deshace(self):
+        def falla_tras_escribir(eventos):
+            Carta.objects.filter(pk=self.carta.pk).update(popularidad=999)
+            raise RuntimeError('fallo tras escribir')
+
+        self.outbox.registrar_eventos({'pedido.pagado': [self.pedido.pk]})
+        EventoOutbox.objects.filter(tipo='pedido.pagado').update(manejador='falla_tras_escribir')
+        with mock.patch.dict(self.outbox.MANEJADORES['pedido.pagado'], {'falla_tras_escribir': (falla_tras_escribir, True)}):
+            procesados, errores = self.outbox.procesar_lote()
+        self.assertEqual(errores, 1)
+        self.assertNotEqual(Carta.objects.get(pk=self.carta.pk).popularidad, 999)
+        self.assertIsNone(EventoOutbox.objects.get(manejador='falla_tras_escribir').fecha_procesado)
+
+
+@override_settings(PASARELA_SECRETO='secreto-de-pruebas')
+class WebhookPasarelaTests(TestCase):
+    """Firma del webhook y transiciones PENDIENTE -> PAGADO / CANCELADO"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user('webhook')
+        expansion = Expansion.objects.create(
+            codigo='WHK', nombre='Webhook', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        carta = Carta.objects.create(
+            codigo='WHK-001', nombre='Cobradora', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN',
+        )
+        cls.inventario = Inventario.objects.create(
+            carta=carta, cantidad_disponible=5, cantidad_reservada=2, precio=Decimal('4.00')
+        )
+        cls.pedido = Pedido.objects.create(
+            cliente=usuario, estado='PENDIENTE', metodo_pago='TARJETA', transaccion_id='TARJ_WEBHOOK',
+            **datos_carrito_nuevo(usuario)
+        )
+        ItemPedido.objects.create(
+            pedido=cls.pedido, carta=carta, inventario=cls.inventario,
+            cantidad=2, precio_unitario=cls.inventario.precio, subtotal=2 * cls.inventario.precio,
+        )
+
+    def notificar(self, estado, transaccion_id='TARJ_WEBHOOK', firma=None, **extra):
+        from .pasarela import CABECERA_FIRMA, firmar
+        cuerpo = json.dumps({'transaccion_id': transaccion_id, 'estado': estado, **extra}).encode()
+        cabeceras = {}
+        if firma is not False:
+            cabeceras[CABECERA_FIRMA] = firma or firmar(cuerpo, 'secreto-de-pruebas')
+        return self.client.post(
+            reverse('webhook_pasarela'), cuerpo, content_type='application/json', headers=cabeceras
+        )
+
+    def estado(self):
+        return Pedido.objects.values_list('estado', flat=True).get(pk=self.pedido.pk)
+
+    def test_aprobado_pasa_a_pagado(self):
+        respuesta = self.notificar('aprobado')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self.estado(), 'PAGADO')
+        self.assertTrue(EventoOutbox.objects.filter(pedido=self.pedido, tipo='pedido.pagado').exists())
+
+    def test_rechazado_cancela_y_libera_la_reserva(self):
+        respuesta = self.notificar('rechazado', motivo='Fondos insuficientes')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self.estado(), 'CANCELADO')
+        self.inventario.refresh_from_db()
+        self.assertEqual(self.inventario.cantidad_reservada, 0)
+        self.assertEqual(self.inventario.cantidad_disponible, 5)
+
+    def test_firma_incorrecta(self):
+        respuesta = self.notificar('aprobado', firma='0' * 64)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self.estado(), 'PENDIENTE')
+
+    def test_sin_firma(self):
+        respuesta = self.notificar('aprobado', firma=False)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self.estado(), 'PENDIENTE')
+
+    def test_firma_reutilizada_con_otro_cuerpo(self):
+        from .pasarela import firmar
+        firma_del_rechazo = firmar(
+            json.dumps({'transaccion_id': 'TARJ_WEBHOOK', 'estado': 'rechazado'}).encode(), 'secreto-de-pruebas'
+        )
+        respuesta = self.notificar('aprobado', firma=firma_del_rechazo)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self.estado(), 'PENDIENTE')
+
+    def test_notificacion_repetida_no_cambia_nada(self):
+        self.assertEqual(self.notificar('aprobado').status_code, 200)
+        eventos = EventoOutbox.objects.count()
+        # La misma notificación reenviada, y un rechazo tardío, no tocan un pedido ya pagado
+        self.assertEqual(self.notificar('aprobado').status_code, 200)
+        self.assertEqual(self.notificar('rechazado').status_code, 200)
+        self.assertEqual(self.estado(), 'PAGADO')
+        self.assertEqual(EventoOutbox.objects.count(), eventos)
+        self.inventario.refresh_from_db()
+        self.assertEqual(self.inventario.cantidad_reservada, 2)
+
+    def test_transaccion_desconocida(self):
+        self.assertEqual(self.notificar('aprobado', transaccion_id='TARJ_OTRA').status_code, 404)
+
+    def test_pasarela_incompleta_no_se_instancia(self):
+        from .pasarela import Pasarela
+
+        class SoloCobro(Pasarela):
+            def iniciar_cobro(self, pedido):
+                pass
+
+        with self.assertRaises(TypeError):
+            SoloCobro()
+
+
+class IdempotenciaPagoTests(TestCase):
+    """Reintentos con la misma Idempotency-Key y validación del checkout"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('idempotente', email='idem@example.com')
+        expansion = Expansion.objects.create(
+            codigo='IDM', nombre='Idempotencia', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='IDM-001', nombre='Repetida', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN', imagen_frontal='cartas/idm.png',
+        )
+        cls.inventario = Inventario.objects.create(carta=cls.carta, cantidad_disponible=5, precio=Decimal('3.00'))
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def llenar_carrito(self):
+        carrito = Pedido.objects.create(
+            cliente=self.usuario, estado='CARRITO', **datos_carrito_nuevo(self.usuario)
+        )
+        ItemPedido.objects.create(
+            pedido=carrito, carta=self.carta, inventario=self.inventario,
+            cantidad=1, precio_unitario=self.inventario.precio, subtotal=self.inventario.precio,
+        )
+        return carrito
+
+    def pagar(self, clave, metodo='efectivo'):
+        return self.client.post(
+            reverse('procesar_pago', args=[metodo]), headers={'Idempotency-Key': clave}
+        )
+
+    def test_reintento_devuelve_la_respuesta_guardada(self):
+        carrito = self.llenar_carrito()
+        primera = self.pagar('clave-1')
+        segunda = self.pagar('clave-1')
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(segunda.status_code, 200)
+        self.assertEqual(segunda['Idempotent-Replayed'], 'true')
+        self.assertEqual(segunda.json(), primera.json())
+        self.assertEqual(Pedido.objects.filter(cliente=self.usuario, estado='PENDIENTE').count(), 1)
+        self.inventario.refresh_from_db()
+        self.assertEqual(self.inventario.cantidad_reservada, 1)
+        self.assertEqual(primera.json()['pedido_id'], str(carrito.numero_pedido))
+
+    def test_los_errores_no_consumen_la_clave(self):
+        # Sin carrito (404) o con un método desconocido (400): no se guardan
+        self.assertEqual(self.pagar('clave-2').status_code, 404)
+        self.assertFalse(ClaveIdempotencia.objects.filter(clave='clave-2').exists())
+        self.llenar_carrito()
+        self.assertEqual(self.pagar('clave-2', metodo='bitcoin').status_code, 400)
+        self.assertFalse(ClaveIdempotencia.objects.filter(clave='clave-2').exists())
+
+        # Con el problema resuelto, la misma clave realiza el pedido
+        respuesta = self.pagar('clave-2')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', respuesta)
+        self.assertTrue(respuesta.json()['success'])
+
+    def test_clave_en_otra_ruta(self):
+        self.llenar_carrito()
+        self.pagar('clave-3')
+        self.assertEqual(self.pagar('clave-3', metodo='transferencia').status_code, 422)
+
+    def test_redirecciones_de_error_no_consumen_la_clave(self):
+        url = reverse('pago_efectivo')
+        # Carrito vacío y después sin stock: redirecciones de error, la clave sigue libre
+        self.assertRedirects(self.client.post(url, {'clave_idempotencia': 'form-1'}), reverse('lista_cartas'),
+                             fetch_redirect_response=False)
+        carrito = self.llenar_carrito()
+        Inventario.objects.filter(pk=self.inventario.pk).update(cantidad_disponible=0)
+        self.assertRedirects(self.client.post(url, {'clave_idempotencia': 'form-1'}), reverse('ver_carrito'),
+                             fetch_redirect_response=False)
+        self.assertFalse(ClaveIdempotencia.objects.filter(clave='form-1').exists())
+
+        # Con stock, la misma clave realiza el pedido; el reintento repite la redirección
+        Inventario.objects.filter(pk=self.inventario.pk).update(cantidad_disponible=5)
+        detalle = reverse('detalle_pedido', args=[carrito.numero_pedido])
+        primera = self.client.post(url, {'clave_idempotencia': 'form-1'})
+        self.assertRedirects(primera, detalle, fetch_redirect_response=False)
+        segunda = self.client.post(url, {'clave_idempotencia': 'form-1'})
+        self.assertEqual((segunda.status_code, segunda['Location']), (302, detalle))
+        self.assertEqual(segunda['Idempotent-Replayed'], 'true')
+
+    def test_checkout_rechaza_metodo_desconocido(self):
+        carrito = self.llenar_carrito()
+        respuesta = self.client.post(reverse('checkout'), {
+            'nombre_completo': 'Ana', 'email': 'ana@example.com', 'telefono': '600000000',
+            'direccion': 'Calle 1', 'ciudad': 'Madrid', 'provincia': 'Madrid', 'codigo_postal': '28001',
+            'metodo_pago': 'TRUEQUE',
+        })
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertContains(respuesta, 'Selecciona un método de pago válido', status_code=400)
+        carrito.refresh_from_db()
+        self.assertEqual(carrito.estado, 'CARRITO')
+        self.assertIsNone(carrito.metodo_pago)
+
+
+class IdempotenciaConcurrenteTests(TransactionTestCase):
+    """Dos envíos simultáneos con la misma clave realizan un solo pedido"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite en memoria no espera al bloqueo entre hilos; usar SQLITE_TEST_NAME=/tmp/test.sqlite3')
+
+    def test_doble_envio_simultaneo(self):
+        import threading
+        from django.db import connections
+        from django.test import Client
+
+        usuario = User.objects.create_user('doble-clic')
+        expansion = Expansion.objects.create(
+            codigo='DBL', nombre='Doble', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        carta = Carta.objects.create(
+            codigo='DBL-001', nombre='Gemela', numero_en_expansion=1, descripcion='', expansion=expansion, rareza='COMUN'
+        )
+        inventario = Inventario.objects.create(carta=carta, cantidad_disponible=5, precio=Decimal('2.00'))
+        carrito = Pedido.objects.create(cliente=usuario, estado='CARRITO', **datos_carrito_nuevo(usuario))
+        ItemPedido.objects.create(
+            pedido=carrito, carta=carta, inventario=inventario,
+            cantidad=1, precio_unitario=inventario.precio, subtotal=inventario.precio,
+        )
+
+        salida = threading.Barrier(2)
+        respuestas = []
+
+        def enviar():
+            cliente = Client()
+            cliente.force_login(usuario)
+            try:
+                salida.wait()
+                respuestas.append(cliente.post(
+                    reverse('procesar_pago', args=['efectivo']), headers={'Idempotency-Key': 'doble'}
+                ))
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=enviar) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual([respuesta.status_code for respuesta in respuestas], [200, 200])
+        self.assertEqual(sum(respuesta.has_header('Idempotent-Replayed') for respuesta in respuestas), 1)
+        self.assertEqual(respuestas[0].json()['pedido_id'], respuestas[1].json()['pedido_id'])
+        self.assertEqual(Pedido.objects.filter(cliente=usuario, estado='PENDIENTE').count(), 1)
+        inventario.refresh_from_db()
+        self.assertEqual(inventario.cantidad_reservada, 1)
+
+
+@unittest.skipUnless(
+    connection.settings_dict['ENGINE'] == 'core.backends.postgresql_pool',
+    'Solo con DB_PERFIL=postgres_pool y un PostgreSQL accesible',
+)
+class PoolPostgresTests(TransactionTestCase):
+    """Las conexiones cerradas vuelven al pool y se reutilizan"""
+
+    def test_reutiliza_conexiones(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+        abiertas = connection.pool.get_stats()['connections_num']
+
+        for _ in range(5):
+            connection.close()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        estadisticas = connection.pool.get_stats()
+        self.assertEqual(estadisticas['connections_num'], abiertas)
+        self.assertGreaterEqual(estadisticas['requests_num'], 6)
+        self.assertTrue(connection.is_usable())
+
+
+class RedondeoTotalesTests(TestCase):
+    """El UPDATE en SQL y el cálculo en Python redondean el IVA igual"""
+
+    def test_mitades_hacia_arriba_en_ambos_caminos(self):
+        from .models import redondear_dinero, TIPO_IVA
+
+        usuario = User.objects.create_user('redondeo')
+        expansion = Expansion.objects.create(
+            codigo='RDN', nombre='Redondeo', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        carta = Carta.objects.create(
+            codigo='RDN-001', nombre='Céntimo', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN',
+        )
+        # 0.50, 1.50 y 2.50 dan 0.105, 0.315 y 0.525 de IVA: la mitad exacta
+        esperados = {
+            Decimal('0.05'): Decimal('0.01'),
+            Decimal('0.50'): Decimal('0.11'),
+            Decimal('1.50'): Decimal('0.32'),
+            Decimal('2.50'): Decimal('0.53'),
+            Decimal('12.50'): Decimal('2.63'),
+            Decimal('99.95'): Decimal('20.99'),
+        }
+        inventario = Inventario.objects.create(carta=carta, cantidad_disponible=1, precio=Decimal('1.00'))
+        pedidos = {}
+        for precio in esperados:
+            pedido = Pedido.objects.create(
+                cliente=usuario, estado='PENDIENTE', descuento=Decimal('0.00'), **datos_carrito_nuevo(usuario)
+            )
+            ItemPedido.objects.create(
+                pedido=pedido, carta=carta, inventario=inventario, cantidad=1, precio_unitario=precio, subtotal=precio,
+            )
+            pedidos[precio] = pedido
+
+        Pedido.objects.filter(pk__in=[pedido.pk for pedido in pedidos.values()]).recalcular_totales()
+        for precio, impuestos in esperados.items():
+            with self.subTest(subtotal=precio):
+                self.assertEqual(redondear_dinero(precio * TIPO_IVA), impuestos)
+                en_sql = Pedido.objects.get(pk=pedidos[precio].pk)
+                self.assertEqual(en_sql.impuestos, impuestos)
+                en_python = pedidos[precio]
+                en_python.calcular_totales()
+                self.assertEqual((en_python.impuestos, en_python.total), (en_sql.impuestos, en_sql.total))
+
+
+class CarritosDuplicadosMixin:
+    """Datos con varios carritos por cliente (la restricción única se quita en la prueba)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='DUP', nombre='Duplicados', fecha_lanzamiento=date(2024, 1, 1), total_cartas=3
+        )
+        cls.inventarios = []
+        for numero, precio in enumerate([Decimal('1.25'), Decimal('3.10'), Decimal('0.55')]):
+            carta = Carta.objects.create(
+                codigo=f'DUP-{numero:03}', nombre=f'Duplicada {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, rareza='COMUN', imagen_frontal=f'cartas/dup{numero}.png',
+            )
+            cls.inventarios.append(Inventario.objects.create(carta=carta, cantidad_disponible=50, precio=precio))
+
+    def setUp(self):
+        # Las bases de datos anteriores a la restricción podían tener varios carritos
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX pedido_un_carrito_por_cliente')
+
+    def carrito(self, usuario, dias, *lineas):
+        """Carrito de hace ``dias`` días con (inventario, cantidad) por línea"""
+        carrito = Pedido.objects.create(cliente=usuario, estado='CARRITO', **datos_carrito_nuevo(usuario))
+        Pedido.objects.filter(pk=carrito.pk).update(fecha_pedido=timezone.now() - timedelta(days=dias))
+        for inventario, cantidad in lineas:
+            ItemPedido.objects.create(
+                pedido=carrito, carta=inventario.carta, inventario=inventario, cantidad=cantidad,
+                precio_unitario=inventario.precio, subtotal=inventario.precio * cantidad,
+            )
+        return carrito
+
+    def lineas(self, carrito):
+        return dict(carrito.items.values_list('carta__codigo', 'cantidad'))
+
+
+class LimpiarCarritosDuplicadosTests(CarritosDuplicadosMixin, TestCase):
+    """Consolidación por conjuntos de limpiar_carritos_duplicados"""
+
+    def setUp(self):
+        super().setUp()
+        uno, dos, tres = self.inventarios
+        self.usuario = User.objects.create_user('duplicado')
+        self.principal = self.carrito(self.usuario, 0, (uno, 1))
+        self.secundarios = [self.carrito(self.usuario, 1, (uno, 2), (dos, 1)), self.carrito(self.usuario, 2, (tres, 4))]
+        # Un cliente con un solo carrito no se toca
+        self.otro = User.objects.create_user('sin_duplicados')
+        self.unico = self.carrito(self.otro, 0, (dos, 2))
+
+    def limpiar(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        salida = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('limpiar_carritos_duplicados', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_fusiona_en_el_carrito_mas_reciente(self):
+        self.limpiar()
+        # Misma carta: cantidades sumadas; solo en un secundario: se mueve
+        self.assertEqual(self.lineas(self.principal), {'DUP-000': 3, 'DUP-001': 1, 'DUP-002': 4})
+        self.assertFalse(Pedido.objects.filter(pk__in=[carrito.pk for carrito in self.secundarios]).exists())
+        self.assertEqual(list(Pedido.objects.filter(estado='CARRITO', cliente=self.usuario)), [self.principal])
+        self.assertEqual(self.lineas(self.unico), {'DUP-001': 2})
+        item = self.principal.items.get(carta__codigo='DUP-000')
+        self.assertEqual(item.subtotal, item.precio_unitario * 3)
+
+    def test_totales_como_el_modelo(self):
+        self.limpiar()
+        for carrito in (self.principal, self.unico):
+            en_sql = Pedido.objects.get(pk=carrito.pk)
+            en_python = Pedido.objects.get(pk=carrito.pk)
+            en_python.calcular_totales()
+            with self.subTest(carrito=carrito.pk):
+                self.assertEqual(en_sql.subtotal, Decimal('9.05') if carrito == self.principal else Decimal('6.20'))
+                self.assertEqual(
+                    (en_sql.subtotal, en_sql.envio, en_sql.impuestos, en_sql.total),
+                    (en_python.subtotal, en_python.envio, en_python.impuestos, en_python.total),
+                )
+
+    def test_dry_run_no_modifica_nada(self):
+        antes = list(ItemPedido.objects.order_by('pk').values_list('pk', 'pedido_id', 'cantidad', 'subtotal'))
+        totales = list(Pedido.objects.order_by('pk').values_list('pk', 'subtotal', 'total'))
+        salida = self.limpiar('--dry-run')
+        self.assertIn('2 carritos a eliminar, 2 items movidos, 1 items fusionados', salida)
+        self.assertEqual(list(ItemPedido.objects.order_by('pk').values_list('pk', 'pedido_id', 'cantidad', 'subtotal')), antes)
+        self.assertEqual(list(Pedido.objects.order_by('pk').values_list('pk', 'subtotal', 'total')), totales)
+
+
+class MigracionCarritoUnicoTests(CarritosDuplicadosMixin, TestCase):
+    """La migración 0006 fusiona los carritos y deja los totales al día"""
+
+    def test_totales_del_carrito_fusionado(self):
+        from importlib import import_module
+        from django.apps import apps
+        migracion = import_module('core.migrations.0006_pedido_un_carrito_por_cliente')
+        uno, dos, _ = self.inventarios
+        usuario = User.objects.create_user('migrado')
+        principal = self.carrito(usuario, 0, (uno, 1))
+        self.carrito(usuario, 1, (uno, 2), (dos, 30))
+
+        migracion.fusionar_carritos_duplicados(apps, None)
+        principal = Pedido.objects.get(pk=principal.pk)
+        self.assertEqual(self.lineas(principal), {'DUP-000': 3, 'DUP-001': 30})
+        calculado = Pedido.objects.get(pk=principal.pk)
+        calculado.calcular_totales()
+        self.assertEqual(principal.subtotal, Decimal('96.75'))
+        self.assertEqual(
+            (principal.subtotal, principal.envio, principal.impuestos, principal.total),
+            (calculado.subtotal, calculado.envio, calculado.impuestos, calculado.total),
+        )
+
+
+class ColumnasDesnormalizadasTests(TestCase):
+    """precio_vigente y stock_real de Carta siguen a su inventario"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expansion = Expansion.objects.create(
+            codigo='DSN', nombre='Desnormalizada', fecha_lanzamiento=date(2024, 1, 1), total_cartas=2
+        )
+
+    def crear_carta(self, numero):
+        return Carta.objects.create(
+            codigo=f'DSN-{numero:03}', nombre=f'Copiada {numero}', numero_en_expansion=numero, descripcion='',
+            expansion=self.expansion, rareza='COMUN', imagen_frontal=f'cartas/dsn{numero}.png',
+        )
+
+    def columnas(self, carta):
+        return tuple(Carta.objects.filter(pk=carta.pk).values_list('precio_vigente', 'stock_real').get())
+
+    def test_save_y_delete_del_inventario(self):
+        carta = self.crear_carta(1)
+        self.assertEqual(self.columnas(carta), (None, 0))
+        inventario = Inventario.objects.create(carta=carta, cantidad_disponible=5, precio=Decimal('2.00'))
+        self.assertEqual(self.columnas(carta), (Decimal('2.00'), 5))
+
+        inventario.cantidad_reservada = 2
+        inventario.save()
+        self.assertEqual(self.columnas(carta), (Decimal('2.00'), 3))
+
+        # La promoción cambia el precio vigente al activarla y al quitarla
+        inventario.precio_promocional = Decimal('1.50')
+        inventario.en_promocion = True
+        inventario.save()
+        self.assertEqual(self.columnas(carta), (Decimal('1.50'), 3))
+        inventario.en_promocion = False
+        inventario.save()
+        self.assertEqual(self.columnas(carta), (Decimal('2.00'), 3))
+
+        inventario.delete()
+        self.assertEqual(self.columnas(carta), (None, 0))
+        self.assertFalse(Carta.objects.desincronizadas().exists())
+
+    def test_reparar_columnas(self):
+        from io import StringIO
+        from django.core.management import call_command
+        carta = self.crear_carta(1)
+        Inventario.objects.create(carta=carta, cantidad_disponible=4, precio=Decimal('3.00'))
+        sin_inventario = self.crear_carta(2)
+        # Cambios que no pasaron por Inventario.save
+        Carta.objects.filter(pk=carta.pk).update(precio_vigente=Decimal('9.99'), stock_real=40)
+        Carta.objects.filter(pk=sin_inventario.pk).update(stock_real=7)
+        self.assertEqual(set(Carta.objects.desincronizadas()), {carta, sin_inventario})
+
+        salida = StringIO()
+        call_command('reparar_columnas_cartas', '--dry-run', stdout=salida)
+        self.assertIn('DSN-001: precio 9.99 -> 3', salida.getvalue())
+        self.assertIn('stock 40 -> 4', salida.getvalue())
+        self.assertIn('2 cartas desincronizadas', salida.getvalue())
+        self.assertEqual(self.columnas(carta), (Decimal('9.99'), 40))
+
+        call_command('reparar_columnas_cartas', stdout=StringIO())
+        self.assertEqual(self.columnas(carta), (Decimal('3.00'), 4))
+        self.assertEqual(self.columnas(sin_inventario), (None, 0))
+        self.assertFalse(Carta.objects.desincronizadas().exists())
+
+
+class AccionesMasivasTests(TestCase):
+    """Acciones por bloques, tareas encoladas y reanudación sin repetir bloques"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='MAS', nombre='Masiva', fecha_lanzamiento=date(2024, 1, 1), total_cartas=5
+        )
+        cls.cartas = [
+            Carta.objects.create(
+                codigo=f'MAS-{numero:03}', nombre=f'Masiva {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, rareza='COMUN', popularidad=0,
+            )
+            for numero in range(1, 6)
+        ]
+        cls.ids = [carta.pk for carta in cls.cartas]
+
+    def popularidades(self):
+        return list(Carta.objects.filter(pk__in=self.ids).order_by('pk').values_list('popularidad', flat=True))
+
+    def test_ejecutar_por_bloques(self):
+        from . import acciones_masivas
+        self.assertEqual(acciones_masivas.ejecutar('carta.aumentar_popularidad', self.ids, tamano_bloque=2), 5)
+        self.assertEqual(self.popularidades(), [10] * 5)
+
+    def test_encolar(self):
+        from . import acciones_masivas
+        from .models import TareaMasiva
+        with self.assertRaises(ValueError):
+            acciones_masivas.encolar('carta.inventada', self.ids)
+        tarea = acciones_masivas.encolar('carta.aumentar_popularidad', iter(self.ids))
+        self.assertEqual((tarea.estado, tarea.total, tarea.ids), (TareaMasiva.PENDIENTE, 5, self.ids))
+        self.assertEqual(self.popularidades(), [0] * 5)
+
+    def test_procesar_tarea(self):
+        from . import acciones_masivas
+        from .models import TareaMasiva
+        acciones_masivas.encolar('carta.aumentar_popularidad', self.ids)
+        tarea = acciones_masivas.tomar_tarea()
+        self.assertEqual(tarea.estado, TareaMasiva.EN_CURSO)
+        self.assertIsNone(acciones_masivas.tomar_tarea())
+
+        avances = []
+        acciones_masivas.procesar_tarea(tarea, tamano_bloque=2, progreso=lambda t: avances.append(t.procesados))
+        self.assertEqual(avances, [2, 4, 5])
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.procesados, tarea.afectados), (TareaMasiva.TERMINADA, 5, 5))
+        self.assertEqual(self.popularidades(), [10] * 5)
+
+    @override_settings(ACCIONES_SEGUNDOS_BLOQUEO=0)
+    def test_reanudar_tras_caida(self):
+        from . import acciones_masivas
+        from .models import TareaMasiva
+        acciones_masivas.encolar('carta.aumentar_popularidad', self.ids)
+        tarea = acciones_masivas.tomar_tarea()
+
+        # El worker muere después de confirmar el primer bloque
+        def caida(t):
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            acciones_masivas.procesar_tarea(tarea, tamano_bloque=2, progreso=caida)
+
+        reanudada = acciones_masivas.tomar_tarea()
+        self.assertEqual((reanudada.pk, reanudada.procesados), (tarea.pk, 2))
+        acciones_masivas.procesar_tarea(reanudada, tamano_bloque=2)
+        reanudada.refresh_from_db()
+        self.assertEqual((reanudada.estado, reanudada.afectados), (TareaMasiva.TERMINADA, 5))
+        self.assertEqual(self.popularidades(), [10] * 5)
+
+    @override_settings(ACCIONES_SEGUNDOS_BLOQUEO=0)
+    def test_worker_parado_no_repite_bloques(self):
+        from . import acciones_masivas
+        from .models import TareaMasiva
+        acciones_masivas.encolar('carta.aumentar_popularidad', self.ids)
+        lento = acciones_masivas.tomar_tarea()
+
+        # Otro worker la reclama y confirma un bloque mientras el primero está parado
+        def pausa(t):
+            raise KeyboardInterrupt
+        rapido = acciones_masivas.tomar_tarea()
+        with self.assertRaises(KeyboardInterrupt):
+            acciones_masivas.procesar_tarea(rapido, tamano_bloque=2, progreso=pausa)
+
+        with self.assertRaises(acciones_masivas.TareaReclamada):
+            acciones_masivas.procesar_tarea(lento, tamano_bloque=2)
+        lento.refresh_from_db()
+        self.assertEqual((lento.estado, lento.procesados), (TareaMasiva.EN_CURSO, 2))
+        self.assertEqual(self.popularidades(), [10, 10, 0, 0, 0])
+
+
+class RepreciadorTests(TestCase):
+    """Reglas de precios en céntimos con el redondeo de los importes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='PRC', nombre='Precios', fecha_lanzamiento=date(2024, 1, 1), total_cartas=3
+        )
+        precios = {'COMUN': Decimal('0.15'), 'RARA': Decimal('0.50'), 'ULTRA_RARA': Decimal('3.00')}
+        cls.inventarios = {}
+        for numero, (rareza, precio) in enumerate(precios.items(), start=1):
+            carta = Carta.objects.create(
+                codigo=f'PRC-{numero:03}', nombre=f'Precio {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, rareza=rareza,
+            )
+            cls.inventarios[rareza] = Inventario.objects.create(carta=carta, cantidad_disponible=1, precio=precio)
+
+    def precio(self, rareza):
+        return Inventario.objects.values_list('precio', flat=True).get(pk=self.inventarios[rareza].pk)
+
+    def test_porcentaje_redondea_mitades_hacia_arriba(self):
+        from .precios import ReglaPrecio, Repreciador
+        # 0.15 * 1.10 = 0.165: la mitad sube a 0.17
+        plan = Repreciador([ReglaPrecio(porcentaje=Decimal('10'), rarezas=('COMUN',))]).aplicar()
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(self.precio('COMUN'), Decimal('0.17'))
+        self.assertEqual(self.precio('RARA'), Decimal('0.50'))
+        self.assertEqual(
+            Carta.objects.values_list('precio_vigente', flat=True).get(pk=self.inventarios['COMUN'].carta_id),
+            Decimal('0.17'),
+        )
+
+    def test_limites_al_centimo(self):
+        from .precios import ReglaPrecio, Repreciador
+        regla = ReglaPrecio(minimo=Decimal('0.995'), maximo=Decimal('2.005'))
+        self.assertEqual((regla.minimo_centimos, regla.maximo_centimos), (100, 201))
+        Repreciador([regla]).aplicar()
+        self.assertEqual(self.precio('COMUN'), Decimal('1.00'))
+        self.assertEqual(self.precio('RARA'), Decimal('1.00'))
+        self.assertEqual(self.precio('ULTRA_RARA'), Decimal('2.01'))
+
+    def test_limites_incompatibles(self):
+        from .precios import ReglaPrecio
+        with self.assertRaises(ValueError):
+            ReglaPrecio(minimo=Decimal('2.00'), maximo=Decimal('1.994'))
+
+    def test_modo_de_prueba_no_guarda(self):
+        import io
+        from django.core.management import call_command
+        from .precios import ReglaPrecio, Repreciador
+
+        plan = Repreciador([ReglaPrecio(porcentaje=Decimal('-50'))]).calcular()
+        self.assertEqual(plan.resumen()['precio_total_despues'], Decimal('1.83'))
+        salida = io.StringIO()
+        call_command('repreciar_inventario', '--porcentaje', '-50', stdout=salida)
+        self.assertIn('Modo de prueba', salida.getvalue())
+        self.assertEqual(
+            [self.precio(rareza) for rareza in self.inventarios],
+            [Decimal('0.15'), Decimal('0.50'), Decimal('3.00')],
+        )
+
+    def test_aplicar_bloquea_el_inventario(self):
+        from django.db.models import QuerySet
+        from .precios import ReglaPrecio, Repreciador
+
+        repreciador = Repreciador([ReglaPrecio(porcentaje=Decimal('10'))])
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as bloqueo:
+            repreciador.calcular()
+            bloqueo.assert_not_called()
+            repreciador.aplicar()
+        bloqueo.assert_called_once_with(mock.ANY, of=('self',))
+        self.assertEqual(self.precio('RARA'), Decimal('0.55'))
+
+
+class CachePaginasTests(TestCase):
+    """Cache de páginas completas para visitantes anónimos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expansion = Expansion.objects.create(
+            codigo='CCH', nombre='Cache', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='CCH-001', nombre='Cacheada', numero_en_expansion=1, descripcion='', expansion=cls.expansion,
+            rareza='COMUN', imagen_frontal='cartas/cch.png',
+        )
+        Inventario.objects.create(carta=cls.carta, cantidad_disponible=3, precio=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_acierto(self):
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta['X-Cache'], 'HIT')
+        self.assertContains(respuesta, 'Cacheada')
+        # Los parámetros de seguimiento no crean otra entrada
+        self.assertEqual(self.client.get(url, {'utm_source': 'boletin'})['X-Cache'], 'HIT')
+
+    def test_invalidacion_por_etiqueta(self):
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Carta.objects.filter(pk=self.carta.pk).update(nombre='Renombrada')
+            self.carta.refresh_from_db()
+            self.carta.save()
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta['X-Cache'], 'MISS')
+        self.assertContains(respuesta, 'Renombrada')
+
+    def test_solo_anonimos(self):
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        self.client.get(url)
+        self.client.force_login(User.objects.create_user('con-sesion'))
+        self.assertFalse(self.client.get(url).has_header('X-Cache'))
+
+    def test_token_csrf_por_visitante(self):
+        import re
+        from django.test import Client
+        from .cache_paginas import MARCADOR_CSRF
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        self.client.get(url)
+
+        # Otro visitante recibe la página guardada con un token válido para su cookie
+        otro = Client(enforce_csrf_checks=True)
+        respuesta = otro.get(url)
+        self.assertEqual(respuesta['X-Cache'], 'HIT')
+        self.assertNotContains(respuesta, MARCADOR_CSRF)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', respuesta.content.decode()).group(1)
+        envio = otro.post(reverse('agregar_al_carrito', args=[self.carta.pk]), {'csrfmiddlewaretoken': token})
+        self.assertNotEqual(envio.status_code, 403)
+
+
+class ETagsTests(TestCase):
+    """ETags por versión del catálogo y del carrito"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Básicas')
+        cls.expansion = Expansion.objects.create(
+            codigo='ETG', nombre='ETags', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='ETG-001', nombre='Versionada', numero_en_expansion=1, descripcion='', expansion=cls.expansion,
+            categoria=cls.categoria, rareza='COMUN', imagen_frontal='cartas/etg.png',
+        )
+        Inventario.objects.create(carta=cls.carta, cantidad_disponible=3, precio=Decimal('1.00'))
+        cls.usuario = User.objects.create_user('etags')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detalle_304_con_if_none_match(self):
+        self.client.force_login(self.usuario)
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        etag = self.client.get(url)['ETag']
+        # Sesión, usuario y la visita (core/visitas.py): ninguna lectura del catálogo
+        with self.assertNumQueries(3):
+            respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_detalle_cambia_al_editar_el_carrito(self):
+        self.client.force_login(self.usuario)
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(
+                reverse('agregar_al_carrito', args=[self.carta.pk]), HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        self.assertTrue(respuesta.json()['success'])
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+    def test_filtrar_por_expansion_cambia_con_las_categorias(self):
+        url = reverse('filtrar_cartas')
+        parametros = {'expansion': self.expansion.pk}
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        etag = self.client.get(url, parametros, **ajax)['ETag']
+        self.assertEqual(self.client.get(url, parametros, HTTP_IF_NONE_MATCH=etag, **ajax).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.categoria.nombre = 'Renombrada'
+            self.categoria.save()
+        respuesta = self.client.get(url, parametros, HTTP_IF_NONE_MATCH=etag, **ajax)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+    def etag_filtrado(self, expansion):
+        return self.client.get(
+            reverse('filtrar_cartas'), {'expansion': expansion.pk}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )['ETag']
+
+    def test_filtrar_por_expansion_solo_cambia_con_su_expansion(self):
+        otra = Expansion.objects.create(
+            codigo='OTR', nombre='Otra', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        carta = Carta.objects.create(
+            codigo='OTR-001', nombre='Ajena', numero_en_expansion=1, descripcion='', expansion=otra,
+            rareza='COMUN', imagen_frontal='cartas/otr.png',
+        )
+        inventario = Inventario.objects.create(carta=carta, cantidad_disponible=3, precio=Decimal('1.00'))
+        etag = self.etag_filtrado(self.expansion)
+
+        # El stock de otra expansión no invalida el listado filtrado
+        with self.captureOnCommitCallbacks(execute=True):
+            inventario.cantidad_disponible = 1
+            inventario.save()
+        self.assertEqual(self.etag_filtrado(self.expansion), etag)
+
+        # El de la propia sí
+        with self.captureOnCommitCallbacks(execute=True):
+            self.carta.inventario.cantidad_disponible = 1
+            self.carta.inventario.save()
+        self.assertNotEqual(self.etag_filtrado(self.expansion), etag)
+
+    def test_carta_que_cambia_de_expansion(self):
+        otra = Expansion.objects.create(
+            codigo='DST', nombre='Destino', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        etag = self.etag_filtrado(self.expansion)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.carta.expansion = otra
+            self.carta.save()
+        self.assertNotEqual(self.etag_filtrado(self.expansion), etag)
+
+    def test_etag_api_por_recurso_y_elemento(self):
+        from .etags import etag_api
+        request = RequestFactory().get('/api/v1/cartas/')
+        self.assertNotEqual(etag_api(request, 'cartas'), etag_api(request, 'expansiones'))
+        self.assertNotEqual(etag_api(request, 'cartas', 1), etag_api(request, 'cartas', 2))
+
+
+class ApiCatalogoTests(TestCase):
+    """Proyección de campos, lotes y paginación de la API JSON"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='API', nombre='Api', fecha_lanzamiento=date(2024, 1, 1), total_cartas=3
+        )
+        cls.cartas = []
+        for numero in range(1, 4):
+            carta = Carta.objects.create(
+                codigo=f'API-{numero:03}', nombre=f'Api {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, rareza='COMUN',
+            )
+            Inventario.objects.create(carta=carta, cantidad_disponible=numero, precio=Decimal('1.50'))
+            cls.cartas.append(carta)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_proyeccion_de_campos(self):
+        url = reverse('api_detalle', args=['cartas', self.cartas[0].pk])
+        with CaptureQueriesContext(connection) as consultas:
+            datos = self.client.get(url, {'fields': 'nombre,precio_actual,stock'}).json()
+        self.assertEqual(datos, {'id': self.cartas[0].pk, 'nombre': 'Api 1', 'precio_actual': '1.50', 'stock': 1})
+        # Solo las columnas pedidas, en una consulta
+        self.assertEqual(len(consultas), 1)
+        self.assertNotIn('"descripcion"', consultas[0]['sql'])
+
+    def test_campo_desconocido(self):
+        respuesta = self.client.get(reverse('api_listado', args=['cartas']), {'fields': 'nombre,password'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('password', respuesta.json()['error'])
+
+    def test_lote_por_ids_y_codigos(self):
+        url = reverse('api_listado', args=['cartas'])
+        ids = f'{self.cartas[2].pk},{self.cartas[0].pk}'
+        with self.assertNumQueries(1):
+            por_ids = self.client.get(url, {'ids': ids, 'fields': 'codigo'}).json()['resultados']
+        self.assertEqual([fila['codigo'] for fila in por_ids], ['API-001', 'API-003'])
+
+        por_codigos = self.client.get(url, {'codigos': 'API-002,NO-EXISTE', 'fields': 'id'}).json()['resultados']
+        self.assertEqual(por_codigos, [{'id': self.cartas[1].pk}])
+
+        self.assertEqual(self.client.get(url, {'ids': '1,dos'}).status_code, 400)
+        from .views.api_views import LIMITE_MAXIMO
+        demasiados = ','.join(str(numero) for numero in range(LIMITE_MAXIMO + 1))
+        self.assertEqual(self.client.get(url, {'ids': demasiados}).status_code, 400)
+
+    def test_paginacion_por_cursor(self):
+        url = reverse('api_listado', args=['cartas'])
+        primera = self.client.get(url, {'limit': 2, 'fields': 'codigo'}).json()
+        self.assertEqual([fila['codigo'] for fila in primera['resultados']], ['API-001', 'API-002'])
+        segunda = self.client.get(primera['siguiente']).json()
+        self.assertEqual(segunda['resultados'], [{'id': self.cartas[2].pk, 'codigo': 'API-003'}])
+        self.assertIsNone(segunda['siguiente'])
+
+
+class AgregarCartaTests(TestCase):
+    """Alta en el carrito con upsert de la línea existente"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('upsert')
+        expansion = Expansion.objects.create(
+            codigo='UPS', nombre='Upsert', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='UPS-001', nombre='Acumulada', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN', imagen_frontal='cartas/ups.png',
+        )
+        Inventario.objects.create(carta=cls.carta, cantidad_disponible=5, precio=Decimal('2.00'))
+
+    def setUp(self):
+        from .carrito import obtener_o_crear_carrito
+        self.carrito = obtener_o_crear_carrito(self.usuario)
+
+    def test_suma_a_la_linea_existente(self):
+        from .carrito import agregar_carta
+        agregar_carta(self.carrito, self.carta.pk, 2)
+        agregar_carta(self.carrito, self.carta.pk, 1)
+        item = ItemPedido.objects.get(pedido=self.carrito)
+        self.assertEqual((item.cantidad, item.subtotal), (3, Decimal('6.00')))
+        self.carrito.refresh_from_db()
+        self.assertEqual(self.carrito.subtotal, Decimal('6.00'))
+        self.assertEqual(self.carrito.total, Decimal('6.00') + Decimal('4.95') + Decimal('1.26'))
+
+    def test_no_supera_el_stock(self):
+        from .carrito import agregar_carta
+        agregar_carta(self.carrito, self.carta.pk, 4)
+        with self.assertRaisesMessage(ValueError, 'Stock insuficiente'):
+            agregar_carta(self.carrito, self.carta.pk, 2)
+        self.assertEqual(ItemPedido.objects.get(pedido=self.carrito).cantidad, 4)
+
+    def test_cantidad_no_numerica(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(
+            reverse('agregar_al_carrito', args=[self.carta.pk]), {'cantidad': 'dos'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(respuesta.json()['message'], 'La cantidad debe ser un número entero')
+        self.assertFalse(ItemPedido.objects.filter(pedido=self.carrito).exists())
+
+    def test_cantidad_no_numerica_al_actualizar(self):
+        from .carrito import agregar_carta
+        agregar_carta(self.carrito, self.carta.pk, 1)
+        item = ItemPedido.objects.get(pedido=self.carrito)
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(reverse('actualizar_carrito', args=[item.pk]), {'cantidad': '1e3'}, follow=True)
+        self.assertContains(respuesta, 'La cantidad debe ser un número entero')
+        self.assertEqual(ItemPedido.objects.get(pk=item.pk).cantidad, 1)
+
+
+class CarritoUnicoTests(TestCase):
+    """Un solo carrito abierto por cliente y una línea por carta"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('carrito-unico')
+
+    def test_obtener_o_crear_devuelve_el_mismo(self):
+        from .carrito import obtener_o_crear_carrito
+        primero = obtener_o_crear_carrito(self.usuario)
+        self.assertEqual(obtener_o_crear_carrito(self.usuario).pk, primero.pk)
+        self.assertEqual(Pedido.objects.filter(cliente=self.usuario, estado='CARRITO').count(), 1)
+
+    def test_restriccion_rechaza_un_segundo_carrito(self):
+        from django.db import IntegrityError, transaction
+        Pedido.objects.create(cliente=self.usuario, estado='CARRITO', **datos_carrito_nuevo(self.usuario))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Pedido.objects.create(cliente=self.usuario, estado='CARRITO', **datos_carrito_nuevo(self.usuario))
+        # Los pedidos ya realizados no cuentan
+        Pedido.objects.create(cliente=self.usuario, estado='PENDIENTE', **datos_carrito_nuevo(self.usuario))
+
+    def test_una_linea_por_carta(self):
+        from django.db import IntegrityError, transaction
+        expansion = Expansion.objects.create(
+            codigo='UNI', nombre='Única', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        carta = Carta.objects.create(
+            codigo='UNI-001', nombre='Sola', numero_en_expansion=1, descripcion='', expansion=expansion, rareza='COMUN'
+        )
+        inventario = Inventario.objects.create(carta=carta, cantidad_disponible=5, precio=Decimal('1.00'))
+        carrito = Pedido.objects.create(cliente=self.usuario, estado='CARRITO', **datos_carrito_nuevo(self.usuario))
+        linea = dict(pedido=carrito, carta=carta, inventario=inventario, cantidad=1, precio_unitario=Decimal('1.00'))
+        ItemPedido.objects.create(**linea)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ItemPedido.objects.create(**linea)
+
+
+class FusionCarritoSesionTests(TestCase):
+    """El carrito anónimo se suma al del usuario al iniciar sesión"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('fusion', password='clave-de-prueba')
+        expansion = Expansion.objects.create(
+            codigo='FUS', nombre='Fusión', fecha_lanzamiento=date(2024, 1, 1), total_cartas=2
+        )
+        cls.cartas = [
+            Carta.objects.create(
+                codigo=f'FUS-00{numero}', nombre=f'Fusión {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, rareza='COMUN',
+            )
+            for numero in (1, 2)
+        ]
+        for carta in cls.cartas:
+            Inventario.objects.create(carta=carta, cantidad_disponible=4, precio=Decimal('1.00'))
+
+    def agregar_anonimo(self, carta, cantidad):
+        respuesta = self.client.post(
+            reverse('agregar_al_carrito', args=[carta.pk]), {'cantidad': cantidad},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertTrue(respuesta.json()['success'])
+
+    def test_suma_cantidades_al_iniciar_sesion(self):
+        from .carrito import agregar_carta, obtener_o_crear_carrito
+        carrito = obtener_o_crear_carrito(self.usuario)
+        agregar_carta(carrito, self.cartas[0].pk, 1)
+
+        self.agregar_anonimo(self.cartas[0], 2)
+        self.agregar_anonimo(self.cartas[1], 1)
+        self.client.post(reverse('login'), {'username': 'fusion', 'password': 'clave-de-prueba'})
+
+        cantidades = dict(ItemPedido.objects.filter(pedido=carrito).values_list('carta_id', 'cantidad'))
+        self.assertEqual(cantidades, {self.cartas[0].pk: 3, self.cartas[1].pk: 1})
+        carrito.refresh_from_db()
+        self.assertEqual(carrito.subtotal, Decimal('4.00'))
+        from .carrito import CLAVE_SESION_ANONIMA
+        self.assertNotIn(CLAVE_SESION_ANONIMA, self.client.session)
+
+    def test_fusion_limitada_al_stock(self):
+        from .carrito import agregar_carta, obtener_o_crear_carrito
+        carrito = obtener_o_crear_carrito(self.usuario)
+        agregar_carta(carrito, self.cartas[0].pk, 3)
+
+        self.agregar_anonimo(self.cartas[0], 3)
+        self.client.post(reverse('login'), {'username': 'fusion', 'password': 'clave-de-prueba'})
+        self.assertEqual(ItemPedido.objects.get(pedido=carrito).cantidad, 4)
+
+
+class HistorialPedidosCursorTests(TestCase):
+    """Paginación por cursor (fecha_pedido, id) de mis_pedidos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('historial')
+        misma_fecha = timezone.now() - timedelta(days=1)
+        cls.pedidos = []
+        for numero in range(7):
+            pedido = Pedido.objects.create(
+                cliente=cls.usuario, estado='ENTREGADO', **datos_carrito_nuevo(cls.usuario)
+            )
+            # Cinco pedidos empatados en la fecha y dos más antiguos
+            fecha = misma_fecha if numero >= 2 else misma_fecha - timedelta(days=numero + 1)
+            Pedido.objects.filter(pk=pedido.pk).update(fecha_pedido=fecha)
+            cls.pedidos.append(pedido.pk)
+        cls.orden_esperado = list(
+            Pedido.objects.filter(pk__in=cls.pedidos).order_by('-fecha_pedido', '-id').values_list('pk', flat=True)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def recorrer(self):
+        vistos, paginas, cursor = [], [], None
+        while True:
+            respuesta = self.client.get(reverse('mis_pedidos'), {'cursor': cursor} if cursor else {})
+            pagina = [pedido.pk for pedido in respuesta.context['pedidos']]
+            paginas.append(pagina)
+            vistos += pagina
+            cursor = respuesta.context['siguiente']
+            if cursor is None:
+                return vistos, paginas
+            self.assertEqual(cursor, pagina[-1])
+
+    def test_paginas_estables_con_fechas_iguales(self):
+        with mock.patch('core.views.carrito_views.PEDIDOS_POR_PAGINA', 3):
+            vistos, paginas = self.recorrer()
+        self.assertEqual(vistos, self.orden_esperado)
+        self.assertEqual([len(pagina) for pagina in paginas], [3, 3, 1])
+
+    def test_ultima_pagina_completa_sin_cursor(self):
+        # Con un total múltiplo del tamaño de página no queda una página vacía al final
+        Pedido.objects.filter(pk=self.orden_esperado[-1]).delete()
+        with mock.patch('core.views.carrito_views.PEDIDOS_POR_PAGINA', 3):
+            vistos, paginas = self.recorrer()
+        self.assertEqual(vistos, self.orden_esperado[:-1])
+        self.assertEqual([len(pagina) for pagina in paginas], [3, 3])
+
+
+class RouterReplicaTests(SimpleTestCase):
+    """Lecturas del catálogo en la réplica salvo tras una escritura"""
+
+    def setUp(self):
+        from .routers import RouterReplica
+        self.router = RouterReplica()
+        self.factory = RequestFactory()
+
+    def peticion(self, request, *escrituras, **hints):
+        """Pasa la petición por el middleware; devuelve (alias de lectura de Carta, respuesta)"""
+        from django.http import HttpResponse
+        from .routers import FijarPrimariaMiddleware
+        lecturas = []
+
+        def vista(request):
+            lecturas.append(self.router.db_for_read(Carta))
+            for modelo in escrituras:
+                self.router.db_for_write(modelo, **hints)
+            lecturas.append(self.router.db_for_read(Carta))
+            return HttpResponse()
+
+        respuesta = FijarPrimariaMiddleware(vista)(request)
+        return lecturas, respuesta
+
+    def test_lectura_en_la_replica(self):
+        from .routers import COOKIE_PRIMARIA
+        lecturas, respuesta = self.peticion(self.factory.get('/'))
+        self.assertEqual(lecturas, ['replica', 'replica'])
+        self.assertNotIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+    def test_escritura_en_un_get_fija_la_primaria(self):
+        from .routers import COOKIE_PRIMARIA
+        lecturas, respuesta = self.peticion(self.factory.get('/'), Carta)
+        self.assertEqual(lecturas, ['replica', 'default'])
+        self.assertIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+    def test_escritura_con_hint_no_fija(self):
+        from .routers import COOKIE_PRIMARIA
+        lecturas, respuesta = self.peticion(self.factory.get('/'), Carta, fijar_primaria=False)
+        self.assertEqual(lecturas, ['replica', 'replica'])
+        self.assertNotIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+    def test_escrituras_fuera_de_core_no_fijan(self):
+        from django.contrib.sessions.models import Session
+        lecturas, _ = self.peticion(self.factory.get('/'), Session)
+        self.assertEqual(lecturas, ['replica', 'replica'])
+
+    def test_post_y_cookie_leen_de_la_primaria(self):
+        from .routers import COOKIE_PRIMARIA
+        lecturas, respuesta = self.peticion(self.factory.post('/'))
+        self.assertEqual(lecturas, ['default', 'default'])
+        self.assertIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+        self.factory.cookies[COOKIE_PRIMARIA] = '1'
+        lecturas, respuesta = self.peticion(self.factory.get('/'))
+        self.assertEqual(lecturas, ['default', 'default'])
+        self.assertNotIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+    def test_escritura_en_un_hilo_de_vista_async(self):
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.http import HttpResponse
+        from .routers import COOKIE_PRIMARIA, FijarPrimariaMiddleware
+        lecturas = []
+
+        async def vista(request):
+            await sync_to_async(self.router.db_for_write, thread_sensitive=False)(Carta)
+            lecturas.append(self.router.db_for_read(Carta))
+            return HttpResponse()
+
+        respuesta = async_to_sync(FijarPrimariaMiddleware(vista))(self.factory.get('/'))
+        self.assertEqual(lecturas, ['default'])
+        self.assertIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+
+@override_settings(REPLICA_SEGUNDOS_PRIMARIA=5)
+class CacheConReplicaTests(TestCase):
+    """Sin páginas en cache ni ETags mientras la réplica puede ir atrasada"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='RPL', nombre='Réplica', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='RPL-001', nombre='Retrasada', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN', imagen_frontal='cartas/rpl.png',
+        )
+        Inventario.objects.create(carta=cls.carta, cantidad_disponible=1, precio=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_espera_al_retraso_de_la_replica(self):
+        import time
+        from .cache_paginas import invalidar_etiquetas
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+        invalidar_etiquetas(f'carta:{self.carta.pk}')
+        respuesta = self.client.get(url)
+        self.assertFalse(respuesta.has_header('X-Cache'))
+        self.assertFalse(respuesta.has_header('ETag'))
+
+        dentro_de_un_rato = time.time() + 6
+        with mock.patch('core.cache_paginas.time.time', return_value=dentro_de_un_rato):
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta['X-Cache'], 'HIT')
+        self.assertTrue(respuesta.has_header('ETag'))
+
+
+class RouterSoloPrimaria:
+    """RouterReplica que lee siempre de default (en las pruebas no hay réplica)"""
+
+    def __init__(self):
+        from .routers import RouterReplica
+        self.router = RouterReplica()
+
+    def db_for_read(self, model, **hints):
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return self.router.db_for_write(model, **hints)
+
+
+@override_settings(
+    DATABASE_ROUTERS=[RouterSoloPrimaria()],
+    MIDDLEWARE=[*settings.MIDDLEWARE, 'core.routers.FijarPrimariaMiddleware'],
+)
+class FijarPrimariaVistasTests(TestCase):
+    """Las visitas al catálogo no fijan la primaria aunque cuenten la popularidad"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='FPR', nombre='Fijada', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='FPR-001', nombre='Visitada', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN', imagen_frontal='cartas/fpr.png',
+        )
+        Inventario.objects.create(carta=cls.carta, cantidad_disponible=1, precio=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detalle_no_fija_la_primaria(self):
+        from .routers import COOKIE_PRIMARIA
+        respuesta = self.client.get(reverse('detalle_carta', args=[self.carta.pk]))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn(COOKIE_PRIMARIA, respuesta.cookies)
+        self.assertEqual(Carta.objects.get(pk=self.carta.pk).popularidad, 1)
+
+
+class VisitasCartaTests(TestCase):
+    """Cada visita al detalle suma popularidad, salga o no de la cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expansion = Expansion.objects.create(
+            codigo='VIS', nombre='Visitas', fecha_lanzamiento=date(2024, 1, 1), total_cartas=1
+        )
+        cls.carta = Carta.objects.create(
+            codigo='VIS-001', nombre='Visitada', numero_en_expansion=1, descripcion='', expansion=expansion,
+            rareza='COMUN', imagen_frontal='cartas/vis.png',
+        )
+        Inventario.objects.create(carta=cls.carta, cantidad_disponible=1, precio=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+
+    def popularidad(self):
+        return Carta.objects.get(pk=self.carta.pk).popularidad
+
+    def test_cuentan_hit_y_304(self):
+        url = reverse('detalle_carta', args=[self.carta.pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+        self.assertEqual(self.popularidad(), 3)
+        # Sin cambios en la cache: la carta sigue sirviéndose desde ella
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    def test_no_cuenta_cartas_inexistentes(self):
+        self.assertEqual(self.client.get(reverse('detalle_carta', args=[self.carta.pk + 1000])).status_code, 404)
+        self.assertEqual(self.popularidad(), 0)
+
+    def test_vista_async(self):
+        from asgiref.sync import async_to_sync
+        from django.http import HttpResponse
+        from .visitas import contar_visita
+
+        @contar_visita
+        async def vista(request, carta_id, estado=200):
+            return HttpResponse(status=estado)
+
+        request = RequestFactory().get('/')
+        async_to_sync(vista)(request, self.carta.pk)
+        async_to_sync(vista)(request, self.carta.pk, estado=304)
+        async_to_sync(vista)(request, self.carta.pk, estado=404)
+        self.assertEqual(self.popularidad(), 2)
+
+
+def _urls_catalogo_async():
+    """core.urls con las vistas de catalogo_async_views (como con VISTAS_ASYNC=True)"""
+    from django.urls import path
+    from . import urls
+    from .views import catalogo_async_views
+    asincronas = {
+        'home': catalogo_async_views.home_view,
+        'lista_cartas': catalogo_async_views.lista_cartas,
+        'detalle_carta': catalogo_async_views.detalle_carta,
+        'autocompletar_cartas': catalogo_async_views.autocompletar_cartas,
+    }
+    return [
+        path(str(patron.pattern), asincronas.get(patron.name, patron.callback), name=patron.name)
+        for patron in urls.urlpatterns
+    ]
+
+
+class UrlsCatalogoAsync:
+    urlpatterns = _urls_catalogo_async()
+
+
+@override_settings(ROOT_URLCONF=UrlsCatalogoAsync)
+class CatalogoAsyncTests(TransactionTestCase):
+    """Vistas async del catálogo (despliegue ASGI) con sus consultas en paralelo"""
+
+    def setUp(self):
+        # en_paralelo abre una conexión por hilo: necesitan ver los datos confirmados
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite en memoria no se comparte entre hilos; usar SQLITE_TEST_NAME=/tmp/test.sqlite3')
+        cache.clear()
+        categoria = Categoria.objects.create(nombre='Asíncrona')
+        expansion = Expansion.objects.create(
+            codigo='ASY', nombre='Async', fecha_lanzamiento=date(2024, 1, 1), total_cartas=3
+        )
+        self.cartas = []
+        for numero in range(3):
+            carta = Carta.objects.create(
+                codigo=f'ASY-{numero:03}', nombre=f'Paralela {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, categoria=categoria, rareza='COMUN', imagen_frontal=f'cartas/asy{numero}.png',
+            )
+            Inventario.objects.create(carta=carta, cantidad_disponible=numero, precio=Decimal('1.00'))
+            self.cartas.append(carta)
+
+    async def test_portada(self):
+        respuesta = await self.async_client.get(reverse('home'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['total_cartas'], 3)
+        self.assertEqual(respuesta.context['total_expansiones'], 1)
+        self.assertEqual(len(respuesta.context['cartas_destacadas']), 3)
+
+    async def test_listado_con_filtros(self):
+        respuesta = await self.async_client.get(reverse('lista_cartas'), {'en_stock': '1'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(
+            sorted(carta.codigo for carta in respuesta.context['cartas']), ['ASY-001', 'ASY-002']
+        )
+        self.assertEqual([categoria.nombre for categoria in respuesta.context['categorias']], ['Asíncrona'])
+
+    async def test_listado_sin_detalles_del_error(self):
+        with mock.patch('core.views.catalogo_async_views.consulta_lista_cartas', side_effect=ValueError('SQL secreto')):
+            with self.assertLogs('core.views.catalogo_async_views', 'ERROR'):
+                respuesta = await self.async_client.get(reverse('lista_cartas'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotContains(respuesta, 'SQL secreto')
+        self.assertEqual(respuesta.context['error'], 'No se pudieron aplicar los filtros')
+
+    async def test_detalle(self):
+        carta = self.cartas[0]
+        respuesta = await self.async_client.get(reverse('detalle_carta', args=[carta.pk]))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['carta'], carta)
+        self.assertEqual(len(respuesta.context['cartas_relacionadas']), 2)
+        self.assertEqual((await Carta.objects.aget(pk=carta.pk)).popularidad, 1)
+        respuesta = await self.async_client.get(reverse('detalle_carta', args=[carta.pk + 1000]))
+        self.assertEqual(respuesta.status_code, 404)
+
+    async def test_autocompletar(self):
+        respuesta = await self.async_client.get(reverse('autocompletar_cartas'), {'q': 'parale'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()['resultados']), 3)
+        respuesta = await self.async_client.get(reverse('autocompletar_cartas'), {'q': 'p'})
+        self.assertEqual(respuesta.json(), {'resultados': []})
+
+    async def test_en_paralelo_en_orden_y_en_otros_hilos(self):
+        import threading
+        from .views.catalogo_async_views import en_paralelo
+        hilos = set()
+
+        def contar(**filtro):
+            hilos.add(threading.get_ident())
+            return Carta.objects.filter(**filtro).count()
+
+        resultados = await en_paralelo(
+            lambda: contar(stock_real__gt=0), lambda: contar(), lambda: contar(stock_real=0),
+        )
+        self.assertEqual(resultados, [2, 3, 1])
+        self.assertNotIn(threading.get_ident(), hilos)
+
+
+@unittest.skipUnless(
+    connection.settings_dict['ENGINE'] == 'core.backends.sqlite3', 'Solo con el backend SQLite ajustado'
+)
+class BackendSqliteTests(TransactionTestCase):
+    """PRAGMA de cada conexión y transacciones con BEGIN IMMEDIATE"""
+
+    def pragmas(self, *nombres, **options):
+        """PRAGMA de una conexión nueva (get_new_connection) con ``options`` añadidas"""
+        conexion = connection.copy()
+        conexion.settings_dict['OPTIONS'] = {**connection.settings_dict['OPTIONS'], **options}
+        try:
+            with conexion.cursor() as cursor:
+                return [cursor.execute(f'PRAGMA {nombre}').fetchone()[0] for nombre in nombres]
+        finally:
+            conexion.close()
+
+    def test_pragmas_al_conectar(self):
+        timeout = connection.settings_dict['OPTIONS'].get('timeout', 5)
+        # synchronous NORMAL = 1, temp_store MEMORY = 2
+        self.assertEqual(
+            self.pragmas('synchronous', 'temp_store', 'cache_size', 'foreign_keys', 'busy_timeout'),
+            [1, 2, -64000, 1, int(timeout * 1000)],
+        )
+        # WAL no existe en una base en memoria (la de pruebas por defecto)
+        self.assertEqual(self.pragmas('journal_mode'), ['memory' if connection.is_in_memory_db() else 'wal'])
+
+    def test_pragmas_de_options(self):
+        self.assertEqual(self.pragmas('cache_size', pragmas={'cache_size': -2000}), [-2000])
+
+    def test_atomic_empieza_con_begin_immediate(self):
+        with CaptureQueriesContext(connection) as consultas:
+            with transaction.atomic():
+                Categoria.objects.create(nombre='Inmediata')
+        self.assertEqual(consultas[0]['sql'], 'BEGIN IMMEDIATE')
+
+        with mock.patch.dict(connection.settings_dict['OPTIONS'], {'begin_immediate': False}):
+            with CaptureQueriesContext(connection) as consultas:
+                with transaction.atomic():
+                    Categoria.objects.create(nombre='Diferida')
+        self.assertEqual(consultas[0]['sql'], 'BEGIN')
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+class LimpiarSesionesTests(TestCase):
+    """Borrado por bloques de las sesiones caducadas"""
+
+    def setUp(self):
+        from django.contrib.sessions.models import Session
+        ahora = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f'caducada{numero}', session_data='', expire_date=ahora - timedelta(days=1))
+             for numero in range(5)]
+            + [Session(session_key=f'viva{numero}', session_data='', expire_date=ahora + timedelta(days=1))
+               for numero in range(2)]
+        )
+
+    def limpiar(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        salida = StringIO()
+        call_command('limpiar_sesiones', *args, stdout=salida)
+        return salida.getvalue()
+
+    def claves(self):
+        from django.contrib.sessions.models import Session
+        return set(Session.objects.values_list('session_key', flat=True))
+
+    def test_borra_por_bloques_y_conserva_las_vivas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            salida = self.limpiar('--bloque', '2', '--pausa', '0')
+        borrados = [consulta['sql'] for consulta in consultas if consulta['sql'].startswith('DELETE')]
+        self.assertEqual(len(borrados), 3)
+        self.assertIn('  2 sesiones borradas\n  4 sesiones borradas\n  5 sesiones borradas', salida)
+        self.assertEqual(self.claves(), {'viva0', 'viva1'})
+
+    def test_dry_run(self):
+        self.assertIn('Sesiones caducadas: 5', self.limpiar('--dry-run'))
+        self.assertEqual(len(self.claves()), 7)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_motor_sin_tabla(self):
+        self.assertIn('no hay nada que limpiar', self.limpiar())
+        self.assertEqual(len(self.claves()), 7)
+
+
+class ListadoAdminTests(TestCase):
+    """Listado genérico del panel: columnas, orden, filtros y total en cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('panel', is_staff=True)
+        cls.expansiones = [
+            Expansion.objects.create(
+                codigo=f'LS{numero}', nombre=f'Listado {numero}', fecha_lanzamiento=date(2024, 1, 1), total_cartas=9
+            )
+            for numero in (1, 2)
+        ]
+        cls.creadas = 0
+        cls.crear_cartas(2)
+
+    @classmethod
+    def crear_cartas(cls, cantidad):
+        for numero in range(cls.creadas, cls.creadas + cantidad):
+            Carta.objects.create(
+                codigo=f'LS-{numero:03}', nombre=f'Listada {numero}', numero_en_expansion=numero + 1,
+                descripcion='Texto largo que el listado no necesita', expansion=cls.expansiones[numero % 2],
+                rareza='COMUN', stock_real=numero,
+            )
+        cls.creadas += cantidad
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def listar(self, **parametros):
+        respuesta = self.client.get(reverse('lista_admin', args=['carta']), parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return [carta.codigo for carta in respuesta.context['page_obj']]
+
+    def test_solo_las_columnas_del_listado(self):
+        from .listado_admin import LISTADOS
+        sql = str(LISTADOS['carta'].consulta().query)
+        self.assertIn('"core_expansion"."nombre"', sql)
+        self.assertNotIn('"core_carta"."descripcion"', sql)
+        self.assertNotIn('"core_expansion"."descripcion"', sql)
+
+    def test_orden(self):
+        from .listado_admin import LISTADOS
+        listado = LISTADOS['carta']
+        self.assertEqual(listado.orden('-nombre'), ['-nombre', '-pk'])
+        self.assertEqual(listado.orden('stock_real'), ['stock_real', 'pk'])
+        # Campos que no son columnas (o inyecciones) vuelven al orden por defecto
+        for pedido in ('descripcion', 'expansion__nombre', 'nombre; DROP TABLE core_carta'):
+            with self.subTest(orden=pedido):
+                self.assertEqual(listado.orden(pedido)[:-1], listado.orden_defecto)
+        self.assertEqual(self.listar(orden='-codigo'), ['LS-001', 'LS-000'])
+        self.assertEqual(self.listar(orden='-descripcion'), self.listar())
+
+    def test_filtros_con_tipo(self):
+        self.assertEqual(self.listar(stock_real='1'), ['LS-001'])
+        self.assertEqual(self.listar(expansion=str(self.expansiones[0].pk)), ['LS-000'])
+        self.assertEqual(sorted(self.listar(nombre='listada')), ['LS-000', 'LS-001'])
+        # Un valor que no encaja con el tipo de la columna no da error: no hay resultados
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertEqual(self.listar(stock_real='mucho'), [])
+        # none(): la vista no llega a consultar la tabla de cartas
+        self.assertFalse([c for c in capturadas if 'core_carta' in c['sql']])
+        self.assertEqual(self.listar(expansion='primera'), [])
+
+    def test_total_en_cache(self):
+        from .paginacion import PaginadorConteoCache
+        from .listado_admin import LISTADOS
+        consulta = LISTADOS['carta'].consulta()
+        self.assertEqual(PaginadorConteoCache(consulta, 25).count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(PaginadorConteoCache(consulta, 25).count, 2)
+        # Otra consulta (otro filtro) tiene su propio total
+        self.assertEqual(PaginadorConteoCache(consulta.filter(stock_real=0), 25).count, 1)
+
+    def test_consultas_fijas_por_pagina(self):
+        def consultas():
+            cache.clear()
+            with CaptureQueriesContext(connection) as capturadas:
+                self.listar()
+            return len(capturadas)
+
+        pocas = consultas()
+        self.crear_cartas(10)
+        self.assertEqual(consultas(), pocas)
+
+
+class ValoracionColeccionesTests(TestCase):
+    """La valoración vectorizada da los mismos precios que Carta.precio_estimado"""
+
+    def test_todas_las_combinaciones(self):
+        from itertools import product
+        from .valoracion import precios_unitarios
+        combinaciones = list(product(
+            [codigo for codigo, _ in Carta.RAREZAS] + ['DESCONOCIDA'],
+            [codigo for codigo, _ in Carta.CONDICIONES],
+            (False, True), (False, True),
+        ))
+        precios = precios_unitarios(*zip(*combinaciones))
+        for combinacion, precio in zip(combinaciones, precios):
+            rareza, condicion, es_holo, primera = combinacion
+            carta = Carta(rareza=rareza, condicion=condicion, es_holo=es_holo, primera_edicion=primera)
+            with self.subTest(combinacion=combinacion):
+                self.assertEqual(precio, carta.precio_estimado)
+
+    def test_valor_de_la_coleccion(self):
+        from .valoracion import valorar_colecciones
+        usuario = User.objects.create_user('coleccionista')
+        categoria = Categoria.objects.create(nombre='Valoración')
+        expansion = Expansion.objects.create(
+            codigo='VAL', nombre='Valoración', fecha_lanzamiento=date(2024, 1, 1), total_cartas=2
+        )
+        coleccion = Coleccion.objects.create(usuario=usuario, nombre='Carpeta')
+        # Los dos casos en los que el orden de los productos cambiaba el redondeo
+        for numero, (rareza, primera, cantidad) in enumerate([('COMUN', True, 3), ('RARA_LUM', False, 2)]):
+            carta = Carta.objects.create(
+                codigo=f'VAL-{numero:03}', nombre=f'Valorada {numero}', numero_en_expansion=numero, descripcion='',
+                expansion=expansion, categoria=categoria, rareza=rareza, condicion='LP', es_holo=True,
+                primera_edicion=primera, imagen_frontal=f'cartas/frontal/val{numero}.png',
+            )
+            ColeccionCarta.objects.create(coleccion=coleccion, carta=carta, cantidad=cantidad)
+        self.assertEqual(valorar_colecciones([coleccion.pk])[coleccion.pk], {
+            'total_cartas': 5,
+            'valor_estimado': Decimal('31.03'),
+            'por_expansion': {'VAL': Decimal('31.03')},
+        })
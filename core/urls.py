@@ -1,13 +1,18 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views_django
 from django.contrib.auth.decorators import login_required
-from .views import auth_views, carta_views, carrito_views, pago_views, admin_views, normal_views
+from .views import auth_views, carta_views, carrito_views, pago_views, admin_views, normal_views, api_views
+from .views import catalogo_async_views
+
+# Vistas de lectura del catálogo: async con el despliegue ASGI (VISTAS_ASYNC)
+catalogo_views = catalogo_async_views if settings.VISTAS_ASYNC else carta_views
 
 urlpatterns = [
     # ==============================================
     # PÁGINAS PRINCIPALES
     # ==============================================
-    path('', carta_views.home_view, name='home'), 
+    path('', catalogo_views.home_view, name='home'), 
     
     # ==============================================
     # AUTENTICACIÓN
@@ -19,10 +24,11 @@ urlpatterns = [
     # ==============================================
     # CARTAS POKÉMON
     # ==============================================
-    path('cartas/', carta_views.lista_cartas, name='lista_cartas'),
-    path('cartas/<int:carta_id>/', carta_views.detalle_carta, name='detalle_carta'),
+    path('cartas/', catalogo_views.lista_cartas, name='lista_cartas'),
+    path('cartas/<int:carta_id>/', catalogo_views.detalle_carta, name='detalle_carta'),
     path('cartas/filtrar/', carta_views.filtrar_cartas, name='filtrar_cartas'),
     path('cartas/buscar/', carta_views.buscar_cartas, name='buscar_cartas'),
+    path('cartas/autocompletar/', catalogo_views.autocompletar_cartas, name='autocompletar_cartas'),
     
     # Wishlist
     path('wishlist/', carta_views.wishlist_view, name='wishlist'),
@@ -51,11 +57,19 @@ urlpatterns = [
     path('pago/paypal/', pago_views.pago_paypal, name='pago_paypal'),
     path('pago/transferencia/', pago_views.pago_transferencia, name='pago_transferencia'),
     path('pago/procesar/<str:metodo>/', pago_views.procesar_pago, name='procesar_pago'),
+    path('pago/webhook/', pago_views.webhook_pasarela, name='webhook_pasarela'),
+    
+    # ==============================================
+    # API JSON DEL CATÁLOGO (solo lectura)
+    # ==============================================
+    path('api/v1/<str:recurso>/', api_views.api_listado, name='api_listado'),
+    path('api/v1/<str:recurso>/<int:obj_id>/', api_views.api_detalle, name='api_detalle'),
     
     # ==============================================
     # PANEL DE ADMINISTRACIÓN
     # ==============================================
     path('admin-dashboard/', admin_views.dashboard_view, name='admin_dashboard'),
+    path('admin-dashboard/cache/', admin_views.estadisticas_cache, name='estadisticas_cache'),
     path('dashboard/<str:model_name>/', admin_views.lista_admin, name='lista_admin'),
     path('dashboard/<str:model_name>/crear/', admin_views.crear_admin, name='crear_admin'),
     path('dashboard/<str:model_name>/<int:obj_id>/', admin_views.detalle_admin, name='detalle_admin'),
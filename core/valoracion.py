@@ -0,0 +1,105 @@
+# core/valoracion.py
+"""
+Valoración vectorizada de colecciones.
+
+Trae todas las cartas de las colecciones pedidas con un único ``values_list``
+y calcula con NumPy el precio estimado de cada fila (mismas tablas que
+``Carta.precio_estimado``), el total de cartas, el valor de cada colección y
+el desglose por expansión, todo en una sola pasada.
+"""
+from decimal import Decimal
+
+import numpy as np
+
+from .models import Carta, ColeccionCarta
+
+# Tablas de búsqueda: la última posición es el valor para códigos desconocidos
+_CODIGOS_RAREZA = [codigo for codigo, _ in Carta.RAREZAS]
+_CODIGOS_CONDICION = [codigo for codigo, _ in Carta.CONDICIONES]
+_TABLA_RAREZA = np.array([Carta.PRECIOS_BASE.get(codigo, 1.0) for codigo in _CODIGOS_RAREZA] + [1.0])
+_TABLA_CONDICION = np.array(
+    [Carta.MULTIPLICADORES_CONDICION.get(codigo, 1.0) for codigo in _CODIGOS_CONDICION] + [1.0]
+)
+
+
+def _indices(valores, codigos):
+    """Posición de cada valor en ``codigos`` (len(codigos) si no está)"""
+    unicos, inverso = np.unique(np.asarray(valores, dtype=object).astype(str), return_inverse=True)
+    posiciones = {codigo: i for i, codigo in enumerate(codigos)}
+    mapa = np.array([posiciones.get(codigo, len(codigos)) for codigo in unicos], dtype=np.int64)
+    return mapa[inverso]
+
+
+def _euros(valor):
+    return Decimal(str(round(float(valor), 2))).quantize(Decimal('0.01'))
+
+
+def precios_unitarios(rareza, condicion, es_holo, primera):
+    """
+    Precio estimado de cada fila, con las mismas operaciones que
+    ``Carta.precio_estimado``: primero el multiplicador y luego la base, y
+    ``round`` de Python sobre los pocos valores distintos
+    """
+    multiplicador = _TABLA_CONDICION[_indices(condicion, _CODIGOS_CONDICION)]
+    multiplicador = np.where(np.array(es_holo, dtype=bool), multiplicador * Carta.MULTIPLICADOR_HOLO, multiplicador)
+    multiplicador = np.where(
+        np.array(primera, dtype=bool), multiplicador * Carta.MULTIPLICADOR_PRIMERA_EDICION, multiplicador
+    )
+    unitario = _TABLA_RAREZA[_indices(rareza, _CODIGOS_RAREZA)] * multiplicador
+    unicos, inverso = np.unique(unitario, return_inverse=True)
+    return np.array([round(float(valor), 2) for valor in unicos])[inverso]
+
+
+def _vacia():
+    return {'total_cartas': 0, 'valor_estimado': Decimal('0.00'), 'por_expansion': {}}
+
+
+def valorar_colecciones(colecciones=None):
+    """
+    Valora varias colecciones a la vez. ``colecciones`` puede ser None (todas),
+    un QuerySet de Coleccion o una lista de ids. Devuelve un diccionario
+    {coleccion_id: {'total_cartas', 'valor_estimado', 'por_expansion'}}.
+    """
+    items = ColeccionCarta.objects.order_by()
+    ids = None
+    if colecciones is not None:
+        ids = [getattr(c, 'pk', c) for c in colecciones]
+        items = items.filter(coleccion_id__in=ids)
+
+    filas = list(items.values_list(
+        'coleccion_id', 'cantidad', 'carta__rareza', 'carta__condicion',
+        'carta__es_holo', 'carta__primera_edicion', 'carta__expansion__codigo',
+    ))
+
+    resultado = {pk: _vacia() for pk in ids} if ids is not None else {}
+    if not filas:
+        return resultado
+
+    coleccion_id, cantidad, rareza, condicion, es_holo, primera, expansion = zip(*filas)
+    cantidad = np.array(cantidad, dtype=np.int64)
+
+    valor = precios_unitarios(rareza, condicion, es_holo, primera) * cantidad
+
+    # Agregados por colección
+    colecciones_unicas, idx_coleccion = np.unique(np.array(coleccion_id, dtype=np.int64), return_inverse=True)
+    totales_cartas = np.bincount(idx_coleccion, weights=cantidad)
+    totales_valor = np.bincount(idx_coleccion, weights=valor)
+
+    # Agregados por (colección, expansión)
+    expansiones_unicas, idx_expansion = np.unique(np.array(expansion, dtype=object).astype(str), return_inverse=True)
+    clave = idx_coleccion * len(expansiones_unicas) + idx_expansion
+    claves_unicas, idx_clave = np.unique(clave, return_inverse=True)
+    valor_por_clave = np.bincount(idx_clave, weights=valor)
+
+    for i, pk in enumerate(colecciones_unicas):
+        resultado[int(pk)] = {
+            'total_cartas': int(totales_cartas[i]),
+            'valor_estimado': _euros(totales_valor[i]),
+            'por_expansion': {},
+        }
+    for clave_unica, valor_clave in zip(claves_unicas, valor_por_clave):
+        pk = int(colecciones_unicas[clave_unica // len(expansiones_unicas)])
+        codigo = str(expansiones_unicas[clave_unica % len(expansiones_unicas)])
+        resultado[pk]['por_expansion'][codigo] = _euros(valor_clave)
+
+    return resultado
@@ -9,4 +9,5 @@ from .carta_views import *
 from .carrito_views import *
 from .pago_views import *
 from .admin_views import *
+from .api_views import *
 from .normal_views import *
\ No newline at end of file
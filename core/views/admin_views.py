@@ -1,7 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.core.paginator import Paginator
+from django.http import JsonResponse
 from django.db.models import Q, Sum, Count, Avg
 from django.utils import timezone
 from datetime import timedelta
@@ -9,6 +9,10 @@ from ..models import (
     Carta, Expansion, Categoria, Pedido, Inventario, 
     Resena, Coleccion, User
 )
+from ..cache_paginas import estadisticas as estadisticas_cache_paginas
+from ..listado_admin import LISTADOS
+from ..paginacion import PaginadorConteoCache
+from ..pedidos import transicionar, PAGADO, ENVIADO, ENTREGADO
 from django import forms
 from django.forms import ModelForm
 
@@ -26,7 +30,7 @@ def dashboard_view(request):
     
     # Estadísticas generales
     total_ventas = Pedido.objects.filter(
-        estado='ENTR',
+        estado=ENTREGADO,
     ).aggregate(total=Sum('total'))['total'] or 0
     
     pedidos_pendientes = Pedido.objects.filter(estado='PAGADO').count()
@@ -36,7 +40,7 @@ def dashboard_view(request):
     fecha_inicio = timezone.now() - timedelta(days=30)
     ventas_recientes = Pedido.objects.filter(
         fecha_pedido__gte=fecha_inicio,
-        estado='ENTR'
+        estado=ENTREGADO
     ).order_by('fecha_pedido')
     
     # Últimos pedidos
@@ -53,58 +57,59 @@ def dashboard_view(request):
     }
     return render(request, 'dashboard/index.html', context)
 
+@staff_required
+def estadisticas_cache(request):
+    """Aciertos y fallos de la cache de páginas anónimas"""
+    return JsonResponse(estadisticas_cache_paginas())
+
 @staff_required
 def lista_admin(request, model_name):
     """Vista genérica para listar objetos de cualquier modelo"""
     
-    # Mapeo de nombres de modelo a clases
-    model_map = {
-        'carta': Carta,
-        'expansion': Expansion,
-        'categoria': Categoria,
-        'pedido': Pedido,
-        'inventario': Inventario,
-        'resena': Resena,
-        'coleccion': Coleccion,
-        'usuario': User,
-    }
-    
-    if model_name not in model_map:
+    if model_name not in LISTADOS:
         messages.error(request, f'Modelo {model_name} no encontrado')
         return redirect('admin_dashboard')
     
-    model_class = model_map[model_name]
+    listado = LISTADOS[model_name]
     
-    # Filtrar por búsqueda
+    # Búsqueda, filtros por columna y orden, todo en la consulta
     query = request.GET.get('q', '')
-    objetos = model_class.objects.all()
-    
-    if query:
-        # Búsqueda genérica por campos comunes
-        if hasattr(model_class, 'nombre'):
-            objetos = objetos.filter(nombre__icontains=query)
-        elif hasattr(model_class, 'username'):
-            objetos = objetos.filter(username__icontains=query)
-        elif hasattr(model_class, 'codigo'):
-            objetos = objetos.filter(codigo__icontains=query)
-    
-    # Paginación
-    paginator = Paginator(objetos, 25)
+    filtros = listado.filtros(request.GET)
+    orden_pedido = request.GET.get('orden', '')
+    orden = listado.orden(orden_pedido)
+    objetos = listado.consulta(query, filtros, orden)
+    
+    # Paginación con el total en cache
+    paginator = PaginadorConteoCache(objetos, 25)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    # Obtener campos para mostrar en la tabla
-    campos = []
-    if objetos.exists():
-        obj = objetos.first()
-        campos = [field.name for field in obj._meta.fields[:5]]  # Primeros 5 campos
+    # Parámetros que conservan los enlaces de paginación y de ordenación
+    parametros = request.GET.copy()
+    parametros.pop('page', None)
+    sin_orden = parametros.copy()
+    sin_orden.pop('orden', None)
+    columnas = []
+    for nombre in listado.columnas:
+        inverso = f'-{nombre}'
+        sin_orden['orden'] = inverso if orden_pedido == nombre else nombre
+        columnas.append({
+            'nombre': nombre,
+            'titulo': listado.campos[nombre].verbose_name,
+            'filtro': filtros.get(nombre, ''),
+            'orden': 'asc' if orden_pedido == nombre else 'desc' if orden_pedido == inverso else '',
+            'url_orden': sin_orden.urlencode(),
+        })
     
     context = {
         'model_name': model_name,
-        'model_name_display': model_class._meta.verbose_name_plural,
+        'model_name_display': listado.titulo,
         'page_obj': page_obj,
-        'campos': campos,
+        'campos': listado.columnas,
+        'columnas': columnas,
         'query': query,
+        'orden': orden_pedido,
+        'parametros': parametros.urlencode(),
     }
     return render(request, 'admin/lista.html', context)
 
@@ -307,9 +312,7 @@ def confirmar_pedido(request, pedido_id):
     """Confirmar un pedido pendiente"""
     pedido = get_object_or_404(Pedido, numero_pedido=pedido_id)
     
-    if pedido.estado == 'PEND':
-        pedido.estado = 'PROC'
-        pedido.save()
+    if transicionar([pedido.pk], PAGADO):
         messages.success(request, f'Pedido #{pedido.numero_pedido} confirmado y en proceso')
     else:
         messages.warning(request, 'El pedido no está en estado pendiente')
@@ -321,11 +324,8 @@ def marcar_enviado(request, pedido_id):
     """Marcar un pedido como enviado"""
     pedido = get_object_or_404(Pedido, numero_pedido=pedido_id)
     
-    if pedido.estado == 'PROC':
-        pedido.estado = 'ENVI'
-        pedido.fecha_envio = timezone.now()
-        pedido.numero_seguimiento = request.POST.get('numero_seguimiento', '')
-        pedido.save()
+    numero_seguimiento = request.POST.get('numero_seguimiento', '')
+    if transicionar([pedido.pk], ENVIADO, numero_seguimiento=numero_seguimiento):
         messages.success(request, f'Pedido #{pedido.numero_pedido} marcado como enviado')
     else:
         messages.warning(request, 'El pedido no está en proceso')
@@ -337,11 +337,9 @@ def marcar_completado(request, pedido_id):
     """Marcar un pedido como completado"""
     pedido = get_object_or_404(Pedido, numero_pedido=pedido_id)
     
-    if pedido.estado == 'ENVI':
-        pedido.estado = 'ENTR'
-        pedido.save()
+    if transicionar([pedido.pk], ENTREGADO):
         messages.success(request, f'Pedido #{pedido.numero_pedido} marcado como entregado')
     else:
         messages.warning(request, 'El pedido no está enviado')
     
-    return redirect('detalle_admin', model_name='pedido', obj_id=pedido.id)
\ No newline at end of file
+    return redirect('detalle_admin', model_name='pedido', obj_id=pedido.id)
@@ -0,0 +1,108 @@
+# core/views/api_views.py
+"""
+API JSON de solo lectura del catálogo (v1).
+
+    GET /api/v1/<recurso>/                      listado paginado por cursor
+    GET /api/v1/<recurso>/?ids=1,2,3            lote por ids
+    GET /api/v1/<recurso>/?codigos=SVI-001,...  lote por códigos
+    GET /api/v1/<recurso>/<id>/                 un elemento
+
+Todos aceptan ``?fields=id,nombre,precio`` para pedir solo esos campos.
+"""
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET, condition
+
+from ..serializers import PROYECCIONES, ErrorCampos
+from ..etags import etag_api
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+
+def _error(mensaje, status=400):
+    return JsonResponse({'error': mensaje}, status=status)
+
+
+def _lista_parametro(valor):
+    return [parte.strip() for parte in valor.split(',') if parte.strip()]
+
+
+@require_GET
+@condition(etag_func=etag_api)
+def api_listado(request, recurso):
+    """Listado con paginación por cursor (id) o consulta por lotes"""
+    proyeccion = PROYECCIONES.get(recurso)
+    if proyeccion is None:
+        return _error(f'Recurso {recurso} no encontrado', status=404)
+
+    try:
+        campos = proyeccion.resolver_campos(request.GET.get('fields'))
+    except ErrorCampos as e:
+        return _error(str(e))
+
+    ids = request.GET.get('ids')
+    codigos = request.GET.get('codigos')
+
+    # Consulta por lotes
+    if ids or codigos:
+        if ids:
+            valores = _lista_parametro(ids)
+            if not all(valor.isdigit() for valor in valores):
+                return _error('ids debe ser una lista de enteros separados por comas')
+            filtro = {'id__in': valores}
+        else:
+            if proyeccion.campo_codigo is None:
+                return _error(f'{recurso} no admite búsqueda por códigos')
+            valores = _lista_parametro(codigos)
+            filtro = {f'{proyeccion.campo_codigo}__in': valores}
+
+        if len(valores) > LIMITE_MAXIMO:
+            return _error(f'Como máximo {LIMITE_MAXIMO} elementos por lote')
+
+        filas = proyeccion.consulta(campos, proyeccion.queryset.filter(**filtro).order_by('id'))
+        return JsonResponse({'resultados': proyeccion.serializar(filas, campos)})
+
+    # Listado paginado por cursor: ?cursor=<último id>&limit=<n>
+    cursor = request.GET.get('cursor', '')
+    limite = request.GET.get('limit', '')
+    if (cursor and not cursor.isdigit()) or (limite and not limite.isdigit()):
+        return _error('cursor y limit deben ser enteros')
+    limite = min(int(limite or LIMITE_POR_DEFECTO), LIMITE_MAXIMO) or LIMITE_POR_DEFECTO
+
+    queryset = proyeccion.queryset
+    if cursor:
+        queryset = queryset.filter(id__gt=int(cursor))
+
+    # Se pide una fila de más para saber si hay página siguiente
+    filas = list(proyeccion.consulta(campos, queryset.order_by('id'))[:limite + 1])
+    hay_mas = len(filas) > limite
+    resultados = proyeccion.serializar(filas[:limite], campos)
+
+    siguiente = None
+    if hay_mas:
+        parametros = request.GET.copy()
+        parametros['cursor'] = resultados[-1]['id']
+        parametros['limit'] = limite
+        siguiente = f'{request.path}?{parametros.urlencode()}'
+
+    return JsonResponse({'resultados': resultados, 'siguiente': siguiente})
+
+
+@require_GET
+@condition(etag_func=etag_api)
+def api_detalle(request, recurso, obj_id):
+    """Un único elemento del recurso"""
+    proyeccion = PROYECCIONES.get(recurso)
+    if proyeccion is None:
+        return _error(f'Recurso {recurso} no encontrado', status=404)
+
+    try:
+        campos = proyeccion.resolver_campos(request.GET.get('fields'))
+    except ErrorCampos as e:
+        return _error(str(e))
+
+    filas = proyeccion.consulta(campos, proyeccion.queryset.filter(id=obj_id))[:1]
+    resultados = proyeccion.serializar(filas, campos)
+    if not resultados:
+        return _error('No encontrado', status=404)
+    return JsonResponse(resultados[0])
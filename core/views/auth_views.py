@@ -3,7 +3,9 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.models import User
+from django.utils.http import url_has_allowed_host_and_scheme
 from ..forms import CustomUserCreationForm
+from ..carrito import fusionar_carrito_sesion
 
 def login_view(request):
     if request.user.is_authenticated:
@@ -16,11 +18,16 @@ def login_view(request):
         
         if user is not None:
             login(request, user)
+            # El carrito anónimo de la sesión pasa al carrito del usuario
+            fusionar_carrito_sesion(request)
             messages.success(request, f'¡Bienvenido de nuevo, {user.username}!')
             
             # Verificar si es admin
             if user.is_staff:
                 return redirect('admin_dashboard')
+            siguiente = request.POST.get('next') or request.GET.get('next')
+            if siguiente and url_has_allowed_host_and_scheme(siguiente, allowed_hosts={request.get_host()}):
+                return redirect(siguiente)
             return redirect('home')
         else:
             messages.error(request, 'Usuario o contraseña incorrectos')
@@ -43,6 +50,7 @@ def register_view(request):
             
             # Autenticar y loguear al usuario
             login(request, user)
+            fusionar_carrito_sesion(request)
             messages.success(request, f'¡Cuenta creada exitosamente! ¡Bienvenido, {user.username}!')
             return redirect('home')
     else:
@@ -3,180 +3,77 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
-from ..models import Carta, Pedido, ItemPedido, Inventario
+from django.db.models import Count, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from ..models import Carta, Pedido, ItemPedido, Inventario, StockInsuficiente
+from ..carrito import (
+    obtener_carrito, obtener_o_crear_carrito, agregar_carta, cantidad_items,
+    cargar_items, items_sin_stock, leer_cantidad,
+    CarritoSesion, contenido_sesion, agregar_carta_sesion, actualizar_carta_sesion, vaciar_carrito_sesion,
+)
+from ..pedidos import PENDIENTE, ENTREGADO, CANCELADO
+from .pago_views import realizar_pedido
 from decimal import Decimal
 from django.utils import timezone
 
-
-@login_required
-def ver_carrito(request):
-    """Vista del carrito de compras"""
-    try:
-        # Buscar carrito existente
-        carrito = Pedido.objects.filter(
-            cliente=request.user,
-            estado='CARRITO'
-        ).first()
-        
-        # Si no existe, crear uno nuevo CON TODOS LOS CAMPOS REQUERIDOS
-        if not carrito:
-            nombre_usuario = f"{request.user.first_name or ''} {request.user.last_name or ''}".strip()
-            if not nombre_usuario:
-                nombre_usuario = request.user.username
-            
-            carrito = Pedido.objects.create(
-                cliente=request.user,
-                estado='CARRITO',
-                nombre_completo=nombre_usuario,
-                email=request.user.email or '',
-                telefono='',
-                direccion='',
-                ciudad='No especificada',  # VALOR POR DEFECTO REQUERIDO
-                provincia='',
-                codigo_postal='',
-                pais='España',
-                subtotal=Decimal('0.00'),
-                envio=Decimal('0.00'),
-                impuestos=Decimal('0.00'),
-                total=Decimal('0.00')
-            )
-            messages.info(request, "Se ha creado un nuevo carrito para ti.")
-        
-        # Calcular totales
-        carrito.calcular_totales()
-        
-        context = {
-            'carrito': carrito,
-            'items': carrito.items.all().select_related('carta', 'inventario'),
-        }
-        
-        return render(request, 'carrito/ver.html', context)
-        
-    except Exception as e:
-        messages.error(request, f"Error al cargar el carrito: {str(e)}")
-        return redirect('lista_cartas')
+PEDIDOS_POR_PAGINA = 20
+# Cartas que se muestran de cada pedido en el historial
+ITEMS_VISTA_PREVIA = 2
 
 
-@login_required
 def agregar_al_carrito(request, carta_id):
-    """Agregar una carta al carrito"""
+    """Agregar una carta al carrito (con X-Requested-With responde JSON)"""
+    es_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     try:
-        carta = get_object_or_404(Carta, id=carta_id)
-        cantidad = int(request.POST.get('cantidad', 1))
-        
-        # Verificar stock
-        if not hasattr(carta, 'inventario') or carta.inventario is None:
-            messages.error(request, f'No hay inventario para {carta.nombre}')
-            return redirect('detalle_carta', carta_id=carta_id)
-        
-        if carta.inventario.stock_real < cantidad:
-            messages.error(request, f'Stock insuficiente para {carta.nombre}')
-            return redirect('detalle_carta', carta_id=carta_id)
-        
-        # Obtener o crear carrito CON TODOS LOS CAMPOS REQUERIDOS
-        carrito = Pedido.objects.filter(
-            cliente=request.user,
-            estado='CARRITO'
-        ).first()
-        
-        if not carrito:
-            nombre_usuario = f"{request.user.first_name or ''} {request.user.last_name or ''}".strip()
-            if not nombre_usuario:
-                nombre_usuario = request.user.username
-            
-            carrito = Pedido.objects.create(
-                cliente=request.user,
-                estado='CARRITO',
-                nombre_completo=nombre_usuario,
-                email=request.user.email or '',
-                telefono='',
-                direccion='',
-                ciudad='No especificada',  # VALOR POR DEFECTO REQUERIDO
-                provincia='',
-                codigo_postal='',
-                pais='España',
-                subtotal=Decimal('0.00'),
-                envio=Decimal('0.00'),
-                impuestos=Decimal('0.00'),
-                total=Decimal('0.00')
-            )
-        
-        # Verificar si ya existe el item
-        item_existente = carrito.items.filter(carta=carta).first()
-        
-        if item_existente:
-            # Actualizar cantidad
-            nueva_cantidad = item_existente.cantidad + cantidad
-            if nueva_cantidad <= carta.inventario.stock_real:
-                item_existente.cantidad = nueva_cantidad
-                item_existente.save()
-                messages.success(request, f'Cantidad actualizada para {carta.nombre}')
-            else:
-                messages.error(request, f'Stock insuficiente para agregar más unidades de {carta.nombre}')
+        cantidad = leer_cantidad(request.POST.get('cantidad'))
+        if request.user.is_authenticated:
+            carrito = obtener_carrito(request)
+            nombre = agregar_carta(carrito, carta_id, cantidad)
         else:
-            # Crear nuevo item
-            ItemPedido.objects.create(
-                pedido=carrito,
-                carta=carta,
-                inventario=carta.inventario,
-                cantidad=cantidad,
-                precio_unitario=carta.inventario.precio_actual
-            )
-            messages.success(request, f'{carta.nombre} añadida al carrito')
-        
-        # Recalcular totales
-        carrito.calcular_totales()
-        
-        return redirect('ver_carrito')
-        
-    except Exception as e:
-        messages.error(request, f"Error: {str(e)}")
+            nombre = agregar_carta_sesion(request, carta_id, cantidad)
+    except ValueError as e:
+        if es_ajax:
+            return JsonResponse({'success': False, 'message': str(e)}, status=409)
+        messages.error(request, str(e))
         return redirect('detalle_carta', carta_id=carta_id)
 
+    mensaje = f'{nombre} añadida al carrito'
+    if es_ajax:
+        if request.user.is_authenticated:
+            cantidad_carrito = cantidad_items(carrito)
+        else:
+            cantidad_carrito = sum(contenido_sesion(request).values())
+        return JsonResponse({
+            'success': True,
+            'message': mensaje,
+            'cart_count': cantidad_carrito,
+        })
+
+    messages.success(request, mensaje)
+    return redirect('ver_carrito')
+
 def crear_carrito_usuario(user):
-    """Crea un nuevo carrito para un usuario con todos los campos requeridos"""
-    nombre_usuario = f"{user.first_name or ''} {user.last_name or ''}".strip()
-    if not nombre_usuario:
-        nombre_usuario = user.username
-    
-    return Pedido.objects.create(
-        cliente=user,
-        estado='CARRITO',
-        nombre_completo=nombre_usuario,
-        email=user.email or '',
-        telefono='',
-        direccion='',
-        ciudad='No especificada',  # Campo requerido
-        provincia='',
-        codigo_postal='',
-        pais='España',
-        subtotal=Decimal('0.00'),
-        envio=Decimal('0.00'),
-        impuestos=Decimal('0.00'),
-        total=Decimal('0.00')
-    )
+    """Devuelve el carrito abierto del usuario, creándolo si no existe"""
+    return obtener_o_crear_carrito(user)
 
 
-@login_required
 def ver_carrito(request):
-    """Vista del carrito de compras - Versión simplificada"""
+    """Vista del carrito de compras"""
+    if not request.user.is_authenticated:
+        carrito = CarritoSesion(request)
+        return render(request, 'carrito/ver.html', {'carrito': carrito, 'items': carrito.lineas})
+
     try:
-        # Buscar carrito existente
-        carrito = Pedido.objects.filter(
-            cliente=request.user,
-            estado='CARRITO'
-        ).first()
-        
-        # Si no existe, crear uno nuevo usando la función auxiliar
-        if not carrito:
-            carrito = crear_carrito_usuario(request.user)
+        # Carrito abierto del usuario (se crea si no existe)
+        carrito = cargar_items(obtener_carrito(request))
         
         # Calcular totales
         carrito.calcular_totales()
         
         context = {
             'carrito': carrito,
-            'items': carrito.items.all().select_related('carta', 'inventario'),
+            'items': carrito.items.all(),
         }
         
         return render(request, 'carrito/ver.html', context)
@@ -185,14 +82,26 @@ def ver_carrito(request):
         messages.error(request, f"Error al cargar el carrito: {str(e)}")
         return redirect('lista_cartas')
 
-@login_required
 def actualizar_carrito(request, item_id):
-    """Actualizar cantidad de un item en el carrito"""
+    """Actualizar cantidad de un item en el carrito (en el carrito anónimo item_id es la carta)"""
+    if not request.user.is_authenticated:
+        if request.method == 'POST':
+            try:
+                actualizar_carta_sesion(request, item_id, leer_cantidad(request.POST.get('cantidad')))
+                messages.success(request, 'Cantidad actualizada')
+            except ValueError as e:
+                messages.error(request, str(e))
+        return redirect('ver_carrito')
+
     try:
         item = get_object_or_404(ItemPedido, id=item_id, pedido__cliente=request.user)
         
         if request.method == 'POST':
-            cantidad = int(request.POST.get('cantidad', 1))
+            try:
+                cantidad = leer_cantidad(request.POST.get('cantidad'))
+            except ValueError as e:
+                messages.error(request, str(e))
+                return redirect('ver_carrito')
             
             if cantidad <= 0:
                 item.delete()
@@ -211,9 +120,16 @@ def actualizar_carrito(request, item_id):
         return redirect('ver_carrito')
 
 
-@login_required
 def eliminar_del_carrito(request, item_id):
-    """Eliminar un item del carrito"""
+    """Eliminar un item del carrito (en el carrito anónimo item_id es la carta)"""
+    if not request.user.is_authenticated:
+        try:
+            actualizar_carta_sesion(request, item_id, 0)
+            messages.success(request, 'Carta eliminada del carrito')
+        except ValueError as e:
+            messages.error(request, str(e))
+        return redirect('ver_carrito')
+
     try:
         item = get_object_or_404(ItemPedido, id=item_id, pedido__cliente=request.user)
         carta_nombre = item.carta.nombre
@@ -231,11 +147,15 @@ def eliminar_del_carrito(request, item_id):
         return redirect('ver_carrito')
 
 
-@login_required
 def vaciar_carrito(request):
     """Vaciar completamente el carrito"""
+    if not request.user.is_authenticated:
+        vaciar_carrito_sesion(request)
+        messages.success(request, 'Carrito vaciado')
+        return redirect('ver_carrito')
+
     try:
-        carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+        carrito = obtener_carrito(request, crear=False)
         if carrito:
             carrito.items.all().delete()
             carrito.calcular_totales()
@@ -251,17 +171,17 @@ def vaciar_carrito(request):
 def checkout_view(request):
     """Vista de checkout para completar la compra"""
     try:
-        carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+        carrito = obtener_carrito(request, crear=False)
         
-        if not carrito or carrito.items.count() == 0:
+        # Ítems cargados una vez: stock, reserva y render usan la misma lista
+        if not carrito or not cargar_items(carrito).items.all():
             messages.warning(request, 'Tu carrito está vacío')
             return redirect('lista_cartas')
         
         # Verificar stock
-        for item in carrito.items.all():
-            if item.cantidad > item.inventario.stock_real:
-                messages.error(request, f'Stock insuficiente para {item.carta.nombre}')
-                return redirect('ver_carrito')
+        for item in items_sin_stock(carrito):
+            messages.error(request, f'Stock insuficiente para {item.carta.nombre}')
+            return redirect('ver_carrito')
         
         if request.method == 'POST':
             # Procesar información (usar nombres CORRECTOS de campos)
@@ -273,14 +193,20 @@ def checkout_view(request):
             carrito.provincia = request.POST.get('provincia')
             carrito.codigo_postal = request.POST.get('codigo_postal')
             carrito.pais = request.POST.get('pais', 'España')
-            carrito.metodo_pago = request.POST.get('metodo_pago')
             carrito.notas = request.POST.get('notas')
-            carrito.estado = 'PENDIENTE'  # Cambiar estado a pendiente
-            carrito.save()
-            
-            # Reservar stock
-            for item in carrito.items.all():
-                item.inventario.reservar(item.cantidad)
+            metodo_pago = request.POST.get('metodo_pago')
+            if metodo_pago not in dict(Pedido.METODOS_PAGO):
+                messages.error(request, 'Selecciona un método de pago válido')
+                return render(request, 'carrito/checkout.html', {'carrito': carrito}, status=400)
+            try:
+                with transaction.atomic():
+                    carrito.save()
+                    # Estado pendiente, reserva de stock y, con tarjeta o PayPal, cobro por la pasarela
+                    realizar_pedido(request, carrito, metodo_pago)
+            except StockInsuficiente as e:
+                # Otra compra se llevó las últimas unidades tras la comprobación de arriba
+                messages.error(request, str(e))
+                return redirect('ver_carrito')
             
             messages.success(request, '¡Pedido realizado con éxito!')
             return redirect('mis_pedidos')
@@ -296,14 +222,47 @@ def checkout_view(request):
 
 @login_required
 def mis_pedidos(request):
-    """Historial de pedidos del usuario"""
+    """Historial de pedidos del usuario, paginado por cursor (?cursor=<último id>)"""
     try:
-        pedidos = Pedido.objects.filter(
-            cliente=request.user
-        ).exclude(estado='CARRITO').order_by('-fecha_pedido')
+        historial = Pedido.objects.filter(cliente=request.user).exclude(estado='CARRITO')
+        
+        # Resumen por estado en una sola consulta
+        resumen = historial.aggregate(
+            pedidos=Count('id'),
+            entregados=Count('id', filter=Q(estado=ENTREGADO)),
+            pendientes=Count('id', filter=Q(estado=PENDIENTE)),
+            gastado=Sum('total', filter=Q(fecha_pago__isnull=False) & ~Q(estado=CANCELADO)),
+        )
+        
+        pedidos = historial.annotate(
+            num_items=Count('items'),
+            unidades=Coalesce(Sum('items__cantidad'), 0),
+        ).prefetch_related(
+            # Solo las dos primeras cartas de cada pedido (una consulta con ventana)
+            Prefetch(
+                'items',
+                queryset=ItemPedido.objects.select_related('carta').order_by('id')[:ITEMS_VISTA_PREVIA],
+                to_attr='items_vista_previa',
+            ),
+        ).order_by('-fecha_pedido', '-id')
+        
+        cursor = request.GET.get('cursor', '')
+        if cursor.isdigit():
+            # Keyset: los pedidos posteriores al último mostrado en (fecha_pedido, id)
+            fecha_cursor = Subquery(historial.filter(pk=cursor).values('fecha_pedido')[:1])
+            pedidos = pedidos.filter(
+                Q(fecha_pedido__lt=fecha_cursor) | Q(fecha_pedido=fecha_cursor, pk__lt=cursor)
+            )
+        
+        # Se pide un pedido de más para saber si hay página siguiente
+        pedidos = list(pedidos[:PEDIDOS_POR_PAGINA + 1])
+        siguiente = pedidos[PEDIDOS_POR_PAGINA - 1].pk if len(pedidos) > PEDIDOS_POR_PAGINA else None
         
         context = {
-            'pedidos': pedidos,
+            'pedidos': pedidos[:PEDIDOS_POR_PAGINA],
+            'resumen': resumen,
+            'cursor': cursor,
+            'siguiente': siguiente,
         }
         return render(request, 'carrito/historial.html', context)
         
@@ -316,11 +275,11 @@ def mis_pedidos(request):
 def detalle_pedido(request, pedido_id):
     """Detalle de un pedido específico"""
     try:
-        pedido = get_object_or_404(
+        pedido = cargar_items(get_object_or_404(
             Pedido,
             numero_pedido=pedido_id,
             cliente=request.user
-        )
+        ))
         
         context = {
             'pedido': pedido,
@@ -1,9 +1,18 @@
+import logging
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.db.models import Q
 from ..models import Carta, Categoria, Expansion, Coleccion, ColeccionCarta
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from ..cache_paginas import cache_pagina_anonima
+from ..etags import etag_filtrar_cartas, etag_autocompletar, etag_detalle_carta
+from ..visitas import contar_visita
 
+logger = logging.getLogger(__name__)
+
+@cache_pagina_anonima('catalogo')
 def home_view(request):
     """Vista principal/presentación del sitio - VERSIÓN CORREGIDA"""
     try:
@@ -52,55 +61,86 @@ def home_view(request):
     }
     return render(request, 'index.html', context)
 
+# Ordenaciones del listado; cualquier otro valor ordena por nombre
+ORDEN_LISTA = {
+    'precio_asc': 'precio_vigente',
+    'precio_desc': '-precio_vigente',
+    'nombre': 'nombre',
+    'nuevo': '-fecha_creacion',
+    'popularidad': '-popularidad',
+}
+
+def consulta_lista_cartas(request):
+    """Queryset (sin evaluar) y filtros activos del listado de cartas"""
+    # Obtener cartas con inventario
+    cartas = Carta.objects.filter(
+        coleccionable=True
+    ).select_related('expansion', 'inventario', 'categoria')
+    
+    # Aplicar filtros
+    tipo = request.GET.get('tipo')
+    rareza = request.GET.get('rareza')
+    expansion_id = request.GET.get('expansion')
+    categoria_id = request.GET.get('categoria')  # Nuevo filtro de categoría
+    query = request.GET.get('q', '')
+    
+    if query:
+        cartas = cartas.filter(
+            Q(nombre__icontains=query) |
+            Q(descripcion__icontains=query) |
+            Q(codigo__icontains=query)
+        )
+    
+    if tipo and tipo != 'all':
+        cartas = cartas.filter(Q(tipo=tipo) | Q(tipo_secundario=tipo))
+    
+    if rareza and rareza != 'all':
+        cartas = cartas.filter(rareza=rareza)
+    
+    if expansion_id and expansion_id != 'all':
+        cartas = cartas.filter(expansion_id=expansion_id)
+    
+    if categoria_id and categoria_id != 'all':  # Nuevo filtro
+        cartas = cartas.filter(categoria_id=categoria_id)
+    
+    en_stock = request.GET.get('en_stock') == '1'
+    if en_stock:
+        cartas = cartas.filter(stock_real__gt=0)
+    
+    # Ordenamiento
+    orden = request.GET.get('orden', 'nombre')
+    cartas = cartas.order_by(ORDEN_LISTA.get(orden, 'nombre'))
+    
+    filtros_activos = {
+        'tipo': tipo,
+        'rareza': rareza,
+        'expansion': expansion_id,
+        'categoria': categoria_id,  # Añadir al estado de filtros
+        'en_stock': en_stock,
+        'query': query,
+        'orden': orden,
+    }
+    return cartas, filtros_activos
+
+def contexto_lista_sin_filtros():
+    """
+    Contexto del listado cuando la consulta falla: las primeras cartas y un
+    aviso genérico (el detalle del error va al log, no a la página)
+    """
+    return {
+        'cartas': Carta.objects.filter(coleccionable=True)[:12],
+        'tipos': Carta.TIPOS_POKEMON,
+        'rarezas': Carta.RAREZAS,
+        'expansiones': Expansion.objects.filter(activa=True),
+        'categorias': Categoria.objects.all(),
+        'error': 'No se pudieron aplicar los filtros',
+    }
+
+@cache_pagina_anonima('catalogo')
 def lista_cartas(request):
     """Lista completa de cartas con filtros - VERSIÓN MEJORADA"""
     try:
-        # Obtener cartas con inventario
-        cartas = Carta.objects.filter(
-            coleccionable=True
-        ).select_related('expansion', 'inventario', 'categoria')
-        
-        # Aplicar filtros
-        tipo = request.GET.get('tipo')
-        rareza = request.GET.get('rareza')
-        expansion_id = request.GET.get('expansion')
-        categoria_id = request.GET.get('categoria')  # Nuevo filtro de categoría
-        query = request.GET.get('q', '')
-        
-        if query:
-            cartas = cartas.filter(
-                Q(nombre__icontains=query) |
-                Q(descripcion__icontains=query) |
-                Q(codigo__icontains=query)
-            )
-        
-        if tipo and tipo != 'all':
-            cartas = cartas.filter(Q(tipo=tipo) | Q(tipo_secundario=tipo))
-        
-        if rareza and rareza != 'all':
-            cartas = cartas.filter(rareza=rareza)
-        
-        if expansion_id and expansion_id != 'all':
-            cartas = cartas.filter(expansion_id=expansion_id)
-        
-        if categoria_id and categoria_id != 'all':  # Nuevo filtro
-            cartas = cartas.filter(categoria_id=categoria_id)
-        
-        # Ordenamiento
-        orden = request.GET.get('orden', 'nombre')
-        
-        if orden == 'precio_asc':
-            cartas = cartas.order_by('inventario__precio')
-        elif orden == 'precio_desc':
-            cartas = cartas.order_by('-inventario__precio')
-        elif orden == 'nombre':
-            cartas = cartas.order_by('nombre')
-        elif orden == 'nuevo':
-            cartas = cartas.order_by('-fecha_creacion')
-        elif orden == 'popularidad':
-            cartas = cartas.order_by('-popularidad')
-        else:
-            cartas = cartas.order_by('nombre')
+        cartas, filtros_activos = consulta_lista_cartas(request)
         
         # Paginación
         from django.core.paginator import Paginator
@@ -120,30 +160,18 @@ def lista_cartas(request):
             'rarezas': rarezas,
             'expansiones': expansiones,
             'categorias': categorias,  # Añadir al contexto
-            'filtros_activos': {
-                'tipo': tipo,
-                'rareza': rareza,
-                'expansion': expansion_id,
-                'categoria': categoria_id,  # Añadir al estado de filtros
-                'query': query,
-                'orden': orden,
-            }
+            'filtros_activos': filtros_activos,
         }
         return render(request, 'cartas/lista.html', context)
         
-    except Exception as e:
-        # En caso de error, mostrar cartas básicas
-        cartas = Carta.objects.filter(coleccionable=True)[:12]
-        context = {
-            'cartas': cartas,
-            'tipos': Carta.TIPOS_POKEMON,
-            'rarezas': Carta.RAREZAS,
-            'expansiones': Expansion.objects.filter(activa=True),
-            'categorias': Categoria.objects.all(),  # Añadir también aquí
-            'error': str(e)
-        }
-        return render(request, 'cartas/lista.html', context)
+    except Exception:
+        logger.exception('Error en el listado de cartas')
+        return render(request, 'cartas/lista.html', contexto_lista_sin_filtros())
 
+# La popularidad se cuenta por fuera de la cache y de los ETags (core/visitas.py)
+@contar_visita
+@cache_pagina_anonima()
+@condition(etag_func=etag_detalle_carta)
 def detalle_carta(request, carta_id):
     """Vista detallada de una carta"""
     carta = get_object_or_404(
@@ -151,10 +179,6 @@ def detalle_carta(request, carta_id):
         id=carta_id
     )
     
-    # Incrementar popularidad
-    if hasattr(carta, 'inventario'):
-        carta.inventario.save()
-    
     # Cartas relacionadas
     cartas_relacionadas = Carta.objects.filter(
         Q(expansion=carta.expansion) | Q(tipo=carta.tipo) | Q(rareza=carta.rareza)
@@ -168,8 +192,12 @@ def detalle_carta(request, carta_id):
         'cartas_relacionadas': cartas_relacionadas,
         'resenas': reseñas,
     }
-    return render(request, 'cartas/detalle.html', context)
+    response = render(request, 'cartas/detalle.html', context)
+    response.etiquetas_cache = [f'carta:{carta.id}', f'expansion:{carta.expansion_id}']
+    return response
 
+@vary_on_headers('X-Requested-With')
+@condition(etag_func=etag_filtrar_cartas)
 def filtrar_cartas(request):
     """Vista para filtrar cartas (AJAX o normal) - VERSIÓN CORREGIDA"""
     # Obtener parámetros de filtro
@@ -207,26 +235,29 @@ def filtrar_cartas(request):
     if categoria_id and categoria_id != 'all':
         cartas = cartas.filter(categoria_id=categoria_id)
     
+    if request.GET.get('en_stock') == '1':
+        cartas = cartas.filter(stock_real__gt=0)
+    
     # Filtrar por precio si existe
     if precio_min:
         try:
             precio_min_val = float(precio_min)
-            cartas = cartas.filter(inventario__precio__gte=precio_min_val)
+            cartas = cartas.filter(precio_vigente__gte=precio_min_val)
         except ValueError:
             pass
     
     if precio_max:
         try:
             precio_max_val = float(precio_max)
-            cartas = cartas.filter(inventario__precio__lte=precio_max_val)
+            cartas = cartas.filter(precio_vigente__lte=precio_max_val)
         except ValueError:
             pass
     
     # Ordenamiento
     orden_map = {
         'nombre': 'nombre',
-        'precio_asc': 'inventario__precio',
-        'precio_desc': '-inventario__precio',
+        'precio_asc': 'precio_vigente',
+        'precio_desc': '-precio_vigente',
         'nuevo': '-fecha_creacion',
         'popularidad': '-popularidad',
         'rareza': 'rareza',
@@ -284,6 +315,7 @@ def filtrar_cartas(request):
             'categoria': categoria_id,
             'precio_min': precio_min,
             'precio_max': precio_max,
+            'en_stock': request.GET.get('en_stock') == '1',
             'orden': orden,
             'query': query,
         },
@@ -293,6 +325,31 @@ def filtrar_cartas(request):
     # Renderizar el template de búsqueda
     return render(request, 'cartas/buscar.html', context)
 
+@condition(etag_func=etag_autocompletar)
+def autocompletar_cartas(request):
+    """Sugerencias de cartas para el buscador (JSON)"""
+    query = request.GET.get('q', '').strip()
+    
+    if len(query) < 2:
+        return JsonResponse({'resultados': []})
+    
+    cartas = Carta.objects.filter(
+        coleccionable=True
+    ).filter(
+        Q(nombre__icontains=query) | Q(codigo__icontains=query)
+    ).order_by('-popularidad').values('id', 'nombre', 'codigo')[:10]
+    
+    resultados = [
+        {
+            'id': carta['id'],
+            'nombre': carta['nombre'],
+            'codigo': carta['codigo'],
+            'url': f"/cartas/{carta['id']}/",
+        }
+        for carta in cartas
+    ]
+    return JsonResponse({'resultados': resultados})
+
 @login_required
 def wishlist_view(request):
     """Vista de la wishlist del usuario"""
@@ -422,12 +479,15 @@ def buscar_cartas(request):
     if categoria_id and categoria_id != 'all':
         cartas = cartas.filter(categoria_id=categoria_id)
     
+    if request.GET.get('en_stock') == '1':
+        cartas = cartas.filter(stock_real__gt=0)
+    
     # Ordenamiento
     orden = request.GET.get('orden', 'nombre')
     orden_map = {
         'nombre': 'nombre',
-        'precio_asc': 'inventario__precio',
-        'precio_desc': '-inventario__precio',
+        'precio_asc': 'precio_vigente',
+        'precio_desc': '-precio_vigente',
         'nuevo': '-fecha_creacion',
         'popularidad': '-popularidad',
         'rareza': 'rareza',
@@ -460,6 +520,7 @@ def buscar_cartas(request):
             'rareza': rareza,
             'expansion': expansion_id,
             'categoria': categoria_id,
+            'en_stock': request.GET.get('en_stock') == '1',
             'orden': orden,
             'query': query,
         },
@@ -0,0 +1,173 @@
+# core/views/catalogo_async_views.py
+"""
+Versiones async de las vistas de lectura del catálogo (portada, listado,
+detalle y autocompletado) para el despliegue ASGI (ver pokemon_tcg/asgi.py).
+
+Los métodos async del ORM de Django 4.2 (aget, acount, async for...) pasan
+todos por el mismo hilo síncrono, así que juntarlos con asyncio.gather no
+solapa nada. ``en_paralelo`` lanza las consultas independientes en el pool
+de hilos (thread_sensitive=False), cada una con su conexión, y espera a
+todas. El render sigue siendo síncrono (los context processors consultan la
+base de datos) y se hace con sync_to_async.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+
+from ..cache_paginas import cache_pagina_anonima
+from ..etags import condicion_async, etag_autocompletar, etag_detalle_carta
+from ..models import Carta, Categoria, Expansion
+from ..visitas import contar_visita
+from .carta_views import consulta_lista_cartas, contexto_lista_sin_filtros
+
+logger = logging.getLogger(__name__)
+
+
+def _en_hilo(consulta):
+    # Mismo ciclo de conexión que una petición WSGI: las conexiones caducadas
+    # o rotas del hilo se cierran (y con el pool vuelven a él)
+    close_old_connections()
+    try:
+        return consulta()
+    finally:
+        close_old_connections()
+
+
+async def en_paralelo(*consultas):
+    """Ejecuta a la vez funciones síncronas sin argumentos y devuelve sus resultados en orden"""
+    return await asyncio.gather(*(
+        sync_to_async(_en_hilo, thread_sensitive=False)(consulta) for consulta in consultas
+    ))
+
+
+async def _render(request, plantilla, context):
+    return await sync_to_async(render)(request, plantilla, context)
+
+
+@cache_pagina_anonima('catalogo')
+async def home_view(request):
+    """Vista principal con las consultas de la portada lanzadas a la vez"""
+    catalogo = Carta.objects.filter(coleccionable=True)
+    con_inventario = catalogo.select_related('inventario', 'expansion')
+    try:
+        (cartas_destacadas, nuevas_cartas, cartas_oferta,
+         total_cartas, total_expansiones, categorias_menu) = await en_paralelo(
+            lambda: list(con_inventario.order_by('-popularidad')[:6]),
+            lambda: list(con_inventario.order_by('-fecha_creacion')[:4]),
+            lambda: list(con_inventario.filter(inventario__en_promocion=True)[:3]),
+            catalogo.count,
+            Expansion.objects.filter(activa=True).count,
+            lambda: list(Categoria.objects.all()[:10]),
+        )
+        # Las categorías de la portada son las primeras del menú
+        categorias = categorias_menu[:6]
+    except Exception:
+        cartas_destacadas = []
+        nuevas_cartas = []
+        cartas_oferta = []
+        total_cartas = 0
+        total_expansiones = 0
+        categorias = []
+        categorias_menu = []
+
+    context = {
+        'cartas_destacadas': cartas_destacadas,
+        'nuevas_cartas': nuevas_cartas,
+        'cartas_oferta': cartas_oferta,
+        'total_cartas': total_cartas,
+        'total_expansiones': total_expansiones,
+        'categorias': categorias,
+        'categorias_menu': categorias_menu,
+    }
+    return await _render(request, 'index.html', context)
+
+
+@cache_pagina_anonima('catalogo')
+async def lista_cartas(request):
+    """Listado de cartas: página, expansiones y categorías a la vez"""
+    try:
+        cartas, filtros_activos = consulta_lista_cartas(request)
+        paginator = Paginator(cartas, 12)
+
+        def pagina():
+            page_obj = paginator.get_page(request.GET.get('page'))
+            page_obj.object_list = list(page_obj.object_list)
+            return page_obj
+
+        page_obj, expansiones, categorias = await en_paralelo(
+            pagina,
+            lambda: list(Expansion.objects.filter(activa=True)),
+            lambda: list(Categoria.objects.all()),
+        )
+        context = {
+            'cartas': page_obj,
+            'tipos': Carta.TIPOS_POKEMON,
+            'rarezas': Carta.RAREZAS,
+            'expansiones': expansiones,
+            'categorias': categorias,
+            'filtros_activos': filtros_activos,
+        }
+    except Exception:
+        # Como la vista síncrona: cartas básicas (se evalúan al renderizar) y el error al log
+        logger.exception('Error en el listado de cartas')
+        context = contexto_lista_sin_filtros()
+    return await _render(request, 'cartas/lista.html', context)
+
+
+@contar_visita
+@cache_pagina_anonima()
+@condicion_async(etag_func=etag_detalle_carta)
+async def detalle_carta(request, carta_id):
+    """Detalle de una carta: relacionadas y reseñas a la vez (la visita la cuenta contar_visita)"""
+    try:
+        carta = await Carta.objects.select_related('expansion', 'inventario', 'categoria').aget(id=carta_id)
+    except Carta.DoesNotExist:
+        raise Http404('No existe la carta')
+
+    cartas_relacionadas, reseñas = await en_paralelo(
+        lambda: list(Carta.objects.filter(
+            Q(expansion=carta.expansion) | Q(tipo=carta.tipo) | Q(rareza=carta.rareza)
+        ).exclude(id=carta.id)[:4]),
+        lambda: list(carta.resenas.filter(aprobada=True)[:5]),
+    )
+
+    context = {
+        'carta': carta,
+        'cartas_relacionadas': cartas_relacionadas,
+        'resenas': reseñas,
+    }
+    response = await _render(request, 'cartas/detalle.html', context)
+    response.etiquetas_cache = [f'carta:{carta.id}', f'expansion:{carta.expansion_id}']
+    return response
+
+
+@condicion_async(etag_func=etag_autocompletar)
+async def autocompletar_cartas(request):
+    """Sugerencias de cartas para el buscador (JSON)"""
+    query = request.GET.get('q', '').strip()
+
+    if len(query) < 2:
+        return JsonResponse({'resultados': []})
+
+    cartas = Carta.objects.filter(
+        coleccionable=True
+    ).filter(
+        Q(nombre__icontains=query) | Q(codigo__icontains=query)
+    ).order_by('-popularidad').values('id', 'nombre', 'codigo')[:10]
+
+    resultados = [
+        {
+            'id': carta['id'],
+            'nombre': carta['nombre'],
+            'codigo': carta['codigo'],
+            'url': f"/cartas/{carta['id']}/",
+        }
+        async for carta in cartas
+    ]
+    return JsonResponse({'resultados': resultados})
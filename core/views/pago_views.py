@@ -1,31 +1,56 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.utils import timezone
-import uuid
-from ..models import Pedido
+from django.db import transaction
+from ..models import Pedido, Inventario, StockInsuficiente
+from ..carrito import obtener_carrito, cerrar_carrito, cargar_items
 from ..forms import PagoTarjetaForm
+from ..idempotencia import completado, idempotente
+from ..pasarela import METODOS_PASARELA, WebhookInvalido, obtener_pasarela
+from ..pedidos import transicionar, PENDIENTE, PAGADO, CANCELADO
 import json
 from django.http import HttpResponseRedirect, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+def realizar_pedido(request, carrito, metodo):
+    """
+    Cierra el carrito como pedido PENDIENTE: estado, reserva de stock y
+    evento del outbox en la misma transacción. Tarjeta y PayPal se cobran
+    después (core/pasarela.py): el worker del outbox pide el cobro y el
+    webhook lo confirma, así que la petición no espera a la pasarela.
+    Lanza StockInsuficiente (sin cambiar nada) si otra compra se llevó las
+    últimas unidades
+    """
+    carrito.metodo_pago = metodo
+    if metodo in METODOS_PASARELA:
+        carrito.transaccion_id = obtener_pasarela().nueva_transaccion(carrito)
+    with transaction.atomic():
+        carrito.save(update_fields=['metodo_pago', 'transaccion_id'])
+        transicionar([carrito.pk], PENDIENTE, metodo_pago=metodo, pasarela=bool(carrito.transaccion_id))
+    carrito.estado = PENDIENTE
+    cerrar_carrito(request)
 
 @login_required
+@idempotente
 def pago_efectivo(request):
     """Formulario de pago en efectivo"""
-    carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+    carrito = obtener_carrito(request, crear=False)
     
-    if not carrito or carrito.items.count() == 0:
+    if not carrito or not cargar_items(carrito).items.all():
         messages.warning(request, 'Tu carrito está vacío')
         return redirect('lista_cartas')
     
     if request.method == 'POST':
         # Confirmar pago en efectivo
-        carrito.estado = 'PEND'
-        carrito.metodo_pago = 'EFEC'
-        carrito.fecha_pago = timezone.now()
-        carrito.save()
+        try:
+            realizar_pedido(request, carrito, 'EFECTIVO')
+        except StockInsuficiente as e:
+            messages.error(request, str(e))
+            return redirect('ver_carrito')
         
         messages.success(request, '¡Pedido confirmado! Deberás pagar en efectivo al recibir tu pedido.')
-        return redirect('detalle_pedido', pedido_id=carrito.numero_pedido)
+        return completado(redirect('detalle_pedido', pedido_id=carrito.numero_pedido))
     
     context = {
         'carrito': carrito,
@@ -33,11 +58,12 @@ def pago_efectivo(request):
     return render(request, 'pagos/efectivo.html', context)
 
 @login_required
+@idempotente
 def pago_tarjeta(request):
     """Formulario de pago con tarjeta"""
-    carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+    carrito = obtener_carrito(request, crear=False)
     
-    if not carrito or carrito.items.count() == 0:
+    if not carrito or not cargar_items(carrito).items.all():
         messages.warning(request, 'Tu carrito está vacío')
         return redirect('lista_cartas')
     
@@ -46,16 +72,15 @@ def pago_tarjeta(request):
     if request.method == 'POST':
         form = PagoTarjetaForm(request.POST)
         if form.is_valid():
-            # Aquí iría la integración con pasarela de pago real
-            # Por ahora simulamos el pago exitoso
-            carrito.estado = 'PEND'
-            carrito.metodo_pago = 'TARJ'
-            carrito.fecha_pago = timezone.now()
-            carrito.transaccion_id = f"TARJ_{uuid.uuid4().hex[:16].upper()}"
-            carrito.save()
+            # El cobro lo confirma la pasarela por el webhook
+            try:
+                realizar_pedido(request, carrito, 'TARJETA')
+            except StockInsuficiente as e:
+                messages.error(request, str(e))
+                return redirect('ver_carrito')
             
-            messages.success(request, '¡Pago con tarjeta procesado exitosamente!')
-            return redirect('detalle_pedido', pedido_id=carrito.numero_pedido)
+            messages.success(request, 'Pedido realizado. Estamos procesando el pago con tarjeta; te avisaremos al confirmarse.')
+            return completado(redirect('detalle_pedido', pedido_id=carrito.numero_pedido))
     
     context = {
         'carrito': carrito,
@@ -64,24 +89,25 @@ def pago_tarjeta(request):
     return render(request, 'pagos/tarjeta.html', context)
 
 @login_required
+@idempotente
 def pago_paypal(request):
     """Simulación de pago con PayPal"""
-    carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+    carrito = obtener_carrito(request, crear=False)
     
-    if not carrito or carrito.items.count() == 0:
+    if not carrito or not cargar_items(carrito).items.all():
         messages.warning(request, 'Tu carrito está vacío')
         return redirect('lista_cartas')
     
     if request.method == 'POST':
-        # Simular procesamiento de PayPal
-        carrito.estado = 'PEND'
-        carrito.metodo_pago = 'PAYP'
-        carrito.fecha_pago = timezone.now()
-        carrito.transaccion_id = f"PAYP_{uuid.uuid4().hex[:16].upper()}"
-        carrito.save()
+        # El cobro lo confirma la pasarela por el webhook
+        try:
+            realizar_pedido(request, carrito, 'PAYPAL')
+        except StockInsuficiente as e:
+            messages.error(request, str(e))
+            return redirect('ver_carrito')
         
-        messages.success(request, '¡Pago con PayPal procesado exitosamente!')
-        return redirect('detalle_pedido', pedido_id=carrito.numero_pedido)
+        messages.success(request, 'Pedido realizado. Estamos procesando el pago con PayPal; te avisaremos al confirmarse.')
+        return completado(redirect('detalle_pedido', pedido_id=carrito.numero_pedido))
     
     context = {
         'carrito': carrito,
@@ -89,23 +115,26 @@ def pago_paypal(request):
     return render(request, 'pagos/paypal.html', context)
 
 @login_required
+@idempotente
 def pago_transferencia(request):
     """Información para pago por transferencia bancaria"""
-    carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+    carrito = obtener_carrito(request, crear=False)
     
-    if not carrito or carrito.items.count() == 0:
+    if not carrito or not cargar_items(carrito).items.all():
         messages.warning(request, 'Tu carrito está vacío')
         return redirect('lista_cartas')
     
     if request.method == 'POST':
         # Confirmar que se realizará transferencia
-        carrito.estado = 'PEND'
-        carrito.metodo_pago = 'TRANS'
-        # No marcamos como pagado hasta confirmar la transferencia
-        carrito.save()
+        # No se marca como pagado hasta que el staff confirme la transferencia
+        try:
+            realizar_pedido(request, carrito, 'TRANSFERENCIA')
+        except StockInsuficiente as e:
+            messages.error(request, str(e))
+            return redirect('ver_carrito')
         
         messages.success(request, '¡Pedido confirmado! Por favor realiza la transferencia bancaria.')
-        return redirect('detalle_pedido', pedido_id=carrito.numero_pedido)
+        return completado(redirect('detalle_pedido', pedido_id=carrito.numero_pedido))
     
     # Datos bancarios (en producción deberían estar en settings)
     datos_bancarios = {
@@ -123,26 +152,51 @@ def pago_transferencia(request):
     return render(request, 'pagos/transferencia.html', context)
 
 @login_required
+@require_POST
+@idempotente
 def procesar_pago(request, metodo):
-    """Endpoint para procesar pagos (simulación)"""
-    carrito = Pedido.objects.filter(cliente=request.user, estado='CARRITO').first()
+    """Endpoint para realizar el pedido con un método de pago; admite la cabecera Idempotency-Key"""
+    carrito = obtener_carrito(request, crear=False)
     
     if not carrito:
-        return JsonResponse({'success': False, 'message': 'Carrito no encontrado'})
-    
-    # Simular procesamiento de pago
-    carrito.estado = 'PEND'
-    carrito.metodo_pago = metodo
+        return JsonResponse({'success': False, 'message': 'Carrito no encontrado'}, status=404)
     
+    metodo = metodo.upper()
+    if metodo not in dict(Pedido.METODOS_PAGO):
+        return JsonResponse({'success': False, 'message': 'Método de pago no válido'}, status=400)
     
+    try:
+        realizar_pedido(request, carrito, metodo)
+    except StockInsuficiente as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=409)
     
-    
-    carrito.fecha_pago = timezone.now()
-    carrito.transaccion_id = f"{metodo}_{uuid.uuid4().hex[:16].upper()}"
-    carrito.save()
-    
+    # Responde sin esperar a la pasarela: el estado cambia cuando llega el webhook
     return JsonResponse({
         'success': True,
-        'message': 'Pago procesado exitosamente',
-        'pedido_id': str(carrito.numero_pedido)
-    })
\ No newline at end of file
+        'message': 'Pedido realizado, pago pendiente de confirmación',
+        'pedido_id': str(carrito.numero_pedido),
+        'estado': carrito.estado,
+        'transaccion_id': carrito.transaccion_id,
+    })
+
+@csrf_exempt
+@require_POST
+def webhook_pasarela(request):
+    """Resultado del cobro enviado por la pasarela: el pedido pasa a PAGADO o CANCELADO"""
+    try:
+        transaccion_id, aprobado, motivo = obtener_pasarela().leer_webhook(request)
+    except WebhookInvalido as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    
+    pedido_id = Pedido.objects.filter(
+        transaccion_id=transaccion_id
+    ).values_list('pk', flat=True).first()
+    if pedido_id is None:
+        return JsonResponse({'ok': False, 'error': 'Transacción desconocida'}, status=404)
+    
+    # Las notificaciones repetidas no cambian nada: el pedido ya no está pendiente
+    if aprobado:
+        transicionar([pedido_id], PAGADO, transaccion_id=transaccion_id)
+    else:
+        transicionar([pedido_id], CANCELADO, desde=[PENDIENTE], transaccion_id=transaccion_id, motivo=motivo)
+    return JsonResponse({'ok': True})
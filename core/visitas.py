@@ -0,0 +1,47 @@
+# core/visitas.py
+"""
+Popularidad por visitas al detalle de una carta.
+
+``contar_visita`` envuelve la vista por fuera de la cache de páginas y de los
+ETags: una visita cuenta igual si la página sale de la cache (HIT), si el
+navegador recibe un 304 o si se genera de nuevo. Es un UPDATE directo de una
+fila, sin señales (no invalida la cache de la carta), con el hint
+``fijar_primaria=False`` para que no fije la petición a la primaria
+(core/routers.py).
+"""
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db.models import F
+
+from .models import Carta
+
+# Respuestas que son una visita (no los 404 de cartas que no existen)
+ESTADOS_VISITA = {200, 304}
+
+
+def sumar_visita(carta_id):
+    """Suma un punto de popularidad a la carta"""
+    return Carta.objects.db_manager(hints={'fijar_primaria': False}).filter(pk=carta_id).update(
+        popularidad=F('popularidad') + 1
+    )
+
+
+def contar_visita(view_func):
+    """Decorador para vistas con ``carta_id``; admite vistas síncronas y async"""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view_async(request, carta_id, *args, **kwargs):
+            response = await view_func(request, carta_id, *args, **kwargs)
+            if response.status_code in ESTADOS_VISITA:
+                await sync_to_async(sumar_visita)(carta_id)
+            return response
+        return _wrapped_view_async
+
+    @wraps(view_func)
+    def _wrapped_view(request, carta_id, *args, **kwargs):
+        response = view_func(request, carta_id, *args, **kwargs)
+        if response.status_code in ESTADOS_VISITA:
+            sumar_visita(carta_id)
+        return response
+    return _wrapped_view
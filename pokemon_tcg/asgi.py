@@ -3,6 +3,24 @@ ASGI config for pokemon_tcg project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Despliegue con uvicorn (pip install uvicorn):
+
+    DEBUG=False DB_PERFIL=postgres_pool \
+    uvicorn pokemon_tcg.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers 4 --backlog 2048 --no-access-log
+
+Servido por ASGI, VISTAS_ASYNC es True salvo que se indique otra cosa: la
+portada, el listado, el detalle y el autocompletado usan las vistas async
+de core/views/catalogo_async_views.py, que lanzan sus consultas a la vez en
+el pool de hilos del event loop (min(32, CPUs + 4) hilos por proceso). El
+resto de vistas son síncronas y Django ejecuta cada petición en un hilo
+propio. Cada hilo mantiene su propia conexión: con PostgreSQL hay que
+dimensionar DB_POOL_MAX (por proceso, con postgres_pool) para las peticiones
+simultáneas más los hilos del pool. Conviene un worker por CPU. Los
+estáticos los sirve el proxy (collectstatic), igual que con WSGI.
+
+Comparación con WSGI (gunicorn + gthread): manage.py benchmark_asgi.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -12,5 +30,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pokemon_tcg.settings')
+os.environ.setdefault('VISTAS_ASYNC', 'True')
 
 application = get_asgi_application()
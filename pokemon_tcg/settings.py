@@ -5,6 +5,8 @@ Django settings for pokemon_tcg project.
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('DJANGO_SECRET_KEY', 'django-insecure-your-secret-key-here')
@@ -51,6 +53,7 @@ TEMPLATES = [
                 'core.context_processors.carrito_context',
                 'core.context_processors.categorias_context',
                 'core.context_processors.categorias_menu',
+                'core.context_processors.csrf_cache_pagina',
             ],
         },
     },
@@ -58,12 +61,102 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'pokemon_tcg.wsgi.application'
 
-DATABASES = {
+# Vistas async de lectura del catálogo (core/views/catalogo_async_views.py).
+# pokemon_tcg/asgi.py las activa por defecto; con WSGI se sirven las síncronas.
+VISTAS_ASYNC = os.getenv('VISTAS_ASYNC', 'False') == 'True'
+
+# Perfil de base de datos (DB_PERFIL):
+#   sqlite         desarrollo, fichero db.sqlite3
+#   postgres       PostgreSQL con conexiones persistentes (DB_CONN_MAX_AGE)
+#   postgres_pool  PostgreSQL con pool de conexiones de psycopg
+#                  (core/backends/postgresql_pool; requiere psycopg y psycopg-pool)
+# En todos se comprueba que una conexión reutilizada siga viva.
+DB_PERFIL = os.getenv('DB_PERFIL', 'sqlite')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))  # segundos
+
+if DB_PERFIL == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # Base de tests en fichero (p. ej. /tmp/test.sqlite3) para las pruebas
+            # con varios hilos; por defecto, en memoria
+            'TEST': {'NAME': os.getenv('SQLITE_TEST_NAME') or None},
+        }
+    }
+
+    # SQLite ajustado para concurrencia (WAL, PRAGMA y BEGIN IMMEDIATE; ver
+    # core/backends/sqlite3/base.py). SQLITE_TIMEOUT: segundos de espera por el
+    # bloqueo de escritura antes de "database is locked".
+    if os.getenv('SQLITE_AJUSTADO', 'True') == 'True':
+        DATABASES['default']['ENGINE'] = 'core.backends.sqlite3'
+        DATABASES['default']['OPTIONS'] = {
+            'timeout': float(os.getenv('SQLITE_TIMEOUT', '20')),
+        }
+elif DB_PERFIL in ('postgres', 'postgres_pool'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'pokemon_tcg'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if DB_PERFIL == 'postgres_pool':
+        # Las conexiones vuelven al pool al final de cada petición
+        DATABASES['default']['ENGINE'] = 'core.backends.postgresql_pool'
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN', '2')),
+                'max_size': int(os.getenv('DB_POOL_MAX', '10')),
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+            },
+        }
+else:
+    raise ImproperlyConfigured(f'DB_PERFIL desconocido: {DB_PERFIL}')
+
+# Réplica de lectura para el catálogo (ver core/routers.py). Con SQLite es
+# otro fichero que se mantiene con "manage.py sincronizar_replica"; con
+# PostgreSQL, el servidor en espera (DB_REPLICA_HOST).
+if os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    if os.getenv('DB_REPLICA_HOST'):
+        DATABASES['replica']['HOST'] = os.getenv('DB_REPLICA_HOST')
+    DATABASE_ROUTERS = ['core.routers.RouterReplica']
+    MIDDLEWARE.append('core.routers.FijarPrimariaMiddleware')
+    REPLICA_SEGUNDOS_PRIMARIA = int(os.getenv('REPLICA_SEGUNDOS_PRIMARIA', '5'))
+
+# Cache (páginas anónimas del catálogo y versiones de etiquetas)
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'pokemon-tcg'),
     }
 }
+CACHE_PAGINAS_TIMEOUT = int(os.getenv('CACHE_PAGINAS_TIMEOUT', '300'))  # segundos
+
+# Total de los listados del panel (core/paginacion.py): segundos en cache y,
+# en PostgreSQL, filas a partir de las que se usa la estimación del planificador
+CONTEO_CACHE_TIMEOUT = int(os.getenv('CONTEO_CACHE_TIMEOUT', '60'))
+CONTEO_ESTIMADO_DESDE = int(os.getenv('CONTEO_ESTIMADO_DESDE', '100000'))
+
+# Cache propia de las sesiones (modo cached_db): en memoria del proceso o en
+# disco (django.core.cache.backends.filebased.FileBasedCache + ruta)
+CACHES['sesiones'] = {
+    'BACKEND': os.getenv('SESSION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+    'LOCATION': os.getenv('SESSION_CACHE_LOCATION', 'pokemon-tcg-sesiones'),
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -106,9 +199,53 @@ LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
 # Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# SESSION_MODO: db (una consulta por petición), cached_db (lectura desde la
+# cache 'sesiones', escritura también en la base de datos) o signed_cookies
+# (sin estado en el servidor; la sesión viaja firmada en la cookie)
+MOTORES_SESION = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODO = os.getenv('SESSION_MODO', 'db')
+if SESSION_MODO not in MOTORES_SESION:
+    raise ImproperlyConfigured(
+        f'SESSION_MODO desconocido: {SESSION_MODO} (opciones: {", ".join(MOTORES_SESION)})'
+    )
+SESSION_ENGINE = MOTORES_SESION[SESSION_MODO]
+SESSION_CACHE_ALIAS = 'sesiones'
 SESSION_COOKIE_AGE = 1209600  # 2 semanas
 CART_SESSION_ID = 'cart'
+CARRITO_SESSION_ID = 'carrito_id'
 
 # Email settings (para producción)
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'pedidos@pokemon-tcg.local')
+
+# Outbox de eventos de pedidos (core/outbox.py, manage.py procesar_outbox):
+# reintentos antes de dar un evento por fallido y segundos que un worker
+# retiene un lote antes de que otro pueda volver a tomarlo
+OUTBOX_MAX_INTENTOS = int(os.getenv('OUTBOX_MAX_INTENTOS', '8'))
+OUTBOX_SEGUNDOS_BLOQUEO = int(os.getenv('OUTBOX_SEGUNDOS_BLOQUEO', '60'))
+
+# Claves de idempotencia de los pagos (core/idempotencia.py): horas durante
+# las que un reenvío con la misma clave recibe la respuesta guardada
+IDEMPOTENCIA_HORAS = int(os.getenv('IDEMPOTENCIA_HORAS', '24'))
+
+# Acciones masivas del admin (core/acciones_masivas.py): filas por bloque,
+# selección máxima que se hace en la petición (más va a una TareaMasiva para
+# manage.py procesar_tareas) y segundos sin avance tras los que otro worker
+# retoma una tarea en curso
+ACCIONES_TAMANO_BLOQUE = int(os.getenv('ACCIONES_TAMANO_BLOQUE', '1000'))
+ACCIONES_MAX_SINCRONO = int(os.getenv('ACCIONES_MAX_SINCRONO', '2000'))
+ACCIONES_SEGUNDOS_BLOQUEO = int(os.getenv('ACCIONES_SEGUNDOS_BLOQUEO', '300'))
+
+# Pasarela de pagos (core/pasarela.py). Por defecto, el simulador local:
+#   python manage.py simulador_pasarela --latencia-max 3 --rechazos 0.1
+# El worker del outbox pide los cobros a PASARELA_URL y la pasarela confirma
+# llamando a PASARELA_WEBHOOK_URL con el cuerpo firmado con PASARELA_SECRETO
+PASARELA_PAGOS = os.getenv('PASARELA_PAGOS', 'core.pasarela.PasarelaSimulada')
+PASARELA_URL = os.getenv('PASARELA_URL', 'http://127.0.0.1:8765')
+PASARELA_WEBHOOK_URL = os.getenv('PASARELA_WEBHOOK_URL', 'http://127.0.0.1:8000/pago/webhook/')
+PASARELA_SECRETO = os.getenv('PASARELA_SECRETO', 'simulador-local')
+PASARELA_TIMEOUT = float(os.getenv('PASARELA_TIMEOUT', '5'))  # segundos
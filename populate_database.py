@@ -690,7 +690,7 @@ class DatabasePopulator:
             # Pedido 1: Ash
             pedido1 = Pedido.objects.create(
                 cliente=ash,
-                estado='ENTR',
+                estado='ENTREGADO',
                 nombre_completo='Ash Ketchum',
                 email='ash@pokemon.com',
                 telefono='+34 600 111 222',
@@ -730,7 +730,7 @@ class DatabasePopulator:
             # Pedido 2: Misty
             pedido2 = Pedido.objects.create(
                 cliente=misty,
-                estado='ENVI',
+                estado='ENVIADO',
                 nombre_completo='Misty',
                 email='misty@pokemon.com',
                 telefono='+34 600 333 444',